@@ -0,0 +1,109 @@
+"""
+Answer queries from asyncio, so that a single process can wait on the
+network for thousands of queries at once. Requires Python 3.7 or later,
+where each task has deadlines of its own (see ``lib.deadline``): before
+that, the tasks of a loop would share those of its thread.
+
+.. code-block:: python
+
+    import lib.wizard
+
+    wizard = lib.wizard.Wizard()
+    answers = await asyncio.gather(*[
+        wizard.aask(query) for query in queries
+    ])
+
+Spells can define ``async def aincantation`` and fetch with
+``await self.afetch(...)``; the others are run in the event loop's
+default executor (see ``lib.spell.BaseSpell.aincantation``).
+"""
+import copy
+import time
+import asyncio
+
+import lib.deadline
+import lib.answercache
+import lib.wizard
+
+if lib.deadline.contextvars is None:
+    raise ImportError('lib.aio requires Python 3.7 or later')
+
+
+async def ask(query, dispatcher, config, store, deadline=None, speculate=1):
+    """
+    Same as ``lib.wizard.ask``, for asyncio: with ``speculate``, the spells
+    tried at the same time are tasks, and the losers are cancelled, along
+    with their deadlines, before the answer is returned
+
+    :rtype: ``lib.wizard.Answer``
+    """
+    start = time.time()
+    timings = []
+    limit = lib.deadline.Deadline(deadline)
+    tried = []
+    candidates = dispatcher.candidates(query)
+    while True:
+        batch = lib.wizard._batch(candidates, tried, config, limit,
+                                  speculate)
+        if not batch:
+            break
+        deadlines = [limit.split() for candidate in batch]
+        tasks = [
+            asyncio.ensure_future(_attempt(candidate, config, store, share))
+            for candidate, share in zip(batch, deadlines)
+        ]
+        try:
+            # Wait for the better spells first: the best answer wins
+            for candidate, task in zip(batch, tasks):
+                result, state, elapsed = await task
+                name = candidate.spell.__class__.__name__
+                timings.append((name, elapsed))
+                if result is not None:
+                    store[name] = state
+                    return lib.wizard.Answer(
+                        query, result, name, candidate.score,
+                        time.time() - start, timings
+                    )
+        finally:
+            for share, task in zip(deadlines, tasks):
+                if not task.done():
+                    # The executor's thread stops at its next request
+                    share.cancel()
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    return lib.wizard._fallback(query, tried, config, store, start, timings)
+
+
+async def _attempt(candidate, config, store, deadline):
+    """ Same as ``lib.wizard._attempt``, for asyncio """
+    spell = candidate.spell
+    name = spell.__class__.__name__
+    before = time.time()
+    result, fresh = lib.answercache.get(spell, candidate.query, config)
+    if result is not None:
+        if not fresh:
+            lib.wizard._refresh(candidate, config, store)
+        return result, store.get(name), time.time() - before
+
+    state = copy.deepcopy(store.get(name))
+    try:
+        with deadline:
+            result, state = await asyncio.wait_for(
+                spell.aincantation(candidate.query, config, state),
+                deadline.remaining()
+            )
+    except asyncio.TimeoutError:
+        lib.wizard._failed(spell, lib.deadline.DeadlineExceeded(
+            'The spell took too long'
+        ))
+        result = None
+    except IOError as e:
+        lib.wizard._failed(spell, e)
+        result = None
+    else:
+        if result is None:
+            lib.wizard._failed(spell)
+        else:
+            lib.answercache.put(spell, candidate.query, config, result)
+    return result, state, time.time() - before
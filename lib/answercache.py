@@ -0,0 +1,228 @@
+"""
+A cache of the answers of the spells, in front of their ``incantation``.
+
+The same questions are asked over and over ("What is the weather like?").
+Spells declaring a ``cacheTTL`` (see ``lib.spell.BaseSpell.cacheTTL``)
+have their answers reused for that many seconds, without running the
+spell again. Answers are keyed by the spell, the query as parsed and
+canonicalised by the spell (see ``lib.canonical``), whatever its case,
+and the configuration values the spell requires (see ``key``).
+Spells whose answers are random, or change all the time, do not set it.
+
+Spells whose answers are still good a while later (the weather, or
+definitions) can also declare a ``cacheGrace``: for that many seconds
+after its ``cacheTTL``, an answer is still used straight away, but it is
+refreshed in the background by asking the spell again (see
+``lib.wizard.ask``). Only one refresh of an answer runs at a time.
+
+Answers are kept in memory; the least recently used ones are evicted
+when there are too many. The size of the cache is set by the
+``[Config]`` section of ``settings.conf`` (see ``configure``)::
+
+    # How many answers to keep in memory (default: 1024, 0 for none)
+    Query.AnswerCache: 1024
+"""
+import time
+import threading
+import collections
+
+import lib.canonical
+
+
+class Cache(object):
+    """
+    The answers, least recently used first
+
+    :type maxEntries: int
+    :param maxEntries: How many answers to keep
+    """
+
+    def __init__(self, maxEntries=1024):
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.counters = collections.Counter()
+
+        #: The answers being refreshed (see ``claim``)
+        self.refreshing = set()
+
+    def get(self, name):
+        """
+        :type name: hashable
+        :param name: See ``key``
+
+        :returns: The answer and whether it is still fresh, or ``(None,
+            False)`` if it is not cached or is too old to be used at all
+        :rtype: tuple
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry is None or entry[1] <= now:
+                self.counters['misses'] += 1
+                return None, False
+            self.entries[name] = entry  # Most recently used
+            fresh = entry[0] > now
+            self.counters[fresh and 'hits' or 'stale'] += 1
+            return entry[2], fresh
+
+    def has(self, name):
+        """
+        :type name: hashable
+        :param name: See ``key``
+
+        :rtype: bool
+        :return: Whether an answer that can be used is cached; unlike
+            ``get``, it is not counted as a hit or a miss
+        """
+        with self.lock:
+            entry = self.entries.get(name)
+        return entry is not None and entry[1] > time.time()
+
+    def expires(self, name):
+        """
+        :type name: hashable
+        :param name: See ``key``
+
+        :rtype: float or None
+        :return: When the answer stops being fresh, or ``None`` if there is
+            none
+        """
+        with self.lock:
+            entry = self.entries.get(name)
+        return entry is not None and entry[0] or None
+
+    def put(self, name, result, ttl, grace=0):
+        """
+        :type name: hashable
+        :param name: See ``key``
+
+        :param result: The answer
+
+        :type ttl: float
+        :param ttl: How long it can be reused, in seconds
+
+        :type grace: float
+        :param grace: How long it can be reused after that while it is
+            refreshed, in seconds
+        """
+        now = time.time()
+        with self.lock:
+            self.entries.pop(name, None)
+            self.entries[name] = (now + ttl, now + ttl + grace, result)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+                self.counters['evicted'] += 1
+
+    def claim(self, name):
+        """
+        :type name: hashable
+        :param name: See ``key``
+
+        :rtype: bool
+        :return: Whether the caller should refresh the answer, that is
+            whether nobody else is already doing it. The caller must
+            ``release`` it once done
+        """
+        with self.lock:
+            if name in self.refreshing:
+                return False
+            self.refreshing.add(name)
+            self.counters['refreshes'] += 1
+            return True
+
+    def release(self, name):
+        """ The answer was refreshed, or could not be """
+        with self.lock:
+            self.refreshing.discard(name)
+
+    def clear(self):
+        """ Drop every answer """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        :rtype: dict
+        :return: The number of ``hits``, of answers used while too old
+            (``stale``), of ``misses``, ``evicted`` answers and answers
+            refreshed in the background (``refreshes``), and of the
+            answers kept (``entries``)
+        """
+        with self.lock:
+            result = dict(
+                (name, self.counters[name])
+                for name in ('hits', 'stale', 'misses', 'evicted', 'refreshes')
+            )
+            result['entries'] = len(self.entries)
+        return result
+
+
+#: The cache used by ``lib.wizard.ask``
+CACHE = Cache()
+
+
+def configure(config):
+    """
+    Set the size of the cache from the configuration
+
+    :type config: dict
+    :param config: The configuration (see ``lib.config.load``)
+    """
+    value = config.get('Query.AnswerCache')
+    if value not in (None, ''):
+        CACHE.maxEntries = int(value)
+
+
+def key(spell, query, config):
+    """
+    :type spell: ``lib.spell.BaseSpell``
+    :param spell: The spell answering
+
+    :type query: str
+    :param query: The query, as parsed by the spell; its case is ignored
+
+    :type config: dict
+    :param config: The configuration; only the values the spell requires
+        (see ``lib.spell.BaseSpell.config``) are part of the key
+
+    :rtype: tuple
+    """
+    return (spell.__class__.__name__, lib.canonical.key(query)) + tuple(
+        repr(config.get(name)) for name in sorted(spell.config)
+    )
+
+
+def get(spell, query, config):
+    """
+    :returns: The cached answer of ``spell`` to ``query`` (``None`` if
+        there is none) and whether it is fresh (see ``Cache.get``)
+    :rtype: tuple
+    """
+    if not spell.cacheTTL:
+        return None, False
+    return CACHE.get(key(spell, query, config))
+
+
+def cached(spell, query, config):
+    """
+    :rtype: bool
+    :return: Whether ``spell`` has a cached answer to ``query``
+    """
+    return bool(spell.cacheTTL) and CACHE.has(key(spell, query, config))
+
+
+def expires(spell, query, config):
+    """
+    :rtype: float or None
+    :return: When the cached answer of ``spell`` to ``query`` stops being
+        fresh, if there is one
+    """
+    return CACHE.expires(key(spell, query, config))
+
+
+def put(spell, query, config, result):
+    """ Remember the answer of ``spell`` to ``query``, if it allows it """
+    if spell.cacheTTL and CACHE.maxEntries > 0:
+        CACHE.put(key(spell, query, config), result, spell.cacheTTL,
+                  spell.cacheGrace)
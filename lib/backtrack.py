@@ -0,0 +1,274 @@
+"""
+Spot spell patterns that can take a very long time to match.
+
+Python's regular expressions backtrack: when part of a pattern fails,
+every other way of matching what came before is tried. Patterns where
+the same text can be matched in many ways, such as ``(\\w+\\s?)+`` or
+``\\d+\\S+\\s+in``, then take exponential (or quadratic) time on some
+inputs. ``risks`` looks for the usual culprits in a parsed pattern;
+it is a heuristic, which errs on the side of flagging too much.
+"""
+import re
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+#: Repeats that can match that many times or more count as unbounded
+UNBOUNDED = 16
+
+#: The characters used to tell whether two character sets overlap
+_ALPHABET = [chr(code) for code in range(128)] + [
+    u'\u00a0', u'\u00e9', u'\u0663', u'\u4e00'
+]
+
+_CATEGORIES = dict(
+    (getattr(sre_parse, 'CATEGORY_' + name), re.compile(regex))
+    for name, regex in (
+        ('DIGIT', r'\d'), ('NOT_DIGIT', r'\D'),
+        ('SPACE', r'\s'), ('NOT_SPACE', r'\S'),
+        ('WORD', r'\w'), ('NOT_WORD', r'\W'),
+        ('LINEBREAK', r'\n'), ('NOT_LINEBREAK', r'[^\n]')
+    )
+)
+
+_REPEATS = tuple(
+    getattr(sre_parse, name)
+    for name in ('MAX_REPEAT', 'MIN_REPEAT')
+    if hasattr(sre_parse, name)
+)
+
+_EMPTY = frozenset()
+
+
+def risks(pattern, flags=re.IGNORECASE | re.VERBOSE):
+    """
+    Find the constructs of ``pattern`` that are prone to catastrophic
+    backtracking:
+
+        * **nested repeats**: a repeat, inside another repeat, that can
+          end with the characters the outer repeat starts with
+          (``(a+)+``, ``(\\w+\\s?)*``)
+        * **overlapping alternatives**: a repeat whose body can match the
+          same text in more than one way (``(a|aa)+``, ``(ab|ac|a)+``)
+        * **adjacent repeats**: two repeats next to each other, matching
+          some of the same characters, followed by something that can
+          fail (``\\d+\\S+\\s+in``)
+
+    :type pattern: str
+    :param pattern: A spell pattern (see ``lib.spell.BaseSpell.pattern``)
+
+    :type flags: int
+    :param flags: The flags the pattern is compiled with
+
+    :rtype: list
+    :return: A description of each problem found; empty if none
+    """
+    try:
+        subpattern = sre_parse.parse(pattern, flags)
+    except (re.error, TypeError, ValueError):
+        return []
+    found = []
+    _scan(subpattern, False, flags & re.IGNORECASE, found)
+    return sorted(set(found))
+
+
+def _chars(op, av, ignoreCase):
+    """
+    The characters a single character expression matches, out of
+    ``_ALPHABET``, or ``None`` if ``op`` is not such an expression
+    """
+    if op == sre_parse.ANY:
+        return frozenset(char for char in _ALPHABET if char != '\n')
+    elif op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL):
+        tests = [(sre_parse.LITERAL, av)]
+        negate = op == sre_parse.NOT_LITERAL
+    elif op == sre_parse.IN:
+        tests = [item for item in av if item[0] != sre_parse.NEGATE]
+        negate = len(tests) != len(av)
+    else:
+        return None
+
+    def matches(char):
+        for kind, value in tests:
+            if kind == sre_parse.LITERAL and ord(char) == value:
+                return True
+            elif kind == sre_parse.RANGE and value[0] <= ord(char) <= value[1]:
+                return True
+            elif kind == sre_parse.CATEGORY and value in _CATEGORIES and (
+                _CATEGORIES[value].match(char)
+            ):
+                return True
+        return False
+
+    result = set()
+    for char in _ALPHABET:
+        variants = ignoreCase and (char, char.lower(), char.upper()) or (char,)
+        if any(matches(variant) for variant in variants) != negate:
+            result.add(char)
+    return frozenset(result)
+
+
+def _children(op, av):
+    """ The subpatterns directly inside an expression """
+    if op == sre_parse.SUBPATTERN:
+        return [av[-1]]
+    elif op == sre_parse.BRANCH:
+        return list(av[1])
+    elif op in _REPEATS:
+        return [av[2]]
+    elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    elif op == sre_parse.GROUPREF_EXISTS:
+        return [item for item in av[1:] if item is not None]
+    elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+        return [av]
+    return []
+
+
+def _nullable(subpattern):
+    """ Whether a sequence can match the empty string """
+    for op, av in subpattern:
+        if op in _REPEATS:
+            if av[0] and not _nullable(av[2]):
+                return False
+        elif op in (sre_parse.SUBPATTERN, sre_parse.GROUPREF_EXISTS) or (
+            op == getattr(sre_parse, 'ATOMIC_GROUP', None)
+        ):
+            if not any(_nullable(child) for child in _children(op, av)):
+                return False
+        elif op == sre_parse.BRANCH:
+            if not any(_nullable(branch) for branch in av[1]):
+                return False
+        elif op not in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            return False
+    return True
+
+
+def _canFail(subpattern):
+    """ Whether a sequence can fail to match, once reached """
+    for op, av in subpattern:
+        if op in _REPEATS:
+            if av[0] and _canFail(av[2]):
+                return True
+        elif op == sre_parse.SUBPATTERN:
+            if _canFail(av[-1]):
+                return True
+        elif op == sre_parse.BRANCH:
+            if all(_canFail(branch) for branch in av[1]):
+                return True
+        else:
+            return True
+    return False
+
+
+def _first(subpattern, ignoreCase):
+    """ The characters a sequence can start with """
+    result = set()
+    for op, av in subpattern:
+        chars = _chars(op, av, ignoreCase)
+        if chars is not None:
+            result.update(chars)
+            return frozenset(result)
+        for child in _children(op, av):
+            if op not in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+                result.update(_first(child, ignoreCase))
+        if not _nullable([(op, av)]):
+            break
+    return frozenset(result)
+
+
+def _repeated(op, av, ignoreCase):
+    """
+    The characters of the unbounded repeat a single expression starts
+    with, if it starts with one
+    """
+    if op in _REPEATS and av[1] >= UNBOUNDED:
+        return _first(av[2], ignoreCase)
+    elif op == sre_parse.SUBPATTERN and av[-1]:
+        return _repeated(*list(av[-1])[0] + (ignoreCase,))
+    elif op == sre_parse.BRANCH:
+        result = set()
+        for branch in av[1]:
+            if branch:
+                result.update(_repeated(*list(branch)[0] + (ignoreCase,)))
+        return frozenset(result)
+    return _EMPTY
+
+
+def _last(subpattern, ignoreCase):
+    """
+    The characters of the unbounded repeats a sequence can end with,
+    along with what is matched after them
+    """
+    result = set()
+    for op, av in reversed(list(subpattern)):
+        if op in _REPEATS and av[1] >= UNBOUNDED:
+            result.update(_first(av[2], ignoreCase))
+        for child in _children(op, av):
+            result.update(_last(child, ignoreCase))
+        if not _nullable([(op, av)]):
+            break
+        result.update(_first([(op, av)], ignoreCase))
+    return frozenset(result)
+
+
+def _scan(subpattern, follow, ignoreCase, found):
+    """
+    Look for risky constructs in a sequence
+
+    :param follow: Whether what comes after the sequence can fail
+    """
+    items = list(subpattern)
+    for index, (op, av) in enumerate(items):
+        after = follow or _canFail(items[index + 1:])
+
+        if op in _REPEATS and av[1] >= UNBOUNDED:
+            body = av[2]
+            start = _first(body, ignoreCase)
+
+            inner = list(body)
+            if len(inner) == 1 and inner[0][0] == sre_parse.SUBPATTERN:
+                inner = list(inner[0][1][-1])
+            if len(inner) == 1 and inner[0][0] == sre_parse.BRANCH:
+                branches = [_first(b, ignoreCase) for b in inner[0][1][1]]
+                for i, one in enumerate(branches):
+                    if any(one & other for other in branches[i + 1:]):
+                        found.append('overlapping alternatives in a repeat')
+                        break
+
+            # Where one iteration ends and the next starts is ambiguous
+            if start & _last(body, ignoreCase):
+                inside = [item for child in body for item in _walk(child)]
+                if any(other in _REPEATS and value[1] >= UNBOUNDED
+                       for other, value in inside):
+                    found.append('nested repeats')
+                elif any(other == sre_parse.BRANCH or (
+                    other in _REPEATS and value[0] != value[1]
+                ) for other, value in inside):
+                    found.append('overlapping alternatives in a repeat')
+
+            # Two unbounded repeats that can swap characters, followed by
+            # something that can fail
+            for position in range(index + 1, len(items)):
+                nextOp, nextAv = items[position]
+                if start & _repeated(nextOp, nextAv, ignoreCase) and (
+                    follow or _canFail(items[position + 1:])
+                ):
+                    found.append('adjacent repeats')
+                    break
+                if not _nullable([items[position]]):
+                    break
+
+        for child in _children(op, av):
+            _scan(child, after or op in _REPEATS, ignoreCase, found)
+
+
+def _walk(item):
+    """ An expression and every expression inside it """
+    yield item
+    for child in _children(*item):
+        for subitem in child:
+            for result in _walk(subitem):
+                yield result
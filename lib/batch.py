@@ -0,0 +1,174 @@
+"""
+Answer a stream of queries, such as a regression corpus or a replay.
+
+The input has one JSON value per line: either the query itself
+(``"How awesome is Chuck Norris?"``) or an object with a ``query`` key
+(``{"id": 42, "query": "..."}``). Every other key of the object is copied
+to the answer, so that it can be told apart. The output has one JSON
+object per line, in the same order as the input::
+
+    {"id": 42, "query": "...", "result": "...", "spell": "Awesome",
+     "score": 100, "elapsed": 0.0012}
+
+Lines that cannot be read, or queries that fail, are answered with
+``{"error": "<message>"}`` instead of stopping the batch.
+"""
+import json
+import threading
+import collections
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python2.x
+
+
+class _Pending(object):
+    """ A query that is being answered """
+
+    def __init__(self, request):
+        self.request = request
+        self.response = None
+        self.done = threading.Event()
+
+    def wait(self):
+        self.done.wait()
+        return self.response
+
+
+def read(lines):
+    """
+    Decode the requests, one per line. Blank lines are skipped
+
+    :type lines: iterable
+    :param lines: The lines of the input
+
+    :rtype: generator
+    :return: For each line, either the request (a ``dict`` with a
+        ``query``) or the exception explaining why it could not be read
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('UTF-8')
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                request = {'query': request}
+            if not isinstance(request.get('query'), type(u'')):
+                raise ValueError('No query in: %s' % line.strip())
+        except ValueError as e:
+            yield e
+        else:
+            yield request
+
+
+def respond(ask, request):
+    """
+    :type ask: function
+    :param ask: Returns the ``lib.wizard.Answer`` to a query
+
+    :type request: dict or Exception
+    :param request: As generated by ``read``
+
+    :rtype: dict
+    :return: The response to write out
+    """
+    if isinstance(request, Exception):
+        return {'error': '%s: %s' % (request.__class__.__name__, request)}
+    response = dict(request)
+    try:
+        answer = ask(request['query'])
+    except Exception as e:
+        response['error'] = '%s: %s' % (e.__class__.__name__, e)
+    else:
+        response.update(
+            result=answer.result,
+            spell=answer.spell,
+            score=answer.score,
+            elapsed=answer.elapsed
+        )
+    return response
+
+
+def answer(ask, lines, window=8):
+    """
+    Answer the queries, a few of them at a time.
+
+    At most ``window`` queries are being answered (or waiting to be
+    written out) at any time, so the memory used does not depend on the
+    size of the input, which is read as the answers are written.
+
+    :type ask: function
+    :param ask: Returns the ``lib.wizard.Answer`` to a query, for example
+        ``lib.wizard.Wizard.ask``. It is called from several threads
+
+    :type lines: iterable
+    :param lines: The input, one request per line (see above)
+
+    :type window: int
+    :param window: How many queries can be answered at the same time
+
+    :rtype: generator
+    :return: The responses (``dict``), in the order of the input
+    """
+    window = max(1, window)
+    todo = queue.Queue(window)
+
+    def worker():
+        while True:
+            pending = todo.get()
+            if pending is None:
+                break
+            try:
+                pending.response = respond(ask, pending.request)
+            finally:
+                pending.done.set()
+
+    workers = [threading.Thread(target=worker) for i in range(window)]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+
+    inflight = collections.deque()
+    try:
+        for request in read(lines):
+            if len(inflight) >= window:
+                yield inflight.popleft().wait()
+            pending = _Pending(request)
+            inflight.append(pending)
+            todo.put(pending)
+        while inflight:
+            yield inflight.popleft().wait()
+    finally:
+        for thread in workers:
+            todo.put(None)
+
+
+def run(ask, lines, output, window=8):
+    """
+    Answer the queries and write the responses out as JSON lines
+
+    :type ask: function
+    :param ask: See ``answer``
+
+    :type lines: iterable
+    :param lines: See ``answer``
+
+    :type output: file
+    :param output: Where the responses are written, one per line
+
+    :type window: int
+    :param window: See ``answer``
+
+    :rtype: int
+    :return: How many queries could not be answered
+    """
+    failed = 0
+    for response in answer(ask, lines, window):
+        if 'error' in response or response.get('result') is None:
+            failed += 1
+        output.write(json.dumps(response) + '\n')
+        output.flush()
+    return failed
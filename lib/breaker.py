@@ -0,0 +1,227 @@
+"""
+Stop sending requests to hosts that keep failing.
+
+Every host has a circuit breaker. After ``threshold`` failed requests in
+a row (errors, timeouts and ``5xx`` responses, but not requests that were
+never sent because the query ran out of time), the breaker opens:
+requests to the host fail straight away with ``CircuitOpenError``, and
+``lib.wizard.ask`` skips the spells fetching from it. After ``cooldown``
+seconds, the breaker lets a single request through (it is half open): if
+it succeeds the breaker closes again, otherwise it stays open for
+another ``cooldown``.
+
+The breakers are configured by the ``[Config]`` section of
+``settings.conf`` (see ``configure``)::
+
+    # How many failed requests in a row open the breaker of a host
+    HTTP.BreakerThreshold: 5
+    # How long to wait before trying an open host again, in seconds
+    HTTP.BreakerCooldown: 30
+"""
+import time
+import threading
+import collections
+
+import lib.http
+import lib.deadline
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+#: How many failed requests in a row open a breaker
+threshold = 5
+
+#: How long a breaker stays open, in seconds
+cooldown = 30.0
+
+_LOCK = threading.Lock()
+
+
+class CircuitOpenError(IOError):
+    """ The host has been failing; the request was not made """
+
+
+class Breaker(object):
+    """
+    The circuit breaker of a host
+
+    :type host: str
+    :param host: ``scheme://host[:port]`` (see ``lib.http.origin``)
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = None  # When the breaker last opened
+        self.probing = False
+        self.counters = collections.Counter()
+
+    def available(self):
+        """
+        :rtype: bool
+        :return: Whether a request would be let through now
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.time() >= self.opened + cooldown
+        return not self.probing
+
+    def allow(self):
+        """
+        Let a request through, if the breaker allows it
+
+        :raises: ``CircuitOpenError`` if it does not
+        """
+        with _LOCK:
+            if self.state == OPEN and time.time() >= self.opened + cooldown:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return
+            if self.state != CLOSED:
+                self.counters['rejected'] += 1
+                raise CircuitOpenError(
+                    '%s has been failing, trying again in %.0f seconds' % (
+                        self.host,
+                        max(0, self.opened + cooldown - time.time())
+                    )
+                )
+
+    def success(self):
+        """ Record a request that succeeded """
+        with _LOCK:
+            self.failures = 0
+            self.probing = False
+            self.state = CLOSED
+
+    def failure(self):
+        """ Record a request that failed """
+        with _LOCK:
+            self.failures += 1
+            self.counters['failures'] += 1
+            self.probing = False
+            if self.state == HALF_OPEN or self.failures >= threshold:
+                if self.state != OPEN:
+                    self.counters['opened'] += 1
+                self.state = OPEN
+                self.opened = time.time()
+
+    def stats(self):
+        """
+        :rtype: dict
+        :return: The ``state`` of the breaker, the number of requests that
+            ``failed``, of times it ``opened`` and of requests it
+            ``rejected``
+        """
+        return {
+            'state': self.state,
+            'failed': self.counters['failures'],
+            'opened': self.counters['opened'],
+            'rejected': self.counters['rejected']
+        }
+
+
+#: The breakers, by ``scheme://host[:port]``
+_BREAKERS = {}
+
+
+def configure(config):
+    """
+    Set the threshold and the cooldown of the breakers from the
+    configuration
+
+    :type config: dict
+    :param config: The configuration (see ``lib.config.load``)
+    """
+    global threshold, cooldown
+    threshold = int(config.get('HTTP.BreakerThreshold') or threshold)
+    cooldown = float(config.get('HTTP.BreakerCooldown') or cooldown)
+
+
+def breaker(url):
+    """
+    :type url: str
+    :param url: Any URL of the host
+
+    :rtype: ``Breaker``
+    :return: The breaker of the host, created if needed
+    """
+    host = lib.http.origin(url)
+    try:
+        return _BREAKERS[host]
+    except KeyError:
+        with _LOCK:
+            return _BREAKERS.setdefault(host, Breaker(host))
+
+
+def available(urls):
+    """
+    :type urls: iterable
+    :param urls: URLs of hosts, such as ``lib.spell.BaseSpell.hosts``
+
+    :rtype: bool
+    :return: Whether none of their breakers are open
+    """
+    return all(breaker(url).available() for url in urls)
+
+
+def call(url, function):
+    """
+    Make a request through the breaker of its host
+
+    :type url: str
+    :param url: The URL requested
+
+    :type function: function
+    :param function: Makes the request, returns the response and raises
+        an ``IOError`` (such as ``requests.RequestException``) if it failed.
+        ``lib.deadline.DeadlineExceeded``, raised when the query runs out
+        of time before the request is sent, is not counted as a failure
+
+    :returns: The response
+    :raises: ``CircuitOpenError`` if the breaker is open, or what
+        ``function`` raised
+    """
+    current = breaker(url)
+    current.allow()
+    try:
+        response = function()
+    except lib.deadline.DeadlineExceeded:
+        # Out of time before the request was sent, not the host's fault
+        with _LOCK:
+            current.probing = False
+        raise
+    except IOError as e:
+        status = getattr(getattr(e, 'response', None), 'status_code', None)
+        if status is not None and status < 500:
+            current.success()  # The host answered, the request was wrong
+        else:
+            current.failure()
+        raise
+    except Exception:
+        with _LOCK:
+            current.probing = False  # Not the host's fault, probe again
+        raise
+    current.success()
+    return response
+
+
+def stats():
+    """
+    :rtype: dict
+    :return: ``Breaker.stats`` by host, along with the list of the hosts
+        whose breakers are ``open``
+    """
+    hosts = dict(
+        (host, item.stats()) for host, item in list(_BREAKERS.items())
+    )
+    return {
+        'hosts': hosts,
+        'open': sorted(
+            host for host, item in hosts.items() if item['state'] != CLOSED
+        )
+    }
@@ -0,0 +1,65 @@
+"""
+Put queries in a canonical form, so that the same question asked in
+slightly different ways is routed, answered and cached the same way.
+
+Queries are canonicalised before they are routed (see
+``lib.dispatch.Dispatcher.candidates``): runs of whitespace become a
+single space, curly quotes become straight ones, ``what's``, ``who're``
+and the like are spelled out, and trailing punctuation is dropped. Case
+is kept, since some spells repeat parts of the query (names, places);
+the caches ignore it instead (see ``key``).
+
+Each spell can then canonicalise the part of the query it parsed (see
+``lib.spell.BaseSpell.canonicalise``), for example to map synonyms onto
+the words it understands. The spell's answer, and what it fetches, are
+keyed by the result.
+"""
+import re
+
+_SPACES = re.compile(r'\s+', re.UNICODE)
+
+#: ``what's`` is ``what is``, ``who're`` is ``who are``...
+_CONTRACTIONS = re.compile(
+    r"\b(what|who|where|when|why|how)'(s|re)\b", re.IGNORECASE
+)
+_VERBS = {'s': 'is', 're': 'are'}
+
+_TRAILING = re.compile(r'[\s?!.]+$')
+
+_QUOTES = (
+    (u'\u2018', "'"), (u'\u2019', "'"), (u'\u201c', '"'), (u'\u201d', '"')
+)
+
+
+def canonical(query):
+    """
+    :type query: str
+    :param query: The query, as asked
+
+    :rtype: str
+    :return: The query in its canonical form, such as ``What is today's
+        weather`` for ``What's  today's weather??``
+    """
+    for curly, straight in _QUOTES:
+        if curly in query:
+            query = query.replace(curly, straight)
+    query = _SPACES.sub(' ', query).strip()
+    if "'" in query:
+        query = _CONTRACTIONS.sub(
+            lambda match: '%s %s' % (
+                match.group(1), _VERBS[match.group(2).lower()]
+            ),
+            query
+        )
+    return _TRAILING.sub('', query)
+
+
+def key(query):
+    """
+    :type query: str or None
+    :param query: A canonical query, or the part of it a spell parsed
+
+    :rtype: str
+    :return: What the caches key it by: the same, whatever its case
+    """
+    return (query or '').lower()
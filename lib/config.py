@@ -30,17 +30,26 @@ def load(fileName):
 def validate(config):
     """
     Inspect configuration and disable spells in which required configurations
-    are missing
+    are missing. Spells that do not require any are skipped
 
     :type config: dict
     :param config: The deserialized config
     """
 
-    for spell in lib.registry.all():
-        baseMsg = 'spell:%s is being disabled;' % spell['spell'].__name__
-        for key, value in spell['spell'].config.iteritems():
+    for spell in lib.registry.configured():
+        baseMsg = 'spell:%s is being disabled;' % spell['name']
+        expected = spell['config']
+        if all(key in config for key in expected) and any(
+            value is None or isinstance(value, list) and value[0] is None
+            for value in expected.values()
+        ):
+            # Some types could not be saved in the manifest; only spells
+            # which are not disabled get imported to find them out
+            expected = lib.registry.load(spell).config
+
+        for key, value in expected.items():
             if key not in config:
-                print (
+                warnings.warn(
                     '%s a required configuration is missing: "%s"' % (
                         baseMsg, key
                     )
@@ -60,7 +69,7 @@ def validate(config):
                 try:
                     config[key] = expectedType(configValue)
                 except ValueError:
-                    print (
+                    warnings.warn(
                         "%s '%s' should be a %s, not a %s." % (
                             baseMsg, key, expectedType, configValue
                         )
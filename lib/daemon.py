@@ -0,0 +1,214 @@
+"""
+A long running Troz process, answering queries sent over a local socket.
+
+Requests and responses are JSON objects, one per line. A request looks
+like ``{"query": "How awesome is Chuck Norris?"}`` and the response like
+``{"query": ..., "score": 100, "spell": "Awesome", "result": ...}``.
+A request can also set the ``deadline`` and ``speculate`` of its query
+(see ``lib.wizard.Wizard.ask``), which default to the daemon's.
+``{"stats": true}`` asks for statistics about the daemon instead (see
+``lib.wizard.Wizard.stats``). If anything goes wrong, the response is
+``{"error": "<message>"}``.
+"""
+import os
+import json
+import signal
+import socket
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+#: Where the daemon listens by default: either the path of a Unix socket
+#: or, where those are not available, a ``host:port`` on the loopback
+ADDRESS = hasattr(socket, 'AF_UNIX') and 'troz.sock' or '127.0.0.1:7482'
+
+
+#: How much longer than the deadline of a query (see ``lib.deadline``)
+#: to wait for the daemon's answer, in seconds; a daemon that takes
+#: longer is assumed to hang
+MARGIN = 2.0
+
+#: The options a query can be sent with, and their types
+OPTIONS = (('deadline', float), ('speculate', int))
+
+
+def parse_address(address):
+    """
+    :type address: str
+    :param address: A Unix socket path or ``host:port``
+
+    :returns: the socket family and the address as expected by ``socket``
+    :rtype: ``tuple(int, mixed)``
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and os.path.sep not in address:
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+
+def forward(request, address=ADDRESS, timeout=None):
+    """
+    Send a request to the daemon and wait for its response
+
+    :type request: dict
+    :param request: The request, for example ``{"query": "..."}``
+
+    :type address: str
+    :param address: Where the daemon listens (see ``ADDRESS``)
+
+    :type timeout: float or None
+    :param timeout: How long to wait for the daemon, in seconds
+
+    :rtype: dict
+    :return: The response
+    :raises: ``socket.error`` if no daemon is listening, or
+        ``socket.timeout`` if it did not answer in time
+    """
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX and not os.path.exists(addr):
+        raise socket.error('No daemon listening on %s' % address)
+
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(addr)
+        stream = sock.makefile('rwb')
+        stream.write((json.dumps(request) + '\n').encode('UTF-8'))
+        stream.flush()
+        line = stream.readline()
+        stream.close()
+    finally:
+        sock.close()
+
+    if not line:
+        raise socket.error('The daemon closed the connection')
+    return json.loads(line.decode('UTF-8'))
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """ Answers each request (line) received over a connection """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('UTF-8'))
+                response = self.server.respond(request)
+            except Exception as e:
+                response = {'error': '%s: %s' % (e.__class__.__name__, e)}
+            self.wfile.write((json.dumps(response) + '\n').encode('UTF-8'))
+            self.wfile.flush()
+
+
+class _Server(object):
+    """
+    The parts common to the Unix and TCP servers. Every connection is
+    handled in its own thread.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def respond(self, request):
+        """
+        :type request: dict
+        :param request: The decoded request
+
+        :rtype: dict
+        :return: The response
+        """
+        if request.get('stats') and self.stats:
+            return self.stats()
+        if 'query' not in request:
+            raise ValueError('Unknown request: %s' % request)
+        options = {}
+        for name, cast in OPTIONS:
+            if request.get(name) is not None:
+                options[name] = cast(request[name])
+        return self.answer(request['query'], **options)
+
+
+class UnixServer(_Server, socketserver.ThreadingMixIn,
+                 socketserver.UnixStreamServer):
+    pass
+
+
+class TCPServer(_Server, socketserver.ThreadingMixIn,
+                socketserver.TCPServer):
+    pass
+
+
+def serve(answer, address=ADDRESS, flush=None, interval=60, stats=None):
+    """
+    Answer queries until interrupted
+
+    :type answer: function
+    :param answer: Called with each query, and the options it was sent
+        with as keyword arguments (see ``OPTIONS``); returns the response
+        (a ``dict``)
+
+    :type address: str
+    :param address: Where to listen (see ``ADDRESS``)
+
+    :type flush: function or None
+    :param flush: Called every `interval` seconds and when the daemon
+        stops, to persist the spells' state
+
+    :type interval: float
+    :param interval: See `flush`
+
+    :type stats: function or None
+    :param stats: Returns the statistics (a ``dict``) sent in response
+        to ``{"stats": true}``
+
+    :raises: ``RuntimeError`` if another daemon is already listening
+    """
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            try:
+                forward({}, address, timeout=1)
+            except socket.error:
+                os.unlink(addr)  # Left behind by a daemon that died
+            else:
+                raise RuntimeError('A daemon is already listening on %s'
+                                   % address)
+        server = UnixServer(addr, Handler)
+    else:
+        server = TCPServer(addr, Handler)
+    server.answer = answer
+    server.stats = stats
+
+    stopped = threading.Event()
+
+    def flusher():
+        while not stopped.wait(interval):
+            flush()
+
+    if flush:
+        thread = threading.Thread(target=flusher)
+        thread.daemon = True
+        thread.start()
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    try:
+        previous = signal.signal(signal.SIGTERM, terminate)
+    except ValueError:
+        previous = None  # Not in the main thread
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if previous is not None:
+            signal.signal(signal.SIGTERM, previous)
+        stopped.set()
+        server.server_close()
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.unlink(addr)
+        if flush:
+            flush()
@@ -0,0 +1,158 @@
+"""
+Bound how long a query can take.
+
+``lib.wizard.ask`` gives each query a ``Deadline``, and each spell it
+tries a share of what is left of it (see ``Deadline.split``). While a
+spell runs, its deadline is the ``current`` one of the thread: the
+requests it makes (see ``lib.spell.BaseSpell.fetch``) time out when it
+expires, and the spell can check how much time it has left with
+``remaining``. Deadlines are kept in a ``contextvars`` variable where
+available, so each asyncio task has its own.
+
+The deadline is set by the ``[Config]`` section of ``settings.conf``::
+
+    # How long a query can take, in seconds (default: 10)
+    Query.Deadline: 10
+"""
+import time
+import threading
+
+#: How long a query can take by default, in seconds
+DEFAULT = 10.0
+
+#: How long opening a connection can take at most, in seconds, however
+#: much time is left
+CONNECT = 3.05
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None  # Python < 3.7: threads only
+
+if contextvars is not None:
+    _CURRENT = contextvars.ContextVar('deadlines', default=())
+    _get, _set = _CURRENT.get, _CURRENT.set
+else:
+    _CURRENT = threading.local()
+
+    def _get():
+        return getattr(_CURRENT, 'stack', ())
+
+    def _set(stack):
+        _CURRENT.stack = stack
+
+
+class DeadlineExceeded(IOError):
+    """ The query ran out of time """
+
+
+class Deadline(object):
+    """
+    A point in time by which a query, or a part of it, must be done
+
+    :type seconds: float or None
+    :param seconds: How long from now; ``None`` for no limit
+    """
+
+    def __init__(self, seconds=None):
+        self.expires = seconds is not None and time.time() + seconds or None
+
+    def remaining(self):
+        """
+        :rtype: float or None
+        :return: How many seconds are left (never negative), or ``None``
+            if there is no limit
+        """
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.time())
+
+    def expired(self):
+        """ :rtype: bool """
+        return self.expires is not None and time.time() >= self.expires
+
+    def split(self, share=0.5):
+        """
+        :type share: float
+        :param share: The part of the remaining time to give away
+
+        :rtype: ``Deadline``
+        :return: A deadline for part of the work, such as one spell. Each
+            spell gets half of what is left by default, so that the ones
+            after it still get some time
+        """
+        child = Deadline()
+        if self.expires is not None:
+            child.expires = time.time() + self.remaining() * share
+        return child
+
+    def cancel(self):
+        """ Make the deadline pass now, so that the work stops early """
+        self.expires = time.time()
+
+    def check(self):
+        """ :raises: ``DeadlineExceeded`` if the deadline has passed """
+        if self.expired():
+            raise DeadlineExceeded('The query took too long')
+
+    def __enter__(self):
+        """
+        Make this the current deadline of the thread (or task). The same
+        deadline can be current in several threads
+        """
+        _set(_get() + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _set(_get()[:-1])
+
+
+def current():
+    """
+    :rtype: ``Deadline`` or None
+    :return: The deadline of the work being done by this thread (or
+        asyncio task), if any
+    """
+    stack = _get()
+    return stack and stack[-1] or None
+
+
+def remaining():
+    """
+    :rtype: float or None
+    :return: How many seconds the current deadline leaves, or ``None`` if
+        there is none
+    """
+    deadline = current()
+    if deadline is None:
+        return None
+    return deadline.remaining()
+
+
+def timeout():
+    """
+    :rtype: ``tuple(float, float)`` or None
+    :return: The (`connect`, `read`) timeouts of a request made now, as
+        expected by ``requests``, or ``None`` if there is no deadline
+    :raises: ``DeadlineExceeded`` if the deadline has passed
+    """
+    deadline = current()
+    if deadline is None or deadline.expires is None:
+        return None
+    deadline.check()
+    left = deadline.remaining()
+    return min(left, CONNECT), left
+
+
+def seconds(config):
+    """
+    :type config: dict
+    :param config: The configuration (see ``lib.config.load``)
+
+    :rtype: float or None
+    :return: How long a query can take, according to the configuration
+    """
+    value = config.get('Query.Deadline')
+    if value in (None, ''):
+        return DEFAULT
+    return float(value) or None  # 0 means no limit
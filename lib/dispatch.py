@@ -0,0 +1,431 @@
+import re
+import time
+import heapq
+import warnings
+import collections
+
+import lib.keywords
+import lib.registry
+import lib.canonical
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+try:
+    TimeoutError
+except NameError:
+    TimeoutError = RuntimeError  # Python2.x, never raised
+
+#: The flags every spell ``pattern`` is compiled with
+FLAGS = re.IGNORECASE | re.VERBOSE
+
+_PATTERN = type(re.compile(''))
+
+#: A spell that matched a query.
+#:
+#:  * **key**: What candidates are ordered by, ``(-score, position)``;
+#:      the smallest key is the best candidate. `position` (the position of
+#:      the spell in ``Dispatcher.groups``) breaks ties between spells
+#:      of equal weight
+#:  * **score**: See ``lib.spell.BaseSpell.parse``
+#:  * **spell**: The spell object
+#:  * **query**: The part of the query the spell is interested in, as
+#:      canonicalised by the spell (see ``lib.spell.BaseSpell.canonicalise``)
+Candidate = collections.namedtuple('Candidate', 'key score spell query')
+
+
+def references(subpattern):
+    """
+    Check if a parsed regular expression refers back to one of its groups
+
+    :type subpattern: ``sre_parse.SubPattern``
+    :param subpattern: The result of ``sre_parse.parse``
+
+    :rtype: bool
+    :return: True if a back reference (``\\1``, ``(?P=name)``
+        or ``(?(1)...)``) is used anywhere in the expression
+    """
+    for op, av in subpattern:
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            return True
+        stack = [av]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, sre_parse.SubPattern):
+                if references(item):
+                    return True
+            elif isinstance(item, (list, tuple)):
+                stack.extend(item)
+    return False
+
+
+def mergeable(regex):
+    """
+    Check if a compiled spell pattern can safely be embedded into
+    the combined expression built by ``Dispatcher``
+
+    Patterns using named groups, back references or global inline
+    flags are renumbered or rejected when embedded, so they are
+    matched on their own instead.
+
+    :type regex: ``re.RegexObject``
+    :param regex: The compiled spell pattern
+
+    :rtype: bool
+    """
+    if regex.groupindex:
+        return False
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            if references(sre_parse.parse(regex.pattern, FLAGS)):
+                return False
+            re.compile('(?:(?=(\n%s\n)))?' % regex.pattern, FLAGS)
+    except (re.error, DeprecationWarning):
+        return False
+    return True
+
+
+def _regex():
+    """ The ``regex`` module, if installed; its matches can time out """
+    try:
+        import regex
+    except ImportError:
+        return None
+    return regex
+
+
+class Dispatcher(object):
+    """
+    Routes queries to spells, matching the patterns of every spell
+    in a single scan.
+
+    First, the keywords required by each spell's pattern (see
+    ``lib.keywords.required``) are looked up in the query with a
+    ``lib.keywords.KeywordIndex``; only the spells whose keywords occur
+    in the query, plus the ones that do not require any (``.*`` for
+    instance), can possibly match.
+
+    The patterns of those spells are then compiled into one expression
+    made of optional lookaheads, one per spell, each wrapped in a capturing
+    group. Since lookaheads never consume input, each of them is tried at
+    the start of the query independently of the others and a single
+    ``match`` tells which spells matched, along with their capture groups.
+    Blacklists are only checked for the spells that matched.
+
+    Spells whose pattern or blacklist could backtrack for very long (see
+    ``lib.backtrack.risks``) are kept out of the combined expression and
+    guarded instead: they are skipped for queries longer than
+    ``maxLength`` and each of their matches gets ``budget`` seconds. With
+    the ``regex`` module (a requirement of Troz), a match that runs over
+    is stopped; should it be missing, the length of the query is the only
+    bound and the match runs to the end. Either way, the spell does not
+    answer, a ``RuntimeWarning`` says why and for the next ``penalty``
+    seconds the spell is skipped for queries longer than half the one
+    that was too slow.
+
+    :type groups: iterable
+    :param groups: The registry groups to route to, usually
+        ``lib.registry.enabled()`` (see ``lib.registry.lookup_by_name``
+        for a description of the structure)
+    """
+
+    #: How many combined expressions (one per set of plausible spells)
+    #: are kept around
+    cacheSize = 128
+
+    #: The longest query spells with risky patterns are tried on
+    maxLength = 512
+
+    #: How long, in seconds, matching a risky pattern may take
+    budget = 0.05
+
+    #: How long, in seconds, a spell whose pattern took too long is
+    #: skipped for queries as long as the one that took too long
+    penalty = 300.0
+
+    def __init__(self, groups):
+        self.groups = list(groups)
+        self.always = []
+        self.keywords = collections.defaultdict(list)
+        for position, group in enumerate(self.groups):
+            if group.get('keywords'):
+                for keyword in group['keywords']:
+                    self.keywords[keyword].append(position)
+            else:
+                self.always.append(position)
+
+        #: The spell objects, created the first time they are needed
+        self.spells = [None] * len(self.groups)
+        self.patterns = [None] * len(self.groups)
+        self.index = lib.keywords.KeywordIndex(self.keywords)
+        self.matchers = {}
+
+        #: The longest query each risky spell is tried on, by position
+        self.limits = dict(
+            (position, self.maxLength)
+            for position, group in enumerate(self.groups)
+            if group.get('risks')
+        )
+
+        #: The lower limits of the risky spells that took too long, and
+        #: until when they apply, by position (see ``guard``)
+        self.penalties = {}
+
+    def spell(self, position):
+        """
+        :type position: int
+        :param position: The position of the spell in ``self.groups``
+
+        :rtype: ``lib.spell.BaseSpell``
+        :return: The spell object, importing the spell if needed
+        """
+        spell = self.spells[position]
+        if spell is None:
+            spell = self.spells[position] = lib.registry.load(
+                self.groups[position]
+            )()
+        return spell
+
+    def pattern(self, position):
+        """
+        :type position: int
+        :param position: The position of the spell in ``self.groups``
+
+        :returns: The compiled `pattern` and `blacklist` of the spell
+        :rtype: ``tuple(re.RegexObject, re.RegexObject)``
+        """
+        patterns = self.patterns[position]
+        if patterns is None:
+            group = self.groups[position]
+            module = position in self.limits and _regex() or re
+            patterns = self.patterns[position] = (
+                module.compile(group['pattern'], FLAGS),
+                module.compile(group['blacklist'], FLAGS)
+            )
+        return patterns
+
+    def plausible(self, query):
+        """
+        :type query: str
+        :param query: The query to route
+
+        :rtype: tuple
+        :return: The (sorted) positions, in ``self.groups``, of the spells
+            which could match ``query``
+        """
+        result = set(self.always)
+        for keyword in self.index.search(query):
+            result.update(self.keywords[keyword])
+        for position in result.intersection(self.limits):
+            if len(query) > self.limit(position):
+                result.discard(position)
+                self.report(position, 'skipped a query of %d characters'
+                            % len(query))
+        return tuple(sorted(result))
+
+    def limit(self, position):
+        """
+        :type position: int
+        :param position: The position of a risky spell in ``self.groups``
+
+        :rtype: int
+        :return: The longest query the spell is tried on, for now
+        """
+        limit, until = self.penalties.get(position, (None, 0))
+        if until > time.time():
+            return limit
+        return self.limits[position]
+
+    def guard(self, position, which, query, default):
+        """
+        Match the pattern or the blacklist of a risky spell within
+        ``budget``
+
+        :type position: int
+        :param position: The position of the spell in ``self.groups``
+
+        :type which: int
+        :param which: 0 for the pattern, 1 for the blacklist
+
+        :type query: str
+        :param query: The query to match
+
+        :param default: What to return if the match takes too long
+
+        :returns: The match, or ``default``
+        """
+        regex = self.pattern(position)[which]
+        start = time.time()
+        try:
+            if isinstance(regex, _PATTERN):
+                found = regex.match(query)
+            else:
+                found = regex.match(query, timeout=self.budget)
+        except TimeoutError:
+            found = default
+        elapsed = time.time() - start
+
+        if elapsed > self.budget:
+            self.penalties[position] = (
+                min(self.limit(position), len(query) // 2),
+                time.time() + self.penalty
+            )
+            self.report(position, 'took %.3fs to match a query of %d '
+                        'characters' % (elapsed, len(query)))
+            return default
+        return found
+
+    def report(self, position, reason):
+        """ Warn that a risky spell is being skipped """
+        group = self.groups[position]
+        warnings.warn('spell:%s %s (%s)' % (
+            group['name'], reason, ', '.join(group['risks'])
+        ), RuntimeWarning)
+
+    def matcher(self, positions):
+        """
+        Build (or reuse) the combined expression for a set of spells
+
+        :type positions: tuple
+        :param positions: As returned by ``plausible``
+
+        :returns: `combined`, `merged`, `standalone` where `merged` is a list
+            of (`position`, `group index`, `number of groups`) for each spell
+            in the `combined` expression and `standalone` the positions of
+            the spells that have to be matched on their own
+        :rtype: ``tuple(re.RegexObject, list, list)``
+        """
+        try:
+            return self.matchers[positions]
+        except KeyError:
+            pass
+
+        merged = []
+        standalone = []
+        parts = []
+        index = 1
+        for position in positions:
+            pattern = self.pattern(position)[0]
+            if position not in self.limits and mergeable(pattern):
+                parts.append('(?:(?=(\n%s\n)))?' % pattern.pattern)
+                merged.append((position, index, pattern.groups))
+                index += pattern.groups + 1
+            else:
+                standalone.append(position)
+
+        if len(self.matchers) >= self.cacheSize:
+            self.matchers.clear()
+        result = self.matchers[positions] = (
+            re.compile(''.join(parts), FLAGS), merged, standalone
+        )
+        return result
+
+    def match(self, query):
+        """
+        Find the spells which could match a query
+
+        :type query: str
+        :param query: The query to route
+
+        :returns: A function which, given the position of one of those
+            spells, returns whether the spell matches and the query is
+            allowed by its blacklist, and the part of the query the spell
+            is interested in, along with the positions of the spells that
+            matched the combined expression or have to be matched on their
+            own (in no particular order). The latter are only matched when
+            passed to the function
+        :rtype: ``tuple(function, list)``
+        """
+        combined, merged, standalone = self.matcher(self.plausible(query))
+        match = combined.match(query)
+        indexes = {}
+        for position, index, groups in merged:
+            if match.start(index) >= 0:
+                indexes[position] = groups and index + 1 or index
+
+        def extract(position):
+            found = indexes.get(position)
+            if found is None:
+                if position in self.limits:
+                    found = self.guard(position, 0, query, None)
+                else:
+                    found = self.pattern(position)[0].match(query)
+                if not found:
+                    return False, ''
+            if position in self.limits:
+                blacklisted = self.guard(position, 1, query, True)
+            else:
+                blacklisted = self.pattern(position)[1].match(query)
+            if blacklisted:
+                return False, ''
+            if isinstance(found, int):
+                return True, match.group(found)
+            elif found.re.groups:
+                return True, found.group(1)
+            return True, found.group()
+
+        return extract, list(indexes) + standalone
+
+    def parse(self, query):
+        """
+        Parse a query with every plausible spell. This is equivalent to
+        calling ``lib.spell.BaseSpell.parse`` on every spell, only faster.
+
+        :type query: str
+        :param query: The query to parse
+
+        :returns: a list of (`score`, `spell`, `query`) tuples, one per
+            matching spell. Spells that do not match are left out
+        :rtype: ``list``
+        """
+        extract, positions = self.match(query)
+        result = []
+        for position in positions:
+            allowed, parsed = extract(position)
+            if allowed:
+                result.append((
+                    self.groups[position]['weight'],
+                    self.spell(position),
+                    parsed
+                ))
+        return result
+
+    def candidates(self, query):
+        """
+        Lazily generate the spells matching a query, best first.
+
+        The single scan of the combined expression only tells which spells
+        matched; those, along with the spells whose patterns are matched on
+        their own (see ``matcher``), are kept in a heap, by weight, and the
+        remaining work (matching the patterns kept out of the combined
+        expression, risky ones included, the blacklist, the capture groups,
+        importing and creating the spell) is only done as each spell is
+        pulled. Spells with a weight of ``-inf`` are never generated.
+
+        The query is routed in its canonical form (see ``lib.canonical``),
+        and each spell canonicalises the part it parsed.
+
+        :type query: str
+        :param query: The query to route
+
+        :returns: ``Candidate`` objects, smallest ``key`` first
+        :rtype: ``generator``
+        """
+        inf = float('inf')
+        extract, positions = self.match(lib.canonical.canonical(query))
+        heap = [
+            (-self.groups[position]['weight'], position)
+            for position in positions
+            if self.groups[position]['weight'] > -inf
+        ]
+        heapq.heapify(heap)
+
+        while heap:
+            key = heapq.heappop(heap)
+            allowed, parsed = extract(key[1])
+            if allowed:
+                spell = self.spell(key[1])
+                yield Candidate(key, -key[0], spell, spell.canonicalise(parsed))
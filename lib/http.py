@@ -0,0 +1,307 @@
+"""
+Keep-alive HTTP connections shared by all the spells.
+
+Every host gets its own ``requests.Session``, whose connections are kept
+open and reused by the following requests to the same host, from any
+spell and any thread. Host names are resolved once and cached for
+``dnsTTL`` seconds, by the connections of these sessions only (see
+``_adapter``). ``warm`` opens connections ahead of time, so that even the
+first query does not wait for them.
+
+The pools are configured by the ``[Config]`` section of ``settings.conf``
+(see ``configure``)::
+
+    # How many connections to keep open to each host
+    HTTP.PoolSize: 4
+    # How long to remember the address of a host, in seconds
+    HTTP.DNSCacheTTL: 300
+
+``requests`` (and everything else this needs to make requests) is only
+imported once the first request is made.
+"""
+import time
+import threading
+import collections
+
+#: How many connections are kept open to each host
+poolSize = 4
+
+#: How long, in seconds, the address of a host is remembered
+dnsTTL = 300
+
+_LOCK = threading.Lock()
+
+#: The sessions, by ``scheme://host[:port]``
+_SESSIONS = {}
+
+#: (`expires`, `addresses`) by (`host`, `port`)
+_DNS = {}
+
+#: Counters by host: requests made, connections opened by them and
+#: by ``warm``, and connections open
+_STATS = collections.defaultdict(
+    lambda: {'requests': 0, 'connections': 0, 'warmed': 0, 'open': 0}
+)
+
+#: Set while ``warm`` opens connections
+_WARMING = threading.local()
+
+#: How long, in seconds, ``warm`` waits for each host
+warmTimeout = 5
+
+#: The adapter class mounted on the sessions (see ``_adapter``)
+_ADAPTER = None
+
+
+def configure(config):
+    """
+    Set the pool size and the DNS cache duration from the configuration.
+    Only sessions created afterwards are affected
+
+    :type config: dict
+    :param config: The configuration (see ``lib.config.load``)
+    """
+    global poolSize, dnsTTL
+    poolSize = int(config.get('HTTP.PoolSize') or poolSize)
+    dnsTTL = float(config.get('HTTP.DNSCacheTTL') or dnsTTL)
+
+
+def origin(url):
+    """
+    :type url: str
+    :param url: Any URL
+
+    :rtype: str
+    :return: ``scheme://host[:port]``, what sessions are shared by
+    """
+    parts = _split(url)
+    return '%s://%s' % (parts.scheme, parts.netloc)
+
+
+def _split(url):
+    """ ``urlsplit``, imported on first use """
+    try:
+        from urllib.parse import urlsplit
+    except ImportError:
+        from urlparse import urlsplit  # Python2.x
+    return urlsplit(url)
+
+
+def session(url):
+    """
+    :type url: str
+    :param url: A URL of the host
+
+    :rtype: ``requests.Session``
+    :return: The session of the host, created if needed
+    """
+    key = origin(url)
+    try:
+        return _SESSIONS[key]
+    except KeyError:
+        pass
+
+    import requests
+
+    with _LOCK:
+        if key not in _SESSIONS:
+            adapter = _adapter()(pool_connections=1, pool_maxsize=poolSize)
+            result = requests.Session()
+            result.mount('http://', adapter)
+            result.mount('https://', adapter)
+            _SESSIONS[key] = result
+    return _SESSIONS[key]
+
+
+def request(method, url, **kwargs):
+    """
+    Same as ``requests.request``, through the session of the host
+
+    :type method: str
+    :param method: ``GET``, ``POST``, ...
+
+    :type url: str
+    :param url: The URL of the resource
+
+    :param kwargs: See ``requests.request``
+
+    :rtype: ``requests.Response``
+    """
+    with _LOCK:
+        _STATS[_split(url).hostname]['requests'] += 1
+    return session(url).request(method, url, **kwargs)
+
+
+def warm(urls):
+    """
+    Open a connection to each host, if there is none yet, by asking it for
+    the headers of its home page. Failures are ignored; the connection
+    will be opened by the first request instead
+
+    :type urls: iterable
+    :param urls: URLs of the hosts
+    """
+    _WARMING.active = True
+    try:
+        for url in urls:
+            counters = _STATS.get(_split(url).hostname)
+            if counters and counters['open']:
+                continue
+            try:
+                session(url).head(origin(url), timeout=warmTimeout)
+            except Exception:
+                pass
+    finally:
+        _WARMING.active = False
+
+
+def stats():
+    """
+    How well connections are being reused
+
+    :rtype: dict
+    :return: The number of ``requests`` made, ``connections`` opened by
+        them, connections opened ahead of time (``warmed``) and connections
+        currently ``open``, along with the ``reuse`` rate (the share of
+        requests which did not have to open a connection). The same, by
+        host, under ``hosts``
+    """
+    with _LOCK:
+        hosts = dict(
+            (host, dict(counters)) for host, counters in _STATS.items()
+        )
+
+    total = {'requests': 0, 'connections': 0, 'warmed': 0, 'open': 0}
+    for counters in hosts.values():
+        counters['reuse'] = _reuse(counters)
+        for key in total:
+            total[key] += counters[key]
+    total['reuse'] = _reuse(total)
+    total['hosts'] = hosts
+    return total
+
+
+def _reuse(counters):
+    """ The share of requests that reused a connection """
+    if not counters['requests']:
+        return 0.0
+    return max(0.0, 1 - float(counters['connections']) / counters['requests'])
+
+
+def _resolve(host, port):
+    """
+    :returns: The addresses of a host, in the order they should be tried,
+        from the cache if possible, and whether they came from the cache
+    :rtype: ``tuple(list, bool)``
+    """
+    import socket
+
+    now = time.time()
+    cached = _DNS.get((host, port))
+    if cached and cached[0] > now:
+        return cached[1], True
+    addresses = []
+    for info in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        if info[4][0] not in addresses:
+            addresses.append(info[4][0])
+    _DNS[(host, port)] = (now + dnsTTL, addresses)
+    return addresses, False
+
+
+def _adapter():
+    """
+    The ``requests`` adapter mounted on the sessions. The connections of
+    its pools resolve host names through the cache, and are counted; the
+    rest of the process (other users of ``requests`` or ``urllib3``) is
+    left alone. Defined on first use, since it needs ``requests``
+
+    :rtype: class
+    :return: A subclass of ``requests.adapters.HTTPAdapter``
+    """
+    global _ADAPTER
+    if _ADAPTER is not None:
+        return _ADAPTER
+
+    import socket
+    import requests.adapters
+    import urllib3.connection
+    import urllib3.connectionpool
+    import urllib3.exceptions
+
+    class Counted(object):
+        """ Resolves host names through the cache, counts the sockets """
+
+        #: The host the socket was counted for, until it is closed
+        counted = None
+
+        def _connect(self, host, addresses):
+            """
+            Connect to the first address that answers, as urllib3 does
+            (on a host with no route to IPv6, only the IPv4 addresses do)
+            """
+            for index, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super(Counted, self)._new_conn()
+                except urllib3.exceptions.ConnectTimeoutError:
+                    if index == len(addresses) - 1:
+                        raise
+                finally:
+                    self._dns_host = host
+
+        def _new_conn(self):
+            host = self._dns_host
+            try:
+                addresses, cached = _resolve(host, self.port)
+            except socket.error:
+                addresses, cached = [host], False  # Reported by urllib3
+            try:
+                sock = self._connect(host, addresses)
+            except urllib3.exceptions.ConnectTimeoutError:
+                if not cached:
+                    raise
+                # The host may have moved, try again with fresh addresses
+                _DNS.pop((host, self.port), None)
+                try:
+                    addresses = _resolve(host, self.port)[0]
+                except socket.error:
+                    addresses = [host]
+                sock = self._connect(host, addresses)
+
+            with _LOCK:
+                if getattr(_WARMING, 'active', False):
+                    _STATS[host]['warmed'] += 1
+                else:
+                    _STATS[host]['connections'] += 1
+                _STATS[host]['open'] += 1
+            self.counted = host
+            return sock
+
+        def close(self):
+            super(Counted, self).close()
+            with _LOCK:
+                if self.counted is not None:
+                    _STATS[self.counted]['open'] -= 1
+                    self.counted = None
+
+    class HTTPConnection(Counted, urllib3.connection.HTTPConnection):
+        pass
+
+    class HTTPSConnection(Counted, urllib3.connection.HTTPSConnection):
+        pass
+
+    class HTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+        ConnectionCls = HTTPConnection
+
+    class HTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+        ConnectionCls = HTTPSConnection
+
+    class Adapter(requests.adapters.HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super(Adapter, self).init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': HTTPConnectionPool, 'https': HTTPSConnectionPool
+            }
+
+    _ADAPTER = Adapter
+    return _ADAPTER
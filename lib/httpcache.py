@@ -0,0 +1,712 @@
+"""
+A cache of the web resources fetched by the spells (see
+``lib.spell.BaseSpell.fetch``).
+
+Responses are kept, compressed, in memory and on disk, keyed by the URL
+and the ``get`` and ``post`` parameters. They are reused for as long as
+``Cache-Control: max-age`` (or ``Expires``) allows, or for
+``lib.spell.BaseSpell.fetchTTL`` seconds if the spell sets it. After
+that, responses carrying an ``ETag`` or a ``Last-Modified`` header are
+revalidated with a conditional request; the body is only downloaded
+again if it changed. Responses to ``POST`` requests are only cached for
+spells that set a ``fetchTTL``.
+
+The decoded result (see ``lib.spell.BaseSpell.fetchFormats``) is cached
+along with the response, so cache hits are not parsed again, and counts
+towards the memory the cache may use. It is shared by every query that
+hits the cache and must not be modified.
+
+Identical requests made at the same time, from threads or from asyncio
+tasks (see ``afetch``), are coalesced: only one of them reaches the
+server, and the others wait for its decoded result (see
+``lib.singleflight``). ``FLIGHTS.stats()`` counts them.
+
+The cache is configured by the ``[Config]`` section of ``settings.conf``
+(see ``configure``)::
+
+    # The directory responses are saved in (empty to keep them in memory)
+    HTTP.CacheDirectory: .httpcache
+    # How many megabytes of responses to keep in memory and on disk
+    HTTP.CacheMemory: 8
+    HTTP.CacheDisk: 64
+"""
+import os
+import re
+import json
+import time
+import zlib
+import threading
+import collections
+
+import lib.deadline
+import lib.singleflight
+
+#: The lifetime of a response is given by ``max-age`` or ``s-maxage``
+#: (compiled on first use, by ``re``)
+_MAX_AGE = r'(?i)(?:^|,)\s*(?:s-)?max-age\s*=\s*"?(\d+)'
+
+#: Responses with these ``Cache-Control`` directives are not reused
+#: without revalidation, or not stored at all
+_NO_CACHE = r'(?i)(?:^|,)\s*(?:no-cache|must-revalidate)\b'
+_NO_STORE = r'(?i)(?:^|,)\s*no-store\b'
+
+
+class Entry(object):
+    """
+    A cached response. It looks enough like a ``requests.Response``
+    (``status_code``, ``headers``, ``content``, ``text`` and ``json()``)
+    for the decoders of ``lib.spell.BaseSpell.fetchFormats``
+
+    :type url: str
+    :param url: The URL of the resource
+
+    :type content: bytes
+    :param content: The body of the response
+
+    :type encoding: str or None
+    :param encoding: The encoding of the body
+
+    :type headers: dict
+    :param headers: The headers of the response
+    """
+
+    def __init__(self, url, content, encoding, headers, status_code=200):
+        self.url = url
+        self.body = zlib.compress(content)
+        self.length = len(content)
+        self.encoding = encoding
+        self.headers = dict(
+            (key.lower(), value) for key, value in headers.items()
+            if key.lower() in ('etag', 'last-modified', 'content-type')
+        )
+        self.status_code = status_code
+        self.expires = 0
+
+        #: The decoded results, by format (see ``Cache.decode``), and how
+        #: much memory they take
+        self.decoded = {}
+        self.decodedSize = 0
+
+    @property
+    def content(self):
+        return zlib.decompress(self.body)
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'UTF-8', 'replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    @property
+    def size(self):
+        """ How much memory the entry takes, decoded results included """
+        return len(self.body) + self.decodedSize
+
+    def validators(self):
+        """
+        :rtype: dict
+        :return: The headers of a conditional request for this resource
+        """
+        headers = {}
+        if 'etag' in self.headers:
+            headers['If-None-Match'] = self.headers['etag']
+        if 'last-modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['last-modified']
+        return headers
+
+    def dump(self):
+        """ :rtype: bytes """
+        meta = json.dumps({
+            'url': self.url, 'length': self.length,
+            'encoding': self.encoding, 'headers': self.headers,
+            'status_code': self.status_code, 'expires': self.expires
+        })
+        return meta.encode('UTF-8') + b'\n' + self.body
+
+    @classmethod
+    def load(cls, data):
+        """ Reverse ``dump`` """
+        meta, _, body = data.partition(b'\n')
+        meta = json.loads(meta.decode('UTF-8'))
+        entry = cls.__new__(cls)
+        entry.__dict__.update(meta)
+        entry.body = body
+        entry.decoded = {}
+        entry.decodedSize = 0
+        return entry
+
+
+def sizeof(value):
+    """
+    :param value: A decoded response (see
+        ``lib.spell.BaseSpell.fetchFormats``): text, bytes, what
+        ``json.loads`` returns, or XML elements
+
+    :rtype: int
+    :return: Roughly how much memory it takes, in bytes
+    """
+    import sys
+
+    size = 0
+    seen = set()
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item)
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, 'getroot'):  # ElementTree
+            stack.append(item.getroot())
+        elif hasattr(item, 'tag') and hasattr(item, 'attrib'):  # Element
+            stack.extend(list(item))
+            stack.extend((item.tag, item.text, item.tail, item.attrib))
+    return size
+
+
+def lifetime(headers, ttl=None):
+    """
+    How long a response can be reused without revalidation
+
+    :type headers: dict
+    :param headers: The headers of the response
+
+    :type ttl: float or None
+    :param ttl: If not ``None``, overrides what the headers say
+
+    :rtype: float or None
+    :return: The lifetime in seconds, or ``None`` if the response must not
+        be stored
+    """
+    control = headers.get('Cache-Control') or ''
+    if re.search(_NO_STORE, control):
+        return None
+    if ttl is not None:
+        return ttl
+    if re.search(_NO_CACHE, control):
+        return 0
+    match = re.search(_MAX_AGE, control)
+    if match:
+        return int(match.group(1))
+    if headers.get('Expires'):
+        import email.utils
+        expires = email.utils.parsedate_tz(headers['Expires'])
+        date = headers.get('Date') and email.utils.parsedate_tz(headers['Date'])
+        if expires is None:
+            return 0  # "Expires: 0" and other invalid dates mean expired
+        return max(0, email.utils.mktime_tz(expires) - (
+            date and email.utils.mktime_tz(date) or time.time()
+        ))
+    return 0
+
+
+def key(url, get=None, post=None):
+    """
+    :rtype: str
+    :return: The key the response to a request is cached under
+    """
+    import hashlib
+
+    return hashlib.sha1(json.dumps(
+        [url, sorted((get or {}).items()), sorted((post or {}).items())],
+        default=str
+    ).encode('UTF-8')).hexdigest()
+
+
+class Cache(object):
+    """
+    The responses, kept in memory and optionally on disk. When either is
+    full, the least recently used responses are evicted from memory, and
+    the oldest ones from disk
+
+    :type maxMemory: int
+    :param maxMemory: How many bytes to keep in memory
+
+    :type directory: str or None
+    :param directory: Where responses are saved, ``None`` to only keep
+        them in memory
+
+    :type maxDisk: int
+    :param maxDisk: How many bytes to keep on disk
+    """
+
+    def __init__(self, maxMemory=8 << 20, directory=None, maxDisk=64 << 20):
+        self.maxMemory = maxMemory
+        self.directory = directory
+        self.maxDisk = maxDisk
+        self.lock = threading.Lock()
+        self.memory = collections.OrderedDict()
+        self.memorySize = 0
+        self.disk = None  # Size of each file, listed on first use
+        self.diskSize = 0
+        self.counters = collections.Counter()
+
+    def get(self, name):
+        """
+        :type name: str
+        :param name: See ``key``
+
+        :rtype: ``Entry`` or None
+        """
+        with self.lock:
+            entry = self.memory.pop(name, None)
+            if entry is not None:
+                self.memory[name] = entry  # Most recently used
+                return entry
+
+        if not self.directory:
+            return None
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                entry = Entry.load(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+        self._remember(name, entry)
+        return entry
+
+    def put(self, name, entry):
+        """
+        :type name: str
+        :param name: See ``key``
+
+        :type entry: ``Entry``
+        :param entry: The response
+        """
+        self._remember(name, entry)
+        if self.directory:
+            self._save(name, entry)
+
+    def forget(self, name):
+        """
+        Drop a response, so that it is fetched again
+
+        :type name: str
+        :param name: See ``key``
+        """
+        with self.lock:
+            entry = self.memory.pop(name, None)
+            if entry is not None:
+                self.memorySize -= entry.size
+            if self.disk is not None and name in self.disk:
+                self.diskSize -= self.disk.pop(name)
+        if self.directory:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def decode(self, name, entry, format, decode):
+        """
+        Decode a response, or reuse the result of a previous call. The
+        result is kept along with the response, and counts towards the
+        memory it takes (see ``sizeof``); it is not kept if that would be
+        more than the whole cache
+
+        :type name: str
+        :param name: See ``key``
+
+        :type entry: ``Entry``
+        :param entry: The response
+
+        :type format: str
+        :param format: The name of the format decoded by ``decode``
+
+        :type decode: function
+        :param decode: Decodes the response
+
+        :returns: The decoded response
+        """
+        try:
+            return entry.decoded[format]
+        except KeyError:
+            pass
+        result = decode(entry)
+        size = sizeof(result)
+        with self.lock:
+            if format not in entry.decoded and (
+                entry.size + size <= self.maxMemory
+            ):
+                entry.decoded[format] = result
+                entry.decodedSize += size
+                if self.memory.get(name) is entry:
+                    self.memorySize += size
+                    self._evict()
+        return result
+
+    def _remember(self, name, entry):
+        with self.lock:
+            previous = self.memory.pop(name, None)
+            if previous is not None:
+                self.memorySize -= previous.size
+            self.memory[name] = entry
+            self.memorySize += entry.size
+            self._evict()
+
+    def _evict(self):
+        """ Make room in memory; the lock must be held """
+        while self.memorySize > self.maxMemory and len(self.memory) > 1:
+            self.memorySize -= self.memory.popitem(last=False)[1].size
+            self.counters['evicted'] += 1
+
+    def _save(self, name, entry):
+        data = entry.dump()
+        path = os.path.join(self.directory, name)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            getattr(os, 'replace', os.rename)(path + '.tmp', path)
+        except (IOError, OSError):
+            return
+
+        with self.lock:
+            if self.disk is None:
+                self._list()
+            self.diskSize += len(data) - self.disk.pop(name, 0)
+            self.disk[name] = len(data)
+            evicted = []
+            while self.diskSize > self.maxDisk and len(self.disk) > 1:
+                oldest, size = self.disk.popitem(last=False)
+                self.diskSize -= size
+                evicted.append(oldest)
+        for oldest in evicted:
+            try:
+                os.remove(os.path.join(self.directory, oldest))
+            except OSError:
+                pass
+
+    def _list(self):
+        """ Find the files saved by previous runs, oldest first """
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.tmp'):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_mtime, name, stat.st_size))
+        self.disk = collections.OrderedDict(
+            (name, size) for mtime, name, size in sorted(files)
+        )
+        self.diskSize = sum(self.disk.values())
+
+    def stats(self):
+        """
+        :rtype: dict
+        :return: The number of ``hits``, ``revalidated`` responses,
+            ``misses`` and ``evicted`` responses, and how many bytes are
+            kept in ``memory`` and on ``disk``
+        """
+        with self.lock:
+            if self.disk is None and self.directory and (
+                os.path.isdir(self.directory)
+            ):
+                self._list()
+            result = dict(
+                (name, self.counters[name])
+                for name in ('hits', 'revalidated', 'misses', 'evicted')
+            )
+            result.update(memory=self.memorySize, disk=self.diskSize)
+        return result
+
+
+#: The cache used by ``lib.spell.BaseSpell.fetch``
+CACHE = Cache()
+
+
+#: The fetches in progress, by key and format
+FLIGHTS = lib.singleflight.Group()
+
+
+def configure(config):
+    """
+    Replace ``CACHE`` by one set up by the configuration
+
+    :type config: dict
+    :param config: The configuration (see ``lib.config.load``)
+    """
+    global CACHE
+    CACHE = Cache(
+        maxMemory=_megabytes(config, 'HTTP.CacheMemory', 8),
+        directory=config.get('HTTP.CacheDirectory', '.httpcache') or None,
+        maxDisk=_megabytes(config, 'HTTP.CacheDisk', 64)
+    )
+
+
+def _megabytes(config, name, default):
+    """ A size in megabytes from the configuration, in bytes """
+    return int(float(config.get(name) or default) * (1 << 20))
+
+
+def fetch(url, post=None, get=None, format='raw', decode=None, ttl=None,
+          cache=None, policy=None, limit=None):
+    """
+    Fetch and decode a resource, through the cache
+
+    :type url: str
+    :param url: The URL of the resource
+
+    :type post: dict or None
+    :param post: The payload of a ``POST`` request
+
+    :type get: dict or None
+    :param get: The query string
+
+    :type format: str
+    :param format: The name of the format decoded by ``decode``
+
+    :type decode: function
+    :param decode: Decodes a response
+
+    :type ttl: float or None
+    :param ttl: How long the response can be reused, overriding what its
+        headers say
+
+    :type cache: ``Cache`` or None
+    :param cache: Defaults to ``CACHE``
+
+    :type policy: ``lib.retry.Policy`` or None
+    :param policy: How to try again, or race, failing or slow requests
+
+    :type limit: ``lib.ratelimit.Limit`` or None
+    :param limit: The quota requests are made within
+
+    :returns: The decoded response
+    :raises: ``requests.HTTPError``, ``lib.deadline.DeadlineExceeded``,
+        ``lib.ratelimit.QuotaExceeded``
+    """
+    function = _fetcher(url, post, get, format, decode, ttl, cache or CACHE,
+                        policy, limit)
+    if post and ttl is None:
+        return function()  # Not cacheable, nor shared
+    return FLIGHTS.do(
+        (key(url, get, post), format), function, lib.deadline.remaining()
+    )
+
+
+def afetch(url, post=None, get=None, format='raw', decode=None, ttl=None,
+           cache=None, policy=None, limit=None, loop=None):
+    """
+    Same as ``fetch``, for asyncio. The request is made in the default
+    executor of the loop
+
+    :type loop: ``asyncio.AbstractEventLoop`` or None
+    :param loop: Defaults to the running loop
+
+    :rtype: ``asyncio.Future``
+    :return: Resolves to the decoded response
+    """
+    function = _fetcher(url, post, get, format, decode, ttl, cache or CACHE,
+                        policy, limit)
+    # The executor's threads do not share the caller's deadline
+    deadline = lib.deadline.current() or lib.deadline.Deadline()
+
+    def run():
+        with deadline:
+            return function()
+
+    if post and ttl is None:
+        import asyncio
+
+        loop = loop or asyncio.get_event_loop()
+        return loop.run_in_executor(None, run)
+    return FLIGHTS.future((key(url, get, post), format), run, loop)
+
+
+def _fetcher(url, post, get, format, decode, ttl, cache, policy, limit):
+    """
+    :rtype: function
+    :return: Fetches the resource, trying again as the policy says
+    """
+    if post and policy is not None and not policy.posts:
+        policy = None  # Sent once (see ``lib.retry``)
+    if post and ttl is None:
+        # Not cacheable, unless the spell says otherwise
+        def once():
+            return decode(_request(url, post, get, {}, policy, limit))
+    else:
+        def once():
+            return _fetch(url, post, get, format, decode, ttl, cache, policy,
+                          limit)
+
+    if policy is None:
+        return once
+    name = key(url, get, post)
+    return lambda: policy.run(once, lambda result: cache.forget(name))
+
+
+def _fetch(url, post, get, format, decode, ttl, cache, policy, limit):
+    """ ``fetch``, once coalesced """
+    name = key(url, get, post)
+    entry = cache.get(name)
+    now = time.time()
+    if entry is not None and entry.expires > now:
+        cache.counters['hits'] += 1
+    else:
+        headers = entry is not None and entry.validators() or {}
+        response = _request(url, post, get, headers, policy, limit)
+        life = lifetime(response.headers, ttl)
+        if entry is not None and response.status_code == 304:
+            cache.counters['revalidated'] += 1
+            entry.expires = now + (life or 0)
+            for header in ('etag', 'last-modified'):
+                if response.headers.get(header):
+                    entry.headers[header] = response.headers[header]
+            cache.put(name, entry)
+        else:
+            cache.counters['misses'] += 1
+            entry = Entry(url, response.content, response.encoding,
+                          response.headers, response.status_code)
+            if life is not None and (life > 0 or entry.validators()):
+                entry.expires = now + life
+                cache.put(name, entry)
+
+    return cache.decode(name, entry, format, decode)
+
+
+#: How many bytes ``stream`` reads at a time
+_CHUNK = 4096
+
+
+def stream(url, post=None, get=None, lines=True, limit=None, until=None,
+           quota=None):
+    """
+    Fetch a resource bit by bit, bypassing the cache, for spells that
+    only need a small part of it. The transfer stops as soon as the spell
+    stops reading, ``limit`` bytes have been read or a line (or chunk)
+    matches ``until``.
+
+    :type url: str
+    :param url: The URL of the resource
+
+    :type post: dict or None
+    :param post: The payload of a ``POST`` request
+
+    :type get: dict or None
+    :param get: The query string
+
+    :type lines: bool
+    :param lines: Whether to yield lines, rather than chunks of text as
+        they arrive
+
+    :type limit: int or None
+    :param limit: How many bytes to read, at most
+
+    :type until: str or regular expression or None
+    :param until: Stop after the first line (or chunk) it is found in
+
+    :type quota: ``lib.ratelimit.Limit`` or None
+    :param quota: The quota the request is made within
+
+    :rtype: generator
+    :return: The lines (without their line endings) or chunks, as ``str``
+    :raises: ``requests.HTTPError``, ``lib.deadline.DeadlineExceeded``
+    """
+    response = _request(url, post, get, {}, limit=quota, stream=True)
+
+    def pieces():
+        try:
+            for piece in read(response.iter_content(_CHUNK),
+                              response.encoding or 'UTF-8',
+                              lines, limit, until):
+                yield piece
+        finally:
+            response.close()  # Drops the rest of the transfer
+
+    return pieces()
+
+
+def read(chunks, encoding='UTF-8', lines=True, limit=None, until=None):
+    """
+    Decode the pieces of a body as they arrive (see ``stream``)
+
+    :type chunks: iterable
+    :param chunks: The body, as ``bytes``
+
+    :type encoding: str
+    :param encoding: The encoding of the body
+
+    :rtype: generator
+    :return: The lines or chunks of text
+    """
+    import codecs
+
+    if until is not None and not hasattr(until, 'search'):
+        until = re.compile(until)
+    decoder = codecs.getincrementaldecoder(encoding)('replace')
+    size = 0
+    pending = ''
+    for chunk in chunks:
+        if limit is not None:
+            chunk = chunk[:max(0, limit - size)]
+        size += len(chunk)
+        text = decoder.decode(chunk)
+        if lines:
+            pending += text
+            found = pending.split('\n')
+            pending = found.pop()
+        else:
+            found = text and [text] or []
+        for piece in found:
+            yield piece.rstrip('\r') if lines else piece
+            if until is not None and until.search(piece):
+                return
+        if limit is not None and size >= limit:
+            break
+
+    pending += decoder.decode(b'', True)
+    if pending:
+        yield pending.rstrip('\r') if lines else pending
+
+
+def _request(url, post, get, headers, policy=None, limit=None,
+             stream=False):
+    """
+    Make the request, raising an exception unless it succeeded. It times
+    out when the current deadline expires (see ``lib.deadline``), is not
+    made at all if the host keeps failing (see ``lib.breaker``) or over
+    quota (see ``lib.ratelimit``), and is hedged as the policy says (see
+    ``lib.retry.Policy.send``) unless it counts against a quota. With
+    ``stream``, the body is only downloaded as it is read
+    """
+    import lib.http
+    import lib.breaker
+
+    def send():
+        timeout = lib.deadline.timeout()
+        if post:
+            response = lib.http.request(
+                'POST', url, data=post, params=get, headers=headers,
+                timeout=timeout, stream=stream
+            )
+        else:
+            response = lib.http.request(
+                'GET', url, params=get, headers=headers, timeout=timeout,
+                stream=stream
+            )
+        response.raise_for_status()
+        return response
+
+    def attempt():
+        # Out of time (or cancelled, see ``lib.wizard.ask``), the request
+        # is not made: neither the quota nor the host's breaker are involved
+        deadline = lib.deadline.current()
+        if deadline is not None:
+            deadline.check()
+        if limit is not None:
+            limit.acquire(lib.deadline.remaining())
+        return lib.breaker.call(url, send)
+
+    if policy is None:
+        response = attempt()
+    else:
+        response = policy.send(attempt, hedge=limit is None)
+    if response.encoding is None and response.status_code != 304 and (
+        not stream
+    ):
+        response.encoding = response.apparent_encoding
+    return response
@@ -0,0 +1,204 @@
+import re
+import collections
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+#: Stands for "any decimal digit" in a set of keywords (``\d``)
+DIGIT = '\\d'
+
+#: Sets of exact strings larger than this are not expanded any further
+_MAX_EXACT = 64
+
+_REPEATS = tuple(
+    getattr(sre_parse, name)
+    for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(sre_parse, name)
+)
+
+
+def required(pattern, flags=re.IGNORECASE | re.VERBOSE):
+    """
+    Find the literal keywords that a query must contain in order to
+    match ``pattern``.
+
+    The result is a set of alternatives: at least one of them is found,
+    lower cased, in every string that ``pattern`` matches. For example,
+    ``What\\s+is\\s+(.+)\\s+(?:weather|forecast)`` requires one of
+    ``weather`` or ``forecast`` (the longer, more selective keywords
+    are preferred over ``what`` and ``is``). ``DIGIT`` stands for
+    any decimal digit.
+
+    :type pattern: str
+    :param pattern: A spell pattern (see ``lib.spell.BaseSpell.pattern``)
+
+    :type flags: int
+    :param flags: The flags the pattern is compiled with
+
+    :rtype: frozenset or None
+    :return: The keywords, or ``None`` when nothing in particular is
+        required (``.*`` for instance)
+    """
+    try:
+        return _sequence(sre_parse.parse(pattern, flags))
+    except (re.error, TypeError, ValueError):
+        return None
+
+
+def _strength(keywords):
+    """ How selective a set of keywords is; larger is better """
+    return (min(len(item) - (item == DIGIT) for item in keywords),
+            -len(keywords))
+
+
+def _keywords(strings):
+    """ Turn a set of literal strings into keywords """
+    strings = frozenset(string.lower() for string in strings)
+    for string in strings:
+        if not string or '\\' in string or max(map(ord, string)) > 127:
+            return None
+    return strings
+
+
+def _exact(op, av):
+    """ The exact strings matched by an expression, if there are few """
+    if op == sre_parse.LITERAL:
+        return set([chr(av)])
+    elif op == sre_parse.SUBPATTERN:
+        subpattern = av[-1]
+    elif op == sre_parse.BRANCH:
+        result = set()
+        for branch in av[1]:
+            strings = _exact(sre_parse.SUBPATTERN, (branch,))
+            if strings is None:
+                return None
+            result.update(strings)
+        return result
+    else:
+        return None
+
+    result = set([''])
+    for item in subpattern:
+        strings = _exact(*item)
+        if strings is None or len(result) * len(strings) > _MAX_EXACT:
+            return None
+        result = set(a + b for a in result for b in strings)
+    return result
+
+
+def _sequence(subpattern):
+    """ The best keywords for a sequence of expressions """
+    candidates = []
+    current = set([''])
+    for op, av in list(subpattern) + [(None, None)]:
+        strings = op is not None and _exact(op, av)
+        if strings and len(current) * len(strings) <= _MAX_EXACT:
+            current = set(a + b for a in current for b in strings)
+            continue
+        candidates.append(_keywords(current))
+        current = set([''])
+        if strings:
+            current = strings
+        elif op is not None:
+            candidates.append(_item(op, av))
+
+    best = None
+    for keywords in candidates:
+        if keywords and (
+            best is None or _strength(keywords) > _strength(best)
+        ):
+            best = keywords
+    return best
+
+
+def _item(op, av):
+    """ The keywords required by a single (non-literal) expression """
+    if op == sre_parse.SUBPATTERN:
+        return _sequence(av[-1])
+    elif op == sre_parse.BRANCH:
+        result = set()
+        for branch in av[1]:
+            keywords = _sequence(branch)
+            if not keywords:
+                return None
+            result.update(keywords)
+        return frozenset(result)
+    elif op in _REPEATS:
+        minimum, _, subpattern = av
+        return minimum and _sequence(subpattern) or None
+    elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+        return _sequence(av)
+    elif op == sre_parse.IN and av == [
+        (sre_parse.CATEGORY, sre_parse.CATEGORY_DIGIT)
+    ]:
+        return frozenset([DIGIT])
+    return None
+
+
+class KeywordIndex(object):
+    """
+    An Aho-Corasick automaton which finds all the keywords that occur
+    in a string in one pass, no matter how many keywords there are.
+
+    :type keywords: iterable
+    :param keywords: The (lower case) keywords to search for. ``DIGIT``
+        matches any decimal digit
+    """
+
+    def __init__(self, keywords):
+        self.digit = False
+        self.goto = [{}]
+        self.output = [set()]
+
+        for keyword in set(keywords):
+            if keyword == DIGIT:
+                self.digit = True
+                continue
+            state = 0
+            for char in keyword:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.output.append(set())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].add(keyword)
+
+        # Breadth first, so that the failure link of a state is always
+        # complete before the states below it are visited
+        self.fail = [0] * len(self.goto)
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] |= self.output[self.fail[child]]
+
+    def search(self, text):
+        """
+        :type text: str
+        :param text: The string to search; case is ignored
+
+        :rtype: set
+        :return: The keywords found in ``text``
+        """
+        text = getattr(text, 'casefold', text.lower)()
+        found = set()
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        if self.digit and any(char.isdigit() for char in text):
+            found.add(DIGIT)
+        return found
@@ -0,0 +1,241 @@
+"""
+Keep the answers to popular and predictable queries cached, so that they
+are (almost) never asked for while their answers are being fetched.
+
+The daemon (see ``lib.wizard.Wizard``) counts how often each query is
+asked; the counts halve every ``halfLife`` seconds, so that only queries
+asked recently stay popular. Every ``interval`` seconds, the ``top``
+most popular queries, along with the queries the spells expect (see
+``lib.spell.BaseSpell.predict``), are answered again in the background
+when their cached answers (see ``lib.answercache``) are about to expire.
+
+Prefetching gives way to the queries being answered: it runs in a
+single thread, one query at a time with a pause in between, and only
+uses a spell's quota (see ``lib.ratelimit``) while at least half of it
+is left. Spells whose hosts are failing (see ``lib.breaker``) are left
+alone.
+
+How many queries are kept warm is set by the ``[Config]`` section of
+``settings.conf``::
+
+    # How many of the most popular queries the daemon keeps answered
+    # ahead of time (default: 20, 0 not to prefetch anything)
+    Query.Prefetch: 20
+"""
+from __future__ import print_function
+
+import sys
+import time
+import threading
+import collections
+
+import lib.breaker
+import lib.deadline
+import lib.canonical
+import lib.answercache
+import lib.wizard
+
+#: How many of the most popular queries are prefetched by default
+TOP = 20
+
+
+class Scheduler(object):
+    """
+    Counts the queries, and prefetches the popular ones in a thread of its
+    own (see ``start``)
+
+    :type dispatcher: ``lib.dispatch.Dispatcher``
+    :param dispatcher: Routes the queries to the spells
+
+    :type config: dict
+    :param config: The (validated) configuration
+
+    :type store: ``dict`` or one of ``lib.store``
+    :param store: Where the spells' state is kept
+
+    :type top: int
+    :param top: How many of the most popular queries to prefetch
+
+    :type interval: float
+    :param interval: How often to look for answers about to expire, in
+        seconds
+
+    :type halfLife: float
+    :param halfLife: How long it takes for the count of a query to halve,
+        in seconds
+
+    :type pause: float
+    :param pause: How long to wait after each query prefetched, in seconds
+
+    :type maxQueries: int
+    :param maxQueries: How many queries to count at most; the least
+        popular ones are forgotten first
+    """
+
+    def __init__(self, dispatcher, config, store, top=TOP, interval=30.0,
+                 halfLife=3600.0, pause=0.5, maxQueries=1000):
+        self.dispatcher = dispatcher
+        self.config = config
+        self.store = store
+        self.top = top
+        self.interval = interval
+        self.halfLife = halfLife
+        self.pause = pause
+        self.maxQueries = maxQueries
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.counters = collections.Counter()
+
+        #: The count of each query, when it was last updated, and the
+        #: query, by ``lib.canonical.key``
+        self.queries = {}
+
+    def _decay(self, count, age):
+        return count * 0.5 ** (age / self.halfLife)
+
+    def record(self, query):
+        """
+        Count a query
+
+        :type query: str
+        :param query: The query, as asked
+        """
+        query = lib.canonical.canonical(query)
+        name = lib.canonical.key(query)
+        now = time.time()
+        with self.lock:
+            count, updated, _ = self.queries.get(name, (0.0, now, query))
+            self.queries[name] = (
+                self._decay(count, now - updated) + 1, now, query
+            )
+            if len(self.queries) > self.maxQueries:
+                # Forget the least popular half
+                ranked = sorted(
+                    self.queries.items(),
+                    key=lambda item: self._decay(
+                        item[1][0], now - item[1][1]
+                    )
+                )
+                for forgotten, entry in ranked[:len(ranked) // 2]:
+                    del self.queries[forgotten]
+
+    def hot(self):
+        """
+        :rtype: list
+        :return: The ``top`` most popular queries, most popular first.
+            Queries asked only once are not popular
+        """
+        now = time.time()
+        with self.lock:
+            ranked = sorted((
+                (self._decay(count, now - updated), query)
+                for count, updated, query in self.queries.values()
+            ), reverse=True)
+        return [query for count, query in ranked[:self.top] if count > 1]
+
+    def predicted(self):
+        """
+        :rtype: list
+        :return: The queries the spells expect (see
+            ``lib.spell.BaseSpell.predict``); only the spells which
+            override it are imported
+        """
+        queries = []
+        for position, group in enumerate(self.dispatcher.groups):
+            if not group['predicts']:
+                continue
+            spell = self.dispatcher.spell(position)
+            queries.extend(spell.predict(self.config) or ())
+        return queries
+
+    def run(self):
+        """ Prefetch the predicted and popular queries, if needed """
+        done = set()
+        for query in self.predicted() + self.hot():
+            name = lib.canonical.key(lib.canonical.canonical(query))
+            if name in done:
+                continue
+            done.add(name)
+            if self.stopped.is_set():
+                return
+            if self.prefetch(query):
+                self.stopped.wait(self.pause)
+
+    def prefetch(self, query):
+        """
+        Answer a query again if its cached answer is about to expire,
+        trying its spells in order like ``lib.wizard.ask``
+
+        :type query: str
+        :param query: The query
+
+        :rtype: bool
+        :return: Whether a spell was asked
+        """
+        asked = False
+        soon = time.time() + 2 * self.interval  # Before the next run
+        for candidate in self.dispatcher.candidates(query):
+            spell = candidate.spell
+            if not spell.cacheTTL:
+                break  # Its answers are not cached anyway
+            expires = lib.answercache.expires(
+                spell, candidate.query, self.config
+            )
+            if expires is not None and expires > soon:
+                break
+            if not lib.breaker.available(spell.hosts) or (
+                spell.rateLimit and not spell.rateLimit.spare()
+            ):
+                self.counters['deferred'] += 1
+                break
+
+            name = lib.answercache.key(spell, candidate.query, self.config)
+            if not lib.answercache.CACHE.claim(name):
+                break  # Already being refreshed
+            asked = True
+            try:
+                result, state = lib.wizard._incant(
+                    candidate, self.config, self.store,
+                    lib.deadline.Deadline(lib.deadline.DEFAULT),
+                    lib.wizard._BACKGROUND
+                )
+            finally:
+                lib.answercache.CACHE.release(name)
+            if result is not None:
+                self.store[spell.__class__.__name__] = state
+                self.counters['prefetched'] += 1
+                break
+            self.counters['failed'] += 1
+        return asked
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            try:
+                self.run()
+            except Exception as e:
+                print('Warning: prefetching failed: %s' % e, file=sys.stderr)
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        """ Prefetch in the background, until ``stop`` is called """
+        thread = threading.Thread(target=self._loop)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """ Stop prefetching """
+        self.stopped.set()
+
+    def stats(self):
+        """
+        :rtype: dict
+        :return: How many queries were ``prefetched``, could not be
+            (``failed``), or were put off because of the spells' quotas or
+            failing hosts (``deferred``), and the ``hot`` queries
+        """
+        result = dict(
+            (name, self.counters[name])
+            for name in ('prefetched', 'failed', 'deferred')
+        )
+        result['hot'] = self.hot()
+        return result
@@ -0,0 +1,203 @@
+"""
+Stay within the quotas of the web services the spells use.
+
+A spell declares its ``rateLimit`` next to its ``config`` (see
+``lib.spell.BaseSpell.rateLimit``), as a token bucket: ``Limit('60/minute',
+burst=10)`` lets 10 requests through at once, and one more every second
+after that. Requests beyond that wait in a short queue, for as long as
+the query's deadline allows (see ``lib.deadline``); when the queue is
+full, or the wait would be too long, ``QuotaExceeded`` is raised and
+``lib.wizard.ask`` moves on to the next spell.
+
+Only requests that reach the service count: responses served from the
+cache (see ``lib.httpcache``) do not. A ``Limit`` is shared by every
+thread of the process, such as the daemon's workers, and can be shared
+by several spells using the same service.
+
+Limits with a ``name`` are saved in the spells' store (see ``lib.store``
+and ``configure``), so that quotas over long periods (``2000/month``)
+hold across runs of ``troz.py`` and restarts of the daemon; the others
+start full in every process. Processes running at the same time do not
+share their limits: the last one to save wins.
+"""
+import time
+import threading
+import collections
+
+#: Seconds in each unit of a rate
+_UNITS = {
+    'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400,
+    'month': 86400 * 30
+}
+
+
+#: Where the named limits are saved (see ``configure``)
+_STORE = None
+
+
+def configure(store):
+    """
+    Save the named limits in a store, and load them from it
+
+    :type store: ``dict`` or one of ``lib.store``
+    :param store: Usually the spells' store (see ``lib.wizard.Wizard``)
+    """
+    global _STORE
+    _STORE = store
+
+
+class QuotaExceeded(IOError):
+    """ The request would go over the quota of the service """
+
+
+class Limit(object):
+    """
+    A token bucket
+
+    :type rate: str or float
+    :param rate: How many requests are allowed, such as ``'60/minute'``
+        or ``'2000/month'``; a number is per second
+
+    :type burst: int
+    :param burst: How many requests can be made at once
+
+    :type queue: int
+    :param queue: How many requests can wait for their turn
+
+    :type wait: float
+    :param wait: How long a request can wait for its turn, in seconds
+
+    :type name: str or None
+    :param name: What the limit is saved as (see ``configure``), usually
+        the name of the service; ``None`` not to save it
+    """
+
+    def __init__(self, rate, burst=1, queue=4, wait=2.0, name=None):
+        self.rate = parse(rate)
+        self.burst = burst
+        self.queue = queue
+        self.wait = wait
+        self.name = name
+        self.lock = threading.Lock()
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.counters = collections.Counter()
+
+        #: The store the limit was loaded from, and is saved to
+        self.store = None
+
+    def _refill(self, now):
+        self._load(now)
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def _load(self, now):
+        """ Pick up where the last process left, once per store """
+        store = _STORE
+        if self.name is None or store is self.store:
+            return
+        self.store = store
+        saved = store is not None and store.get('Quota:' + self.name)
+        if saved:
+            self.tokens = min(self.burst, float(saved['tokens']))
+            self.updated = min(now, float(saved['updated']))
+
+    def _save(self):
+        if self.store is not None:
+            self.store['Quota:' + self.name] = {
+                'tokens': self.tokens, 'updated': self.updated
+            }
+
+    def _delay(self, budget):
+        """ How long the next request would wait, or None if too long """
+        delay = max(0.0, (1 - self.tokens) / self.rate)
+        if -self.tokens >= self.queue or delay > self.wait or (
+            budget is not None and delay >= budget
+        ):
+            return None
+        return delay
+
+    def available(self, budget=None):
+        """
+        :type budget: float or None
+        :param budget: How long the request could wait, at most
+
+        :rtype: bool
+        :return: Whether a request made now would be let through
+        """
+        with self.lock:
+            self._refill(time.time())
+            return self._delay(budget) is not None
+
+    def spare(self, share=0.5):
+        """
+        :type share: float
+        :param share: The part of the ``burst`` that must be left
+
+        :rtype: bool
+        :return: Whether there is room for requests that can wait, such as
+            prefetching (see ``lib.prefetch``), without getting in the way
+            of the others
+        """
+        with self.lock:
+            self._refill(time.time())
+            return self.tokens >= max(1, self.burst * share)
+
+    def acquire(self, budget=None):
+        """
+        Wait for the turn of a request
+
+        :type budget: float or None
+        :param budget: How long the request can wait, at most, in seconds
+
+        :raises: ``QuotaExceeded`` if it would have to wait too long
+        """
+        with self.lock:
+            self._refill(time.time())
+            delay = self._delay(budget)
+            if delay is None:
+                self.counters['rejected'] += 1
+                raise QuotaExceeded(
+                    'Over quota, %d requests waiting' % max(0, -self.tokens)
+                )
+            self.tokens -= 1  # Reserved, even while waiting for it
+            self.counters['granted'] += 1
+            self._save()
+            if delay:
+                self.counters['waited'] += 1
+        if delay:
+            time.sleep(delay)
+
+    def stats(self):
+        """
+        :rtype: dict
+        :return: How many ``tokens`` are left, and how many requests were
+            ``granted``, had to wait (``waited``) or were ``rejected``
+        """
+        with self.lock:
+            self._refill(time.time())
+            result = dict(
+                (name, self.counters[name])
+                for name in ('granted', 'waited', 'rejected')
+            )
+            result['tokens'] = round(self.tokens, 2)
+        return result
+
+
+def parse(rate):
+    """
+    :type rate: str or float
+    :param rate: See ``Limit``
+
+    :rtype: float
+    :return: The rate, in requests per second
+    """
+    if isinstance(rate, (int, float)):
+        return float(rate)
+    count, _, unit = rate.partition('/')
+    unit = unit.strip().rstrip('s')
+    if unit not in _UNITS:
+        raise ValueError('Invalid rate: %s' % rate)
+    return float(count) / _UNITS[unit]
@@ -1,30 +1,279 @@
 import os
+import sys
 import imp
-import inspect
-import pkgutil
+import json
+import importlib
+import threading
 import collections
 
+import lib.keywords
+
 REGISTRY = collections.defaultdict(
-    lambda: {'spell': None, 'test': None, 'enabled': True}
+    lambda: {'spell': None, 'test': None, 'enabled': True, 'entry': None}
+)
+
+#: The groups by (lower case) spell name and test name,
+#: see ``lookup_by_name``
+_BY_NAME = {}
+_BY_TEST = {}
+
+#: The entry point group under which installed packages list their
+#: spells, for example in ``setup.py``:
+#:
+#: .. code-block:: Python
+#:
+#:    entry_points={'troz.spells': ['Weather = troz_weather.spell:Weather']}
+ENTRY_POINTS = 'troz.spells'
+
+#: The name of the file, under the spell directory, in which
+#: ``discover`` caches what it knows about the spells
+MANIFEST = '.manifest.json'
+
+#: Bump whenever the content of the manifest changes
+MANIFEST_VERSION = 5
+
+#: Serializes imports, spells may be loaded from several threads
+_LOCK = threading.RLock()
+
+#: The spell attributes saved in the manifest
+_RECORD = (
+    'root', 'module', 'name', 'doc', 'weight',
+    'pattern', 'blacklist', 'config', 'keywords', 'risks', 'entry',
+    'hosts', 'predicts'
 )
 
 
-def collect(root='spells'):
+def modules(root='spells'):
     """
-    Recursively find and import all modules under `root`
+    Recursively find all modules under `root`, without importing them
 
     :type root: str
     :param root: The directory to start the module searching at
+
+    :rtype: generator
+    :return: (`directory`, `name`, `path`) of each module found
     """
+    # Same as walking pkgutil.iter_modules, without its cost (and its
+    # import of inspect), which adds up with many spells
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isfile(os.path.join(path, '__init__.py')):
+            for item in modules(path):
+                yield item
+        elif name.endswith('.py') and name != '__init__.py':
+            yield root, name[:-3], path
+
 
-    for loader, name, ispkg in pkgutil.iter_modules([root]):
-        collect(os.path.join(root, name))
-        fid, pathname, desc = imp.find_module(name, [root])
+def entry_points(group=ENTRY_POINTS):
+    """
+    Find the spells installed by packages, without importing them
+
+    :type group: str
+    :param group: The entry point group (see ``ENTRY_POINTS``)
+
+    :rtype: list
+    :return: (`name`, `value`, `version`) of each entry point, where `value`
+        is ``module:Class`` and `version` the version of the package
+    """
+    try:
+        from importlib import metadata
+    except ImportError:
+        try:
+            import pkg_resources  # Python2.x
+        except ImportError:
+            return []
+        return sorted(
+            (item.name, '%s:%s' % (item.module_name, '.'.join(item.attrs)),
+             item.dist and item.dist.version)
+            for item in pkg_resources.iter_entry_points(group)
+        )
+
+    found = metadata.entry_points()
+    if hasattr(found, 'select'):
+        found = found.select(group=group)
+    else:
+        found = found.get(group, [])  # Python 3.8, 3.9
+    return sorted(
+        (item.name, item.value,
+         getattr(getattr(item, 'dist', None), 'version', None))
+        for item in found
+    )
+
+
+def collect(root='spells', tests=True, entryPoints=ENTRY_POINTS):
+    """
+    Recursively find and import all modules under `root`, as well as
+    the spells installed by packages
+
+    :type root: str
+    :param root: The directory to start the module searching at
+
+    :type tests: bool
+    :param tests: If false, test modules (``test.py``) are not imported
+
+    :type entryPoints: str or None
+    :param entryPoints: The entry point group of the installed spells (see
+        ``ENTRY_POINTS``), ``None`` to skip them
+    """
+
+    for directory, name, path in modules(root):
+        if tests or name != 'test':
+            _import(directory, name)
+
+    for name, value, version in entryPoints and entry_points(entryPoints) or []:
+        cls = _resolve(value)
+        REGISTRY[get_root(cls)]['entry'] = value
+
+
+def _resolve(value):
+    """ Import the class named by an entry point (``module:Class``) """
+    module, _, attrs = value.partition(':')
+    result = importlib.import_module(module)
+    for attr in attrs.split('.'):
+        result = getattr(result, attr)
+    return result
+
+
+def _import(directory, name):
+    """ Import module `name` from `directory` """
+    fid, pathname, desc = imp.find_module(name, [directory])
+    try:
+        imp.load_module(name, fid, pathname, desc)
+    finally:
         if fid:
-            imp.load_module(name, fid, pathname, desc)
             fid.close()
 
 
+def discover(root='spells', entryPoints=ENTRY_POINTS):
+    """
+    Register all the spells under `root`, and the ones installed by
+    packages, without importing them, using the manifest (see
+    ``MANIFEST``) saved by a previous call.
+
+    The manifest is rebuilt, by importing all the spell modules (but not
+    the tests), whenever a module under `root` is added, removed or
+    modified, or a package providing spells is installed, removed or
+    upgraded. Spell classes are then imported on demand by ``load``.
+
+    :type root: str
+    :param root: The directory to start the module searching at
+
+    :type entryPoints: str or None
+    :param entryPoints: See ``collect``
+    """
+
+    stamps = {}
+    for directory, name, path in modules(root):
+        stat = os.stat(path)
+        stamps[path] = [stat.st_mtime, stat.st_size]
+    for name, value, version in entryPoints and entry_points(entryPoints) or []:
+        stamps['%s = %s' % (name, value)] = [version]
+    path = os.path.join(root, MANIFEST)
+
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        manifest = None
+
+    if (
+        manifest and manifest.get('version') == MANIFEST_VERSION and
+        manifest.get('files') == stamps
+    ):
+        for record in manifest['spells']:
+            group = REGISTRY[record['root']]
+            if 'name' in group:
+                continue  # Already imported
+            group.update(record)
+            group['config'] = _loadConfig(record['config'])
+            if record['keywords'] is not None:
+                group['keywords'] = frozenset(record['keywords'])
+            _index(group)
+        return
+
+    collect(root, tests=False, entryPoints=entryPoints)
+    records = []
+    for group in all():
+        if group['spell'] is None:
+            continue
+        record = dict((key, group[key]) for key in _RECORD)
+        record['config'] = _dumpConfig(group['config'])
+        if group['keywords'] is not None:
+            record['keywords'] = sorted(group['keywords'])
+        records.append(record)
+
+    try:
+        with open(path, 'w') as f:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'files': stamps,
+                'spells': records
+            }, f)
+    except (IOError, OSError):
+        pass  # Read only; we'll just have to import everything next time
+
+
+def _dumpConfig(config):
+    """
+    Make a spell's ``config`` serializable by replacing the types by
+    their (`module`, `name`), or ``None`` for the types that cannot be
+    imported by name (a ``lambda`` for instance)
+    """
+    result = {}
+    for key, value in config.items():
+        if isinstance(value, (list, tuple)):
+            expectedType, expectedValues = value[0], list(value[1:])
+        else:
+            expectedType, expectedValues = value, None
+        name = getattr(expectedType, '__name__', '<lambda>')
+        module = getattr(expectedType, '__module__', None)
+        try:
+            if getattr(importlib.import_module(module), name) is not \
+                    expectedType:
+                module = name = None
+        except (ImportError, AttributeError, TypeError, ValueError):
+            module = name = None
+        result[key] = [module, name, expectedValues]
+    return result
+
+
+def _loadConfig(config):
+    """
+    Reverse ``_dumpConfig``. The types that could not be saved are
+    ``None``; ``lib.config.validate`` imports the spell to get them, if
+    the spell is enabled
+    """
+    result = {}
+    for key, (module, name, expectedValues) in config.items():
+        expectedType = module and getattr(importlib.import_module(module), name)
+        if expectedValues is None:
+            result[key] = expectedType
+        else:
+            result[key] = [expectedType] + expectedValues
+    return result
+
+
+def load(group):
+    """
+    Import the spell of a group, if it has not been imported yet
+
+    :type group: dict
+    :param group: See ``lookup_by_name``
+
+    :rtype: class
+    :return: The spell class
+    """
+    with _LOCK:
+        if group['spell'] is None and group['entry']:
+            _resolve(group['entry'])
+        elif group['spell'] is None:
+            directory, name = os.path.split(
+                os.path.splitext(group['module'])[0]
+            )
+            _import(directory, name)
+    return group['spell']
+
+
 def register(**kwargs):
     """
     Register a new spell or test. Classes are automatically grouped
@@ -35,11 +284,56 @@ def register(**kwargs):
 
     :type test: str
     :param test: If specified, register a new test
+
+    The literal keywords required by a spell's pattern are extracted
+    here, once (see ``lib.keywords.required``), and its pattern and
+    blacklist are checked for catastrophic backtracking (see
+    ``lib.backtrack.risks``). Whether it predicts queries is recorded too,
+    so that only the spells that do are imported by ``lib.prefetch``
     """
     for key, cls in kwargs.items():
         root = get_root(cls)
-        REGISTRY[root][key] = cls
-        REGISTRY[root]['root'] = root
+        group = REGISTRY[root]
+        group[key] = cls
+        group['root'] = root
+        if key == 'spell':
+            if (group.get('pattern'), group.get('blacklist')) != (
+                cls.pattern, cls.blacklist
+            ):
+                # Not known yet, from the manifest (see ``discover``)
+                import lib.backtrack
+                group['keywords'] = lib.keywords.required(cls.pattern)
+                group['risks'] = (lib.backtrack.risks(cls.pattern) +
+                                  lib.backtrack.risks(cls.blacklist))
+            group.update({
+                'module': os.path.realpath(_getfile(cls)),
+                'name': cls.__name__,
+                'doc': cls.__doc__,
+                'weight': cls.weight,
+                'pattern': cls.pattern,
+                'blacklist': cls.blacklist,
+                'config': cls.config,
+                'hosts': list(cls.hosts),
+                'predicts': _overrides(cls, 'predict')
+            })
+        _index(group)
+
+
+def _overrides(cls, name):
+    """ Whether spell class `cls` overrides method `name` of the base spell """
+    import lib.spell
+    method = getattr(cls, name)
+    default = getattr(lib.spell.BaseSpell, name)
+    return getattr(method, '__func__', method) is not \
+        getattr(default, '__func__', default)
+
+
+def _index(group):
+    """ Add a group to the name and test indexes """
+    if group.get('name'):
+        _BY_NAME.setdefault(group['name'].lower(), group)
+    if group['test']:
+        _BY_TEST.setdefault(group['test'].__name__.lower(), group)
 
 
 def get_root(cls):
@@ -52,7 +346,19 @@ def get_root(cls):
     :rtype: str
     :return: The parent directory path
     """
-    return os.path.realpath(os.path.split(inspect.getfile(cls))[0])
+    return os.path.realpath(os.path.split(_getfile(cls))[0])
+
+
+def _getfile(cls):
+    """
+    ``inspect.getfile``; importing ``inspect`` takes longer than importing
+    most spells, so it is only done when the module has no ``__file__``
+    """
+    module = sys.modules.get(cls.__module__)
+    if getattr(module, '__file__', None):
+        return module.__file__
+    import inspect
+    return inspect.getfile(cls)
 
 
 def lookup_by_name(**kwargs):
@@ -69,16 +375,27 @@ def lookup_by_name(**kwargs):
     :return: The group matchinging the given arguments
 
     The result will be a dictionary with the following keys:
-        * `spell`: A class deriving from `lib.spell.BaseSpell`
+        * `spell`: A class deriving from `lib.spell.BaseSpell`, or ``None``
+            if it has not been imported yet (see ``discover`` and ``load``)
         * 'test': A class driving from `lib.test.Shaman`
         * 'enabled`: If false, a required configuration is missing.
             Spells are disabled by `lib.config.validate`
+        * `keywords`: The keywords a query needs to contain to be matched
+            by the spell (see ``lib.keywords.required``)
+        * `risks`: Why the spell's pattern or blacklist could take very
+            long to match, if it could (see ``lib.backtrack.risks``)
+        * `predicts`: Whether the spell expects queries of its own (see
+            ``lib.spell.BaseSpell.predict``)
+        * `name`, `doc`, `weight`, `pattern`, `blacklist`, `config`,
+            `hosts`: The attributes of the spell class, available without
+            importing it
+        * `module`: The path of the module that defines the spell
     """
 
-    for item in all():
-        for key, value in kwargs.items():
-            if item[key] and item[key].__name__.lower() == value.lower():
-                return item
+    for key, value in kwargs.items():
+        index = key == 'spell' and _BY_NAME or _BY_TEST
+        if value.lower() in index:
+            return index[value.lower()]
 
 
 def all():
@@ -92,6 +409,16 @@ def all():
     return REGISTRY.values()
 
 
+def configured():
+    """
+    Return all registered spells which require configuration values
+
+    :rtype: generator
+    :return: The groups (see `lookup_by_name`) with a ``config``
+    """
+    return (value for value in REGISTRY.values() if value.get('config'))
+
+
 def enabled():
     """
     Return all registered spells in which the 'enabled' value
@@ -0,0 +1,257 @@
+"""
+Try fetching again when it fails, and race slow requests.
+
+Every spell has a ``Policy`` (see ``lib.spell.BaseSpell.retry``), which
+``lib.spell.BaseSpell.fetch`` follows:
+
+    * requests that fail (connection errors, timeouts and the
+      ``statuses`` of the policy) and responses the spell does not
+      ``accept`` are tried again, up to ``attempts`` times in all, after
+      a random delay which doubles each time (exponential backoff with
+      full jitter);
+    * requests slower than most (the ``hedge`` percentile of the latest
+      ones) are sent a second time, and whichever answers first is used.
+
+``POST`` requests are neither tried again nor hedged, unless the policy
+allows it (``posts``): the service may well have acted on the first one.
+
+Requests are never tried again, nor sent twice, when the query's
+deadline (see ``lib.deadline``) would not leave time for it. Requests
+counted against a quota (see ``lib.ratelimit``) are never sent twice:
+the second one would spend a token on an answer already on its way.
+"""
+import time
+import random
+import threading
+import collections
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python2.x
+
+import lib.breaker
+import lib.deadline
+import lib.ratelimit
+
+#: How many requests a policy needs to have timed before hedging
+SAMPLES = 10
+
+_LOCK = threading.Lock()
+
+#: How many requests were tried again, sent twice (``hedged``), and won
+#: by the second request (``hedgesWon``)
+_STATS = collections.Counter()
+
+
+class Policy(object):
+    """
+    How a spell's requests are tried again and hedged
+
+    :type attempts: int
+    :param attempts: How many times to try, at most
+
+    :type backoff: float
+    :param backoff: The longest delay before the first retry, in seconds;
+        it doubles with each retry
+
+    :type maximum: float
+    :param maximum: The longest delay before any retry, in seconds
+
+    :type statuses: tuple
+    :param statuses: The HTTP status codes worth trying again
+
+    :type accept: function or None
+    :param accept: Called with the decoded response; returns false if it
+        should be fetched again, for example when the service sometimes
+        answers with blank data
+
+    :type hedge: float or None
+    :param hedge: The percentile (between 0 and 1) of the latency of the
+        latest requests after which a request is sent a second time;
+        ``None`` never to do so
+
+    :type samples: int
+    :param samples: How many of the latest latencies are kept
+
+    :type posts: bool
+    :param posts: Whether ``POST`` requests are tried again and hedged
+        too, for services where sending one twice does no harm
+    """
+
+    def __init__(self, attempts=2, backoff=0.25, maximum=2.0,
+                 statuses=(429, 500, 502, 503, 504), accept=None,
+                 hedge=None, samples=100, posts=False):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.maximum = maximum
+        self.statuses = statuses
+        self.accept = accept
+        self.hedge = hedge
+        self.posts = posts
+        self.latencies = collections.deque(maxlen=samples)
+
+    def copy(self):
+        """
+        :rtype: ``Policy``
+        :return: The same policy, with latencies of its own
+        """
+        return Policy(self.attempts, self.backoff, self.maximum,
+                      self.statuses, self.accept, self.hedge,
+                      self.latencies.maxlen, self.posts)
+
+    def retryable(self, error):
+        """
+        :type error: Exception
+        :param error: Why a request failed
+
+        :rtype: bool
+        :return: Whether trying again could help
+        """
+        if not isinstance(error, IOError) or isinstance(error, (
+            lib.deadline.DeadlineExceeded, lib.breaker.CircuitOpenError,
+            lib.ratelimit.QuotaExceeded
+        )):
+            return False
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+        return status is None or status in self.statuses
+
+    def delay(self, retry):
+        """
+        :type retry: int
+        :param retry: How many retries were made so far
+
+        :rtype: float
+        :return: How long to wait before the next one, in seconds
+        """
+        return random.uniform(0, min(self.maximum, self.backoff * 2 ** retry))
+
+    def run(self, function, rejected=None):
+        """
+        Call ``function`` until it succeeds, or there are no attempts or
+        no time left
+
+        :type function: function
+        :param function: Fetches and decodes a resource
+
+        :type rejected: function or None
+        :param rejected: Called with each result not accepted, before
+            trying again
+
+        :returns: What ``function`` returned last
+        :raises: What ``function`` raised last
+        """
+        retry = 0
+        while True:
+            try:
+                result = function()
+            except Exception as e:
+                if not self.retryable(e) or not self._wait(retry):
+                    raise
+            else:
+                if self.accept is None or self.accept(result):
+                    return result
+                if rejected is not None:
+                    rejected(result)
+                if not self._wait(retry):
+                    return result
+            retry += 1
+
+    def _wait(self, retry):
+        """ Wait before trying again, if there is room for it """
+        if retry + 1 >= self.attempts:
+            return False
+        delay = self.delay(retry)
+        left = lib.deadline.remaining()
+        if left is not None and delay >= left:
+            return False
+        with _LOCK:
+            _STATS['retries'] += 1
+        time.sleep(delay)
+        return True
+
+    def threshold(self):
+        """
+        :rtype: float or None
+        :return: How long to wait for a request before sending it again,
+            or ``None`` not to
+        """
+        if self.hedge is None or len(self.latencies) < SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge))]
+
+    def send(self, function, hedge=True):
+        """
+        Make a request, and make it a second time if it takes longer than
+        ``threshold``
+
+        :type function: function
+        :param function: Makes the request and returns the response
+
+        :type hedge: bool
+        :param hedge: Whether the request may be made a second time at
+            all; not when it is counted against a quota
+
+        :returns: The first response
+        :raises: What ``function`` raised, if both requests failed
+        """
+        after = self.threshold() if hedge else None
+        left = lib.deadline.remaining()
+        if after is None or left is not None and after >= left:
+            return self._timed(function)
+
+        deadline = lib.deadline.current() or lib.deadline.Deadline()
+        finished = queue.Queue()
+
+        def attempt(hedged):
+            try:
+                with deadline:
+                    finished.put((hedged, self._timed(function), None))
+            except Exception as e:
+                finished.put((hedged, None, e))
+
+        self._start(attempt, False)
+        try:
+            outcomes = [finished.get(timeout=after)]
+        except queue.Empty:
+            with _LOCK:
+                _STATS['hedged'] += 1
+            self._start(attempt, True)
+            outcomes = [finished.get()]
+            if outcomes[0][2] is not None:
+                outcomes.append(finished.get())  # Maybe the other succeeds
+
+        for hedged, response, error in outcomes:
+            if error is None:
+                if hedged:
+                    with _LOCK:
+                        _STATS['hedgesWon'] += 1
+                return response
+        raise outcomes[0][2]
+
+    def _timed(self, function):
+        """ Call ``function``, remembering how long it took """
+        start = time.time()
+        result = function()
+        self.latencies.append(time.time() - start)
+        return result
+
+    @staticmethod
+    def _start(target, hedged):
+        thread = threading.Thread(target=target, args=(hedged,))
+        thread.daemon = True
+        thread.start()
+
+
+def stats():
+    """
+    :rtype: dict
+    :return: How many requests were tried again (``retries``), sent a
+        second time (``hedged``), and answered first the second time
+        (``hedgesWon``)
+    """
+    with _LOCK:
+        return dict(
+            (name, _STATS[name]) for name in ('retries', 'hedged', 'hedgesWon')
+        )
@@ -0,0 +1,155 @@
+"""
+Make a single call for identical requests that are in progress at the
+same time.
+
+When the same resource is asked for by many queries at once (everyone
+asking for the weather at 8am), the first one fetches it and the others
+wait for its result instead of fetching it again. Both threads (``do``)
+and asyncio tasks (``future``) can wait, on the same calls.
+"""
+import threading
+import collections
+
+import lib.deadline
+
+
+class _Call(object):
+    """ A call in progress, and the callers waiting for it """
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+        #: Called with the call once it is done (see ``Group.future``)
+        self.callbacks = []
+
+    def outcome(self):
+        """ The result of the call, or raise its exception """
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class Group(object):
+    """
+    Calls in progress, by key. Callers using the same key while a call
+    is in progress share its result (or its exception)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.counters = collections.Counter()
+
+    def _join(self, key):
+        """
+        :returns: The call in progress for ``key``, created if needed, and
+            whether the caller has to make it
+        :rtype: ``tuple(_Call, bool)``
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.counters['coalesced'] += 1
+                return call, False
+            call = self.calls[key] = _Call()
+            self.counters['calls'] += 1
+            return call, True
+
+    def _run(self, key, call, function):
+        """ Make the call, then hand its result to everyone waiting """
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+        finally:
+            with self.lock:
+                # Callers arriving from now on make a new call
+                del self.calls[key]
+                callbacks = call.callbacks
+                call.callbacks = []
+            call.done.set()
+            for callback in callbacks:
+                callback(call)
+        return call
+
+    def do(self, key, function, timeout=None):
+        """
+        Call ``function``, unless a call with the same key is already in
+        progress, in which case wait for it instead
+
+        :type key: hashable
+        :param key: Identifies the call
+
+        :type function: function
+        :param function: Takes no argument
+
+        :type timeout: float or None
+        :param timeout: How long to wait for a call in progress, in seconds
+
+        :returns: What ``function`` returned
+        :raises: What ``function`` raised, or
+            ``lib.deadline.DeadlineExceeded`` if the call in progress took
+            longer than ``timeout``
+        """
+        call, first = self._join(key)
+        if first:
+            self._run(key, call, function)
+        elif not call.done.wait(timeout):
+            raise lib.deadline.DeadlineExceeded(
+                'Gave up waiting for the same request'
+            )
+        return call.outcome()
+
+    def future(self, key, function, loop=None):
+        """
+        Same as ``do``, for asyncio: ``function`` is run in the default
+        executor of the loop, which is not blocked while waiting
+
+        :type loop: ``asyncio.AbstractEventLoop`` or None
+        :param loop: Defaults to the running loop
+
+        :rtype: ``asyncio.Future``
+        :return: Resolves to what ``function`` returned
+        """
+        import asyncio
+
+        loop = loop or asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def settle(call):
+            if future.cancelled():
+                return
+            if call.error is not None:
+                future.set_exception(call.error)
+            else:
+                future.set_result(call.result)
+
+        def notify(call):
+            loop.call_soon_threadsafe(settle, call)
+
+        call, first = self._join(key)
+        with self.lock:
+            waiting = key in self.calls and self.calls[key] is call
+            if waiting:
+                call.callbacks.append(notify)
+        if first:
+            loop.run_in_executor(None, self._run, key, call, function)
+        elif not waiting:
+            settle(call)  # Finished in the meantime
+        return future
+
+    def stats(self):
+        """
+        :rtype: dict
+        :return: The number of ``calls`` made, of callers which waited
+            for a call in progress instead (``coalesced``) and of calls
+            currently in progress (``inflight``)
+        """
+        with self.lock:
+            return {
+                'calls': self.counters['calls'],
+                'coalesced': self.counters['coalesced'],
+                'inflight': len(self.calls)
+            }
@@ -1,12 +1,75 @@
 import re
 import datetime
-import requests
-
-from xml.etree import ElementTree as ETree
 
+import lib.retry
+import lib.deadline
 import lib.registry
 
 
+class XMLStream(object):
+    """
+    An XML document, parsed as it is read (the ``xml-stream`` format of
+    ``BaseSpell.fetch``). Instead of building the whole tree, ``iter``
+    yields the elements one at a time and then drops them, so a spell can
+    stop reading as soon as it has found what it needs:
+
+    .. code-block:: python
+
+        data = self.fetch(url, format='xml-stream')
+        if data.attrib.get('success') == 'true':
+            for pod in data.iter('pod'):
+                ...
+
+    It can be read as many times as needed.
+
+    :param response: Has the document, as bytes, in ``content``
+    """
+
+    def __init__(self, response):
+        self.response = response
+
+    def _parse(self, events):
+        # Only loaded when needed; most queries never decode any XML
+        import io
+        from xml.etree import ElementTree as ETree
+
+        content = self.response.content
+        if not content:
+            return iter(())
+        return ETree.iterparse(io.BytesIO(content), events)
+
+    @property
+    def attrib(self):
+        """ The attributes of the root element; only the start is read """
+        for event, element in self._parse(('start',)):
+            return dict(element.attrib)
+        return {}
+
+    def iter(self, tag=None):
+        """
+        :type tag: str or None
+        :param tag: Only yield the elements with this tag
+
+        :rtype: generator
+        :return: The elements, complete with their children, in the order
+            in which they end. Once the spell moves on, every child of the
+            root is cleared as soon as it ends
+        """
+        depth = 0
+        for event, element in self._parse(('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if tag is None or element.tag == tag:
+                yield element
+            if depth == 1:
+                element.clear()
+
+    def __iter__(self):
+        return self.iter()
+
+
 class _BaseSpellMeta(type):
     """
     This is used to override the default metaclass to intercept
@@ -15,6 +78,9 @@ class _BaseSpellMeta(type):
     """
     def __init__(cls, name, bases, class_dict):
         if name != 'BaseSpell':
+            if 'retry' not in class_dict:
+                # The latencies hedging relies on are the spell's own
+                cls.retry = cls.retry.copy()
             lib.registry.register(spell=cls)
 BaseSpellMeta = _BaseSpellMeta('BaseSpell', (object,), {})
 
@@ -75,32 +141,88 @@ class BaseSpell(BaseSpellMeta):
     #: Nested values are not supported
     config = dict()
 
+    #: The URLs of the hosts the spell fetches from, such as
+    #: ``('http://api.duckduckgo.com',)``. Connections to them are
+    #: opened ahead of time (see ``lib.http.warm``)
+    hosts = ()
+
+    #: How long, in seconds, the resources fetched by the spell can be
+    #: reused, whatever their ``Cache-Control`` headers say. Defaults to
+    #: ``None``: the headers decide (see ``lib.httpcache``)
+    fetchTTL = None
+
+    #: How long, in seconds, the spell's answers can be reused for the
+    #: same query (see ``lib.answercache``). Defaults to ``0``: the spell
+    #: is asked every time, as it should be when its answers are random or
+    #: change all the time
+    cacheTTL = 0
+
+    #: How long, in seconds, an answer older than ``cacheTTL`` is still
+    #: used, while the spell is asked again in the background
+    #: (stale-while-revalidate, see ``lib.answercache``). Defaults to
+    #: ``0``: old answers are never used
+    cacheGrace = 0
+
+    #: The quota of the web service the spell uses, as a
+    #: ``lib.ratelimit.Limit`` such as ``Limit('60/minute', burst=10)``.
+    #: Queries are passed on to the next spell rather than go over it.
+    #: Give it a ``name`` for it to be saved along with the spells' state,
+    #: which long periods (``'2000/month'``) need. Defaults to ``None``:
+    #: no limit
+    rateLimit = None
+
+    #: How failed or slow fetches are tried again (see
+    #: ``lib.retry.Policy``). By default, requests failing because of the
+    #: network or the server are tried a second time, if the query has
+    #: time left; ``POST`` requests are not. Each spell gets a copy of the
+    #: policy it inherits, with latencies of its own
+    retry = lib.retry.Policy()
+
     #: :returns: date a object preset to today
     #: :rtype: ``datetime.date``
     today = datetime.date.today
 
     def xml(request):
-        if request.text:
-            try:
-                return ETree.fromstring(request.text)
-            except UnicodeEncodeError:
-                return ETree.fromstring(request.text.encode('UTF-8'))
+        # Only loaded when needed; most queries never decode any XML
+        from xml.etree import ElementTree as ETree
+
+        if request.content:
+            # From the bytes, letting the parser find out their encoding
+            return ETree.fromstring(request.content)
         else:
             return ETree.ElementTree()
 
+    def json(request):
+        import json
+
+        content = request.content
+        if not content.strip():
+            return {}
+        try:
+            return json.loads(content)
+        except TypeError:
+            # Python < 3.6 only reads JSON from text
+            return json.loads(content.decode(request.encoding or 'UTF-8'))
+
     fetchFormats = {
         'raw': lambda request: request.text,
-        'json': lambda request: request.text and request.json() or {},
-        'xml': xml
+        'bytes': lambda request: request.content,
+        'json': json,
+        'xml': xml,
+        'xml-stream': XMLStream
     }
 
     def __init__(self):
         self.pattern = re.compile(self.pattern, re.IGNORECASE | re.VERBOSE)
         self.blacklist = re.compile(self.blacklist, re.IGNORECASE | re.VERBOSE)
 
-    def fetch(self, url, post=None, get=None, format='raw'):
+    def fetch(self, url, post=None, get=None, format='raw', limit=None,
+              until=None):
         """
-        Retrieve and return a web resource
+        Retrieve and return a web resource. Connections are kept
+        open and shared with the other spells (see ``lib.http``),
+        responses are cached (see ``lib.httpcache``), and identical
+        fetches made at the same time are only made once
 
         :type url: str
         :param url: The URL of the resource to retrieve
@@ -123,32 +245,83 @@ class BaseSpell(BaseSpellMeta):
         Valid values for **format** are:
             * **raw** -- return the result without any post-processing.
                 Returns a ``str``
+            * **bytes** -- return the body as it was received, without
+                decoding it. Returns ``bytes``
             * **json** -- decode the result as a JSON; returns a ``dict``
             * **xml** -- decode the result as XML. Returns an
                 ``ElementTree`` object
+            * **xml-stream** -- decode the result as XML, one element
+                at a time. Returns a ``lib.spell.XMLStream``
+            * **lines** -- download the resource as it is read, and stop
+                as soon as the spell has what it needs (see
+                ``lib.httpcache.stream``). Returns a generator of lines
+            * **chunks** -- same as **lines**, with chunks of text as they
+                arrive instead of lines
+
+        :type limit: int or None
+        :param limit: For **lines** and **chunks**, how many bytes to
+            download at most
+
+        :type until: str or None
+        :param until: For **lines** and **chunks**, a regular expression;
+            the download stops after the first line (or chunk) it is
+            found in
+
+        The request times out when the spell runs out of time (see
+        ``remaining``), and is tried again as ``retry`` says. Resources
+        fetched as **lines** or **chunks** are neither cached nor tried
+        again.
 
         :returns: The result retrieved from the resource decoded with
             the post-processor specified in ``format``
         :rtype: `mixed`
-        :raises: ``ValueError``, ``HTTPError``
+        :raises: ``ValueError``, ``HTTPError``,
+            ``lib.deadline.DeadlineExceeded``
         """
+        # Importing requests is slow, and not every query needs it
+        import lib.httpcache
+
+        if format in ('lines', 'chunks'):
+            return lib.httpcache.stream(
+                url, post=post, get=get, lines=format == 'lines',
+                limit=limit, until=until, quota=self.rateLimit
+            )
+
         try:
-            if post:
-                request = requests.post(url, data=post)
-            if get:
-                request = requests.get(url, params=get)
-            else:
-                request = requests.get(url)
+            decode = self.fetchFormats[format]
+        except KeyError:
+            raise ValueError('Invalid format: %s' % format)
 
-            request.raise_for_status()
+        return lib.httpcache.fetch(
+            url, post=post, get=get, format=format, decode=decode,
+            ttl=self.fetchTTL, policy=self.retry, limit=self.rateLimit
+        )
 
-            try:
-                return self.fetchFormats[format](request)
-            except KeyError:
-                raise ValueError('Invalid format: %s' % format)
+    def afetch(self, url, post=None, get=None, format='raw'):
+        """
+        Same as ``fetch``, for spells defining ``aincantation``:
+
+        .. code-block:: python
+
+            data = await self.afetch(url, format='json')
 
-        except requests.exceptions.HTTPError:
-            raise
+        The request is made in a thread of the event loop's default
+        executor, so the loop is not blocked while waiting for it.
+
+        :rtype: ``asyncio.Future``
+        :return: Resolves to the decoded resource
+        """
+        import lib.httpcache
+
+        try:
+            decode = self.fetchFormats[format]
+        except KeyError:
+            raise ValueError('Invalid format: %s' % format)
+
+        return lib.httpcache.afetch(
+            url, post=post, get=get, format=format, decode=decode,
+            ttl=self.fetchTTL, policy=self.retry, limit=self.rateLimit
+        )
 
     def parse(self, query):
         """
@@ -160,6 +333,9 @@ class BaseSpell(BaseSpellMeta):
                 ``self.pattern``, then the first matching group
                 is returned
 
+        Queries that do not match, or are blacklisted, get a score of
+        ``-inf``.
+
         :type query: str
         :param query: The query to parse
         :returns: a tuple of (`score`, `spell`, `query`)
@@ -168,7 +344,7 @@ class BaseSpell(BaseSpellMeta):
         match = self.pattern.match(query)
         if match:
             if self.blacklist.match(query):
-                return None, self, float('-inf')
+                return float('-inf'), self, ''
             groups = match.groups()
             if groups:
                 return self.weight, self, groups[0]
@@ -176,6 +352,37 @@ class BaseSpell(BaseSpellMeta):
                 return self.weight, self, query[match.start():match.end()]
         return float('-inf'), self, ''
 
+    def canonicalise(self, query):
+        """
+        Put the part of a query the spell parsed in a canonical form, so
+        that questions meaning the same get the same answer, and hit the
+        same cache entries (see ``lib.canonical``). For example, a weather
+        spell could map ``tonight's`` and ``now`` onto ``today``. The
+        query is left as is by default.
+
+        :type query: str
+        :param query: The query, as returned by ``parse``
+
+        :rtype: str
+        :return: What ``incantation`` is given
+        """
+        return query
+
+    def predict(self, config):
+        """
+        The queries the spell expects to be asked, such as the weather
+        where the user lives. Their answers are kept cached by the daemon
+        (see ``lib.prefetch``), for spells with a ``cacheTTL``. There are
+        none by default.
+
+        :type config: dict
+        :param config: The user configuration
+
+        :rtype: list
+        :return: The queries, as a user would ask them
+        """
+        return []
+
     def incantation(self, query, config, state):
         """
         :type query: str
@@ -195,5 +402,43 @@ class BaseSpell(BaseSpellMeta):
         """
         raise NotImplementedError("This must be provided by the spell!")
 
+    def aincantation(self, query, config, state):
+        """
+        Same as ``incantation``, for asyncio (see ``lib.aio``). Spells can
+        define it as ``async def aincantation``, fetching with
+        ``afetch``; by default, ``incantation`` is run in the event loop's
+        default executor.
+
+        :rtype: awaitable
+        :return: Resolves to `result`, `state`
+        """
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        deadline = lib.deadline.current() or lib.deadline.Deadline()
+
+        def run():
+            with deadline:
+                return self.incantation(query, config, state)
+
+        return loop.run_in_executor(None, run)
+
+    def fallback(self, query, config, state):
+        """
+        Answer without going over the network, when the query ran out of
+        time or every spell failed (see ``lib.wizard.ask``). Same
+        arguments and results as ``incantation``; the default is not to
+        answer (``None``)
+        """
+        return None, state
+
+    def remaining(self):
+        """
+        :rtype: float or None
+        :return: How many seconds the spell has left to answer, or ``None``
+            if there is no limit (see ``lib.deadline``)
+        """
+        return lib.deadline.remaining()
+
     def __str__(self):
         return self.__class__.__name__
@@ -0,0 +1,114 @@
+"""
+Where the spells' state is persisted between queries.
+
+A store is anything with ``get(name)`` and item assignment (so a plain
+``dict`` will do), plus an optional ``flush()`` to persist what has
+changed. The state of each spell must be serializable to JSON.
+"""
+import os
+import json
+import threading
+
+try:
+    import dbm
+except ImportError:
+    import anydbm as dbm
+
+
+class MemoryStore(dict):
+    """ Keeps the state in memory only """
+
+    def flush(self):
+        pass
+
+
+class JSONStore(object):
+    """
+    Keeps the state of all the spells in a single JSON file, which is
+    read once and only rewritten by ``flush`` if something changed.
+
+    :type fileName: str
+    :param fileName: The JSON file
+    """
+
+    def __init__(self, fileName='save.db'):
+        self.fileName = fileName
+        self.lock = threading.Lock()
+
+        #: Held while the file is written, by one ``flush`` at a time
+        self.writing = threading.Lock()
+
+        #: How many times the state changed, and how many of these
+        #: changes are in the file
+        self.changes = 0
+        self.saved = 0
+        if os.path.exists(fileName):
+            with open(fileName) as f:
+                self.data = json.load(f)
+        else:
+            self.data = {}
+
+    def get(self, name, default=None):
+        return self.data.get(name, default)
+
+    def __setitem__(self, name, state):
+        with self.lock:
+            self.data[name] = state
+            self.changes += 1
+
+    def flush(self):
+        """
+        Write the file, if anything changed. The file is replaced in one
+        go, so that it is never seen half written. Flushes from several
+        threads (such as the daemon's, see ``lib.daemon``) write one after
+        the other, each with the latest state; should writing fail, the
+        next flush tries again
+        """
+        with self.writing:
+            with self.lock:
+                if self.saved == self.changes:
+                    return
+                changes = self.changes
+                data = json.dumps(self.data)
+
+            with open(self.fileName + '.tmp', 'w') as f:
+                f.write(data)
+            getattr(os, 'replace', os.rename)(
+                self.fileName + '.tmp', self.fileName
+            )
+            self.saved = changes
+
+
+class DBMStore(object):
+    """
+    Keeps the state of each spell under its own key in a ``dbm``
+    database, so saving the state of a spell only writes that spell's
+    state.
+
+    :type fileName: str
+    :param fileName: The database file
+    """
+
+    def __init__(self, fileName='save.dbm'):
+        self.lock = threading.Lock()
+        self.db = dbm.open(fileName, 'c')
+
+    def get(self, name, default=None):
+        with self.lock:
+            try:
+                return json.loads(self.db[name].decode('UTF-8'))
+            except KeyError:
+                return default
+
+    def __setitem__(self, name, state):
+        with self.lock:
+            self.db[name] = json.dumps(state).encode('UTF-8')
+
+    def flush(self):
+        with self.lock:
+            if hasattr(self.db, 'sync'):
+                self.db.sync()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
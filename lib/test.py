@@ -5,7 +5,6 @@ import sys
 import json
 import types
 import inspect
-import requests
 import tempfile
 import datetime
 import itertools
@@ -22,8 +21,10 @@ else:
 
 import spells
 import lib
+import lib.http
 import lib.spell
 import lib.registry
+import lib.canonical
 
 
 class WebMock(object):
@@ -41,6 +42,11 @@ class WebMock(object):
             spec=True,
             side_effect=self.mock_fetch
         )
+        self.amock = mock.patch(
+            'lib.spell.BaseSpell.afetch',
+            spec=True,
+            side_effect=self.mock_afetch
+        )
 
     def route(self, url, file, post=None, get=None, format='raw'):
         """
@@ -64,39 +70,61 @@ class WebMock(object):
             :param format: Only requests asking for the same format will be
                 handled
         """
-        with open(os.path.join(self.root, file), 'r') as f:
+        with open(os.path.join(self.root, file), 'rb') as f:
             request = mock.Mock()
-            request.text = f.read()
+            request.content = f.read()
+            request.encoding = 'UTF-8'
+            request.text = request.content.decode('UTF-8')
             request.json = lambda: json.loads(request.text)
             args = (url, post, get, format)
             self.routes = list(filter(
                 lambda item: item[0] != args,
                 self.routes
             ))
-            self.routes.append((
-                args,
-                lib.spell.BaseSpell.fetchFormats[format](request)
-            ))
+            self.routes.append((args, request))
 
-    def mock_fetch(self, url, post=None, get=None, format='raw'):
+    def mock_fetch(self, url, post=None, get=None, format='raw', limit=None,
+                   until=None):
         """
         This function replaces ``lib.spell.BaseSpell.fetch`` when the mock
-        is active.
+        is active. The data file is decoded on each call, as ``format``
+        says.
 
         :raises:Exception: Any request that does not match one
             predefined with ``route()`` will result in an
             ``Exception`` being thrown.
         """
+        import lib.httpcache
 
-        for args, content in self.routes:
+        for args, request in self.routes:
             if args == (url, post, get, format):
-                return content
+                if format in ('lines', 'chunks'):
+                    return lib.httpcache.read(
+                        [request.content], request.encoding,
+                        format == 'lines', limit, until
+                    )
+                return lib.spell.BaseSpell.fetchFormats[format](request)
         raise Exception(
             'Unknown request: fetch(url=%s, post=%s, get=%s, format=%s)'
             % (url, post, get, format)
         )
 
 
+    def mock_afetch(self, url, post=None, get=None, format='raw'):
+        """
+        This function replaces ``lib.spell.BaseSpell.afetch`` when the
+        mock is active. Same as ``mock_fetch``, resolved through a future
+        """
+        import asyncio
+
+        future = asyncio.get_event_loop().create_future()
+        try:
+            future.set_result(self.mock_fetch(url, post, get, format))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
 class WebCapture(object):
     """
     This is a proxy class that intercepts web requests and then
@@ -108,35 +136,42 @@ class WebCapture(object):
     """
 
     def __init__(self):
-        self._get = requests.get
-        self._post = requests.post
+        self._request = lib.http.request
         self.patches = (
-            mock.patch('requests.get', spec=True, side_effect=self.mock_get),
-            mock.patch('requests.post', spec=True, side_effect=self.mock_post)
+            mock.patch(
+                'lib.http.request', spec=True, side_effect=self.mock_request
+            ),
         )
 
-    def mock_get(self, url, **kwargs):
+    def mock_request(self, method, url, **kwargs):
         """
-        This replaces ``requests.get``. It prints out the ``kwargs`` that
-        is used to build the query string, passes the request along to
-        the original ``get(...)`` function and then saves the result to a file
+        This replaces ``lib.http.request``. It prints out the ``kwargs``
+        that are used to build the query string and the post payload,
+        passes the request along to the original ``request(...)`` function
+        and then saves the result to a file
+
+        :type method: str
+        :param method: ``GET`` or ``POST``
 
         :type url: str
         :param url: The URL of the resource being requested
 
         :type kwargs: dict
         :param kwargs: The keyword arguments used to build the query string
+            (``params``) and the post payload (``data``)
 
-        :rtype: str
-        :return: The result from the original ``get(...)`` function
+        :rtype: ``requests.Response``
+        :return: The result from the original ``request(...)`` function
         """
 
         print('url: %s' % url, end='')
 
-        if 'params' in kwargs:
+        if kwargs.get('params'):
             print('get: %s' % kwargs['params'], end='')
+        if kwargs.get('data'):
+            print('data: %s' % kwargs['data'], end='')
 
-        result = self._get(url, **kwargs)
+        result = self._request(method, url, **kwargs)
 
         with tempfile.NamedTemporaryFile(delete=False) as f:
             f.write(result.text.encode('UTF-8'))
@@ -144,34 +179,6 @@ class WebCapture(object):
 
         return result
 
-    def mock_post(self, url, data, **kwargs):
-        """
-        This replaces ``requests.post``. It prints out post payload
-        (``data``), passes the request along to the original
-        ``get(...)`` function and then saves the result to a file
-
-        :type url: str
-        :param url: The URL of the resource being requested
-
-        :type data: dict
-        :param data: The data payload that will be sent via post
-            to the server.
-
-        :rtype: str
-        :return: The result from the original ``get(...)`` function
-        """
-
-        print('url: %s' % url, end='')
-        print('data: %s' % data, end='')
-
-        result = self._post(url, data, **kwargs)
-
-        with tempfile.NamedTemporaryFile(delete=False) as f:
-            f.write(result.text)
-            print('Output saved to %s' % f.name)
-
-        return result
-
     def __enter__(self):
         for patch in self.patches:
             patch.start()
@@ -261,7 +268,7 @@ class Shaman(unittest.TestCase, ShamanMeta):
         cls.config = dict()
         cls.queries = dict()
         cls.web = WebMock(os.path.join(root, 'test_data'))
-        cls.patches = [cls.web.mock]
+        cls.patches = [cls.web.mock, cls.web.amock]
         lib.registry.collect()
 
         # Search for spell if one is not already provided
@@ -398,10 +405,10 @@ class Shaman(unittest.TestCase, ShamanMeta):
             :rtype: str
         """
 
+        _query = self.canonical(query)
         for patch in self.patches:
             patch.start()
 
-        score, cls, _query = self.spell_obj.parse(query)
         result, self.state = self.spell_obj.incantation(
             _query, self.config, self.state
         )
@@ -413,6 +420,65 @@ class Shaman(unittest.TestCase, ShamanMeta):
 
         return result
 
+    def aquery(self, query):
+        """
+            Same as ``query``, through the spell's ``aincantation``,
+            run on an event loop of its own
+
+            :type query: str
+            :param query: The query to give to the spell
+
+            :returns: returns the result of the spell
+            :rtype: str
+        """
+        import asyncio
+
+        _query = self.canonical(query)
+        for patch in self.patches:
+            patch.start()
+
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            result, self.state = loop.run_until_complete(
+                self.spell_obj.aincantation(_query, self.config, self.state)
+            )
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            for patch in self.patches:
+                patch.stop()
+
+        self.queries[query] = result
+
+        return result
+
+    def canonical(self, query):
+        """
+            Parse a query the way ``lib.dispatch.Dispatcher`` does: in its
+            canonical form (see ``lib.canonical``), then canonicalised by
+            the spell. Canonicalising the query must not change whether
+            it is routed to the spell
+
+            :type query: str
+            :param query: The query, as asked
+
+            :returns: What the spell's ``incantation`` is given
+            :rtype: str
+
+            :raises: ``AssertionError`` if the query is only routed to the
+                spell in one of its forms
+        """
+        score = self.spell_obj.parse(query)[0]
+        canonicalScore, cls, _query = self.spell_obj.parse(
+            lib.canonical.canonical(query)
+        )
+        self.assertEqual(
+            score, canonicalScore,
+            'Canonicalising %r changes how it is routed' % query
+        )
+        return self.spell_obj.canonicalise(_query)
+
     def today(self, year, month, day):
         """
             Replace ``lib.spell.BaseSpell.today`` with a mock function
@@ -0,0 +1,512 @@
+"""
+Troz as a library: ``Wizard`` loads everything once and then answers
+as many queries as needed.
+
+.. code-block:: python
+
+    import lib.wizard
+
+    wizard = lib.wizard.Wizard()
+    answer = wizard.ask('How awesome is Chuck Norris?')
+    print(answer.result, answer.spell, answer.elapsed)
+    wizard.flush()
+"""
+from __future__ import print_function
+
+import sys
+import copy
+import time
+import threading
+import collections
+
+import lib.http
+import lib.httpcache
+import lib.answercache
+import lib.breaker
+import lib.retry
+import lib.ratelimit
+import lib.config
+import lib.deadline
+import lib.dispatch
+import lib.registry
+import lib.store
+
+try:
+    string_types = basestring  # Python2.x
+except NameError:
+    string_types = str  # Python3
+
+#: The answer to a query.
+#:
+#:  * **query**: The query, as asked
+#:  * **result**: The answer, or ``None`` if no spell could answer
+#:  * **spell**: The name of the spell that answered, if any
+#:  * **score**: The score of that spell (see ``lib.spell.BaseSpell.parse``)
+#:  * **elapsed**: How long it took to answer, in seconds
+#:  * **timings**: A list of (`spell`, `seconds`) for each spell that
+#:      was tried, in order
+Answer = collections.namedtuple(
+    'Answer', 'query result spell score elapsed timings'
+)
+
+
+def ask(query, dispatcher, config, store, deadline=None, speculate=1):
+    """
+    Try the spells matching a query, best first, until one answers
+
+    Each spell gets half of the time left (see ``lib.deadline``); spells
+    that fail to fetch something, or run out of time, are skipped, and so
+    are the spells whose hosts keep failing (see ``lib.breaker``) or which
+    are over their quota (see ``lib.ratelimit``). Once
+    the deadline has passed, or if no spell answered, the spells'
+    ``fallback`` answers instead, without going over the network.
+
+    Cached answers (see ``lib.answercache``) are used without asking the
+    spell again; answers a little too old are used as well, while they
+    are refreshed in the background.
+
+    With ``speculate``, the best few spells are tried at the same time.
+    The best answer is returned as soon as every better spell has failed,
+    and the spells still running are cancelled.
+
+    :type query: str
+    :param query: The query
+
+    :type dispatcher: ``lib.dispatch.Dispatcher``
+    :param dispatcher: Routes the query to the spells
+
+    :type config: dict
+    :param config: The (validated) configuration
+
+    :type store: ``dict`` or one of ``lib.store``
+    :param store: Where the spells' state is kept. Only the state of the
+        spell that answered is saved
+
+    :type deadline: float or None
+    :param deadline: How long answering can take, in seconds; ``None``
+        for no limit
+
+    :type speculate: int
+    :param speculate: How many spells to try at the same time
+
+    :rtype: ``Answer``
+    """
+    start = time.time()
+    timings = []
+    limit = lib.deadline.Deadline(deadline)
+    tried = []
+    candidates = dispatcher.candidates(query)
+    while True:
+        batch = _batch(candidates, tried, config, limit, speculate)
+        if not batch:
+            break
+        if len(batch) == 1:
+            outcomes = [_attempt(batch[0], config, store, limit.split())]
+        else:
+            outcomes = _race(batch, config, store, limit)
+
+        for candidate, (result, state, elapsed) in zip(batch, outcomes):
+            name = candidate.spell.__class__.__name__
+            timings.append((name, elapsed))
+            if result is not None:
+                store[name] = state
+                return Answer(query, result, name, candidate.score,
+                              time.time() - start, timings)
+
+    return _fallback(query, tried, config, store, start, timings)
+
+
+def _batch(candidates, tried, config, limit, size):
+    """
+    :returns: The next few usable candidates, at most ``size`` of them,
+        up to the first one with a cached answer. All of them are added to
+        ``tried``
+    :rtype: list
+    """
+    batch = []
+    for candidate in candidates:
+        tried.append(candidate)
+        if limit.expired():
+            continue  # Only collected for their fallback
+        cached = lib.answercache.cached(
+            candidate.spell, candidate.query, config
+        )
+        if cached or _usable(candidate.spell, limit.remaining()):
+            batch.append(candidate)
+            if cached or len(batch) >= size:
+                break
+    return batch
+
+
+def _attempt(candidate, config, store, deadline, cancelled=None):
+    """
+    Ask a spell, unless its answer is cached. Answers past their
+    ``cacheTTL``, but not their ``cacheGrace``, are used all the same and
+    refreshed in the background (see ``_refresh``)
+
+    :type deadline: ``lib.deadline.Deadline``
+    :param deadline: The time the spell has
+
+    :type cancelled: ``threading.Event`` or None
+    :param cancelled: Set once the answer is no longer needed
+
+    :returns: `result` (``None`` if the spell failed), `state` and how
+        long it took
+    :rtype: tuple
+    """
+    before = time.time()
+    result, fresh = lib.answercache.get(
+        candidate.spell, candidate.query, config
+    )
+    if result is not None:
+        if not fresh:
+            _refresh(candidate, config, store)
+        state = store.get(candidate.spell.__class__.__name__)
+        return result, state, time.time() - before
+    result, state = _incant(candidate, config, store, deadline, cancelled)
+    return result, state, time.time() - before
+
+
+def _incant(candidate, config, store, deadline, cancelled=None):
+    """
+    Run a spell's ``incantation``, and cache its answer
+
+    :returns: `result` (``None`` if the spell failed) and `state`
+    :rtype: tuple
+    """
+    spell = candidate.spell
+    # Each query works on its own copy of the state, which can
+    # then be committed in one go
+    state = copy.deepcopy(store.get(spell.__class__.__name__))
+    try:
+        with deadline:
+            result, state = spell.incantation(candidate.query, config, state)
+    except IOError as e:
+        if cancelled is None or not cancelled.is_set():
+            _failed(spell, e)
+        result = None
+    else:
+        if result is not None:
+            lib.answercache.put(spell, candidate.query, config, result)
+        elif cancelled is None or not cancelled.is_set():
+            _failed(spell)
+    return result, state
+
+
+#: Nobody waits for the answers refreshed in the background, so their
+#: failures are not reported (see ``_incant``)
+_BACKGROUND = threading.Event()
+_BACKGROUND.set()
+
+
+def _refresh(candidate, config, store):
+    """
+    Ask a spell again in the background, to refresh its cached answer.
+    Nothing is done if the answer is already being refreshed
+    """
+    name = lib.answercache.key(candidate.spell, candidate.query, config)
+    if not lib.answercache.CACHE.claim(name):
+        return
+
+    def run():
+        try:
+            deadline = lib.deadline.Deadline(lib.deadline.DEFAULT)
+            result, state = _incant(
+                candidate, config, store, deadline, _BACKGROUND
+            )
+            if result is not None:
+                store[candidate.spell.__class__.__name__] = state
+        finally:
+            lib.answercache.CACHE.release(name)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+
+def _race(batch, config, store, limit):
+    """
+    Ask the spells at the same time, each in its own thread
+
+    :returns: The outcome (see ``_attempt``) of each spell, best first,
+        up to the first that answered; the others are cancelled
+    :rtype: list
+
+    :raises: What a spell raised, once the better spells have failed
+    """
+    deadlines = [limit.split() for candidate in batch]
+    outcomes = [None] * len(batch)
+    done = [threading.Event() for candidate in batch]
+    cancelled = threading.Event()
+
+    def run(index):
+        try:
+            outcomes[index] = _attempt(
+                batch[index], config, store, deadlines[index], cancelled
+            )
+        except Exception as e:
+            outcomes[index] = e
+        finally:
+            done[index].set()
+
+    for index in range(len(batch)):
+        thread = threading.Thread(target=run, args=(index,))
+        thread.daemon = True
+        thread.start()
+
+    for index in range(len(batch)):
+        # Wait for the better spells first: the best answer wins
+        done[index].wait()
+        if isinstance(outcomes[index], Exception):
+            _cancel(cancelled, deadlines[index + 1:])
+            raise outcomes[index]
+        if outcomes[index][0] is not None:
+            _cancel(cancelled, deadlines[index + 1:])
+            return outcomes[:index + 1]
+    return outcomes
+
+
+def _cancel(cancelled, deadlines):
+    """ Stop the spells still racing (see ``_race``) """
+    cancelled.set()
+    for deadline in deadlines:
+        deadline.cancel()
+
+
+def _usable(spell, budget=None):
+    """
+    :type budget: float or None
+    :param budget: How long the spell could wait for its quota
+
+    :rtype: bool
+    :return: Whether the hosts of a spell are not failing (see
+        ``lib.breaker``) and it is within its quota (see
+        ``lib.ratelimit``)
+    """
+    if not lib.breaker.available(spell.hosts):
+        print('Warning: %s skipped, its hosts keep failing' % spell,
+              file=sys.stderr)
+        return False
+    if spell.rateLimit is not None and not spell.rateLimit.available(budget):
+        print('Warning: %s skipped, it is over its quota' % spell,
+              file=sys.stderr)
+        return False
+    return True
+
+
+def _failed(spell, error=None):
+    """ Report a spell that did not answer """
+    if error is None:
+        print('Warning: %s failed' % spell, file=sys.stderr)
+    else:
+        print('Warning: %s failed (%s: %s)' % (
+            spell, error.__class__.__name__, error
+        ), file=sys.stderr)
+
+
+def _fallback(query, candidates, config, store, start, timings):
+    """
+    :type candidates: list
+    :param candidates: The spells matching the query, best first (see
+        ``lib.dispatch.Dispatcher.candidates``)
+
+    :rtype: ``Answer``
+    :return: The first answer of the spells' ``fallback``, if any
+    """
+    for candidate in candidates:
+        spell = candidate.spell
+        name = spell.__class__.__name__
+        state = copy.deepcopy(store.get(name))
+        result, state = spell.fallback(candidate.query, config, state)
+        if result is not None:
+            store[name] = state
+            return Answer(query, result, name, candidate.score,
+                          time.time() - start, timings)
+    return Answer(query, None, None, None, time.time() - start, timings)
+
+
+class Wizard(object):
+    """
+    Collects the spells, validates the configuration and loads the state
+    once, then answers queries.
+
+    :type config: str or dict
+    :param config: The configuration file to load, or the configuration
+        itself
+
+    :type store: ``dict`` or one of ``lib.store``
+    :param store: Where the spells' state is kept. Defaults to
+        ``lib.store.JSONStore('save.db')``
+
+    :type root: str
+    :param root: The directory the spells are in
+
+    :type warm: bool
+    :param warm: If true, connections to the hosts of the enabled spells
+        are opened in the background (see ``warm``)
+
+    :type deadline: float or None
+    :param deadline: How long answering a query can take, in seconds.
+        Defaults to the ``Query.Deadline`` configuration value (see
+        ``lib.deadline``); 0 for no limit
+
+    :type speculate: int or None
+    :param speculate: How many spells to try at the same time (see
+        ``ask``). Defaults to the ``Query.Speculate`` configuration value,
+        or 1
+
+    :type prefetch: bool
+    :param prefetch: If true, the answers to popular and predictable
+        queries are kept cached in the background (see ``lib.prefetch``),
+        which pays off for long running processes such as the daemon
+    """
+
+    def __init__(self, config='settings.conf', store=None, root='spells',
+                 warm=True, deadline=None, speculate=None, prefetch=False):
+        lib.registry.discover(root)
+        if isinstance(config, string_types):
+            config = lib.config.load(config)
+        else:
+            lib.config.validate(config)
+        self.config = config
+        self.store = lib.store.JSONStore() if store is None else store
+        self.dispatcher = lib.dispatch.Dispatcher(lib.registry.enabled())
+        if deadline is None:
+            deadline = lib.deadline.seconds(config)
+        self.deadline = deadline or None
+        if speculate is None:
+            speculate = int(config.get('Query.Speculate') or 1)
+        self.speculate = max(1, speculate)
+
+        lib.http.configure(config)
+        lib.httpcache.configure(config)
+        lib.answercache.configure(config)
+        lib.breaker.configure(config)
+        lib.ratelimit.configure(self.store)
+        if warm:
+            thread = threading.Thread(target=self.warm)
+            thread.daemon = True
+            thread.start()
+
+        #: Prefetches the popular queries (see ``lib.prefetch``), if any
+        self.scheduler = prefetch and self._schedule() or None
+
+    def _schedule(self):
+        """ Start prefetching, unless the configuration says not to """
+        import lib.prefetch
+
+        top = self.config.get('Query.Prefetch')
+        top = lib.prefetch.TOP if top in (None, '') else int(top)
+        if top <= 0:
+            return None
+        scheduler = lib.prefetch.Scheduler(
+            self.dispatcher, self.config, self.store, top
+        )
+        scheduler.start()
+        return scheduler
+
+    def ask(self, query, deadline=None, speculate=None):
+        """
+        :type query: str
+        :param query: The query to answer
+
+        :type deadline: float or None
+        :param deadline: How long answering this query can take, in
+            seconds, instead of ``self.deadline``; 0 for no limit
+
+        :type speculate: int or None
+        :param speculate: How many spells to try at the same time for this
+            query, instead of ``self.speculate``
+
+        :rtype: ``Answer``
+        """
+        if self.scheduler is not None:
+            self.scheduler.record(query)
+        return ask(query, self.dispatcher, self.config, self.store,
+                   *self._options(deadline, speculate))
+
+    def _options(self, deadline, speculate):
+        """ The deadline and speculation of a query (see ``ask``) """
+        if deadline is None:
+            deadline = self.deadline
+        if speculate is None:
+            speculate = self.speculate
+        return deadline or None, max(1, speculate)
+
+    def aask(self, query, deadline=None, speculate=None):
+        """
+        Same as ``ask``, for asyncio (see ``lib.aio``)
+
+        :rtype: awaitable
+        :return: Resolves to the ``Answer``
+        """
+        import lib.aio
+
+        if self.scheduler is not None:
+            self.scheduler.record(query)
+        return lib.aio.ask(query, self.dispatcher, self.config, self.store,
+                           *self._options(deadline, speculate))
+
+    def ask_many(self, queries):
+        """
+        :type queries: iterable
+        :param queries: The queries to answer
+
+        :rtype: generator
+        :return: The ``Answer`` to each query, in order
+        """
+        for query in queries:
+            yield self.ask(query)
+
+    def warm(self):
+        """ Open connections to the hosts of the enabled spells """
+        hosts = set()
+        for group in self.dispatcher.groups:
+            hosts.update(group.get('hosts') or ())
+        lib.http.warm(sorted(hosts))
+
+    def stats(self):
+        """
+        :rtype: dict
+        :return: How the connections (see ``lib.http.stats``), the
+            cache (see ``lib.httpcache.Cache.stats``) and the cached
+            answers (see ``lib.answercache.Cache.stats``) are used, how
+            many fetches were coalesced (see
+            ``lib.singleflight.Group.stats``), tried again or hedged (see
+            ``lib.retry.stats``), which hosts are failing (see
+            ``lib.breaker.stats``) and how much of their quota the spells
+            used (see ``lib.ratelimit.Limit.stats``), and what was prefetched
+            (see ``lib.prefetch.Scheduler.stats``)
+        """
+        quotas = dict(
+            (group['name'], group['spell'].rateLimit.stats())
+            for group in self.dispatcher.groups
+            if group['spell'] is not None and group['spell'].rateLimit
+        )
+        return {
+            'http': lib.http.stats(),
+            'cache': lib.httpcache.CACHE.stats(),
+            'answers': lib.answercache.CACHE.stats(),
+            'fetches': lib.httpcache.FLIGHTS.stats(),
+            'retries': lib.retry.stats(),
+            'breakers': lib.breaker.stats(),
+            'quotas': quotas,
+            'prefetch': self.scheduler and self.scheduler.stats()
+        }
+
+    def close(self):
+        """ Stop prefetching, and persist the spells' state """
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        self.flush()
+
+    def flush(self):
+        """ Persist the spells' state (see ``lib.store``) """
+        if hasattr(self.store, 'flush'):
+            self.store.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
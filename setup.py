@@ -3,7 +3,7 @@
 import setuptools
 import sys
 
-requiredList = ['requests', 'python-dateutil']
+requiredList = ['requests', 'python-dateutil', 'regex']
 
 if sys.version_info[:2] <= (2, 6):
     requiredList.extend(['argparse', 'unittest2'])
@@ -19,7 +19,7 @@ setuptools.setup(
     author='Peter Naudus',
     author_email='linuxlefty@fastmail.fm',
     url='http://TheTroz.com',
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['tests']),
     scripts = ['troz.py'],
     install_requires=requiredList
 )
@@ -11,6 +11,9 @@ class Awesome(lib.spell.BaseSpell):
         ([^?]+)
         \?*
     """
+    hosts = ('http://api.icndb.com',)
+    # Every joke is a random one
+    cacheTTL = 0
     config = {
         'Personal.FirstName': str,
         'Personal.LastName': str
@@ -49,3 +49,7 @@ class Awesome(Shaman):
             Kick. They didn't even come close.
         """
         self.assertLooksLike(result, expected)
+
+    def test_chuck_norris_async(self):
+        result = self.aquery("How awesome is Chuck Norris?")
+        self.assertLooksLike(result, self.query("How awesome is Chuck Norris?"))
@@ -19,6 +19,11 @@ class DDG(lib.spell.BaseSpell):
             \?*
         )
     """
+    hosts = ('http://api.duckduckgo.com',)
+    # Definitions hardly ever change, and are refreshed in the background
+    # for a day
+    cacheTTL = 3600
+    cacheGrace = 86400
 
     def incantation(self, query, config, state):
         result = self.fetch(
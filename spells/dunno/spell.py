@@ -7,24 +7,44 @@ class Dunno(lib.spell.BaseSpell):
     """ When all else fails, make up a random excuse """
     weight = -100
     pattern = r".*"
+    hosts = ('http://pages.cs.wisc.edu',)
+    # Every excuse is a random one
+    cacheTTL = 0
     reHtml = re.compile('<[^<]+?>')
     reExcuse = re.compile('The cause of the problem is:([^\n]+)')
+    #: The excuse is on the line this is found in, near the top of the page
+    reCause = re.compile('The cause of the problem is:')
+    limit = 16384
     apology = [
         'Sorry,', 'Oh dear,', 'I beg you pardon,',
         'Egad!', 'Whoops,', 'Oh snap,',
         'My hunble apologies,', 'Drat!',
         'I would love to help you, but',
     ]
+    #: Used when the BOFH server cannot be reached in time
+    excuses = [
+        'solar flares',
+        'the cleaning lady unplugged the server',
+        'cosmic ray particles crashed through the hard disk platter',
+        'the network is down for routine maintenance',
+        'somebody set up us the bomb',
+    ]
 
     def incantation(self, query, config, state):
-        excuse = self.fetch(
+        lines = self.fetch(
             'http://pages.cs.wisc.edu/~ballard/bofh/bofhserver.pl',
-            format='raw'
+            format='lines', limit=self.limit, until=self.reCause
         )
 
+        for line in lines:
+            match = self.reExcuse.search(self.reHtml.sub('', line))
+            if match:
+                return ' '.join((
+                    random.choice(self.apology), match.groups()[0]
+                )), state
+        return None, state
+
+    def fallback(self, query, config, state):
         return ' '.join((
-            random.choice(self.apology),
-            self.reExcuse.search(
-                self.reHtml.sub('', excuse)
-            ).groups()[0]
+            random.choice(self.apology), random.choice(self.excuses)
         )), state
@@ -15,7 +15,13 @@ class Dunno(Shaman):
     def test(self, letter, request, expected):
         self.web.route(
             'http://pages.cs.wisc.edu/~ballard/bofh/bofhserver.pl',
-            file='%s.html' % letter
+            file='%s.html' % letter, format='lines'
         )
         result = self.query(request)
         self.assertLooksLike(result[len(result)-len(expected):], expected)
+
+    def test_fallback(self):
+        result, state = self.spell_obj.fallback('anything', {}, {})
+        self.assertTrue(any(
+            result.endswith(excuse) for excuse in self.spell_obj.excuses
+        ))
@@ -1,5 +1,5 @@
 import lib.spell
-from dateutil import relativedelta as rdelta
+import lib.ratelimit
 
 
 class Templates(object):
@@ -181,21 +181,28 @@ class OpenWeatherMap(lib.spell.BaseSpell):
         'wednesday', 'thursday', 'friday', 'saturday', 'sunday', 'weekend'
     ])
 
+    # Other ways of saying the offsetKeys, see canonicalise()
+    synonyms = {
+        'now': 'today', 'current': 'today', 'currently': 'today',
+        'tonight': 'today', 'mon': 'monday', 'tue': 'tuesday',
+        'tues': 'tuesday', 'wed': 'wednesday', 'thu': 'thursday',
+        'thur': 'thursday', 'thurs': 'thursday', 'fri': 'friday',
+        'sat': 'saturday', 'sun': 'sunday',
+    }
+
+    # Arguments for dateutil's relativedelta, see getOffsets()
     offsets = {
-        'current': [rdelta.relativedelta(days=0)],
-        'today': [rdelta.relativedelta(days=0)],
-        'tomorrow': [rdelta.relativedelta(days=1)],
-        'monday': [rdelta.relativedelta(weekday=rdelta.MO)],
-        'tuesday': [rdelta.relativedelta(weekday=rdelta.TU)],
-        'wednesday': [rdelta.relativedelta(weekday=rdelta.WE)],
-        'thursday': [rdelta.relativedelta(weekday=rdelta.TH)],
-        'friday': [rdelta.relativedelta(weekday=rdelta.FR)],
-        'saturday': [rdelta.relativedelta(weekday=rdelta.SA)],
-        'sunday': [rdelta.relativedelta(weekday=rdelta.SU)],
-        'weekend': [
-            rdelta.relativedelta(weekday=rdelta.SA),
-            rdelta.relativedelta(weekday=rdelta.SU)
-        ],
+        'current': [{'days': 0}],
+        'today': [{'days': 0}],
+        'tomorrow': [{'days': 1}],
+        'monday': [{'weekday': 'MO'}],
+        'tuesday': [{'weekday': 'TU'}],
+        'wednesday': [{'weekday': 'WE'}],
+        'thursday': [{'weekday': 'TH'}],
+        'friday': [{'weekday': 'FR'}],
+        'saturday': [{'weekday': 'SA'}],
+        'sunday': [{'weekday': 'SU'}],
+        'weekend': [{'weekday': 'SA'}, {'weekday': 'SU'}],
     }
 
     hours = [
@@ -207,10 +214,77 @@ class OpenWeatherMap(lib.spell.BaseSpell):
         ' 20:00:00',  # evening 2
     ]
 
+    hosts = ('http://api.openweathermap.org',)
+    # Conditions and forecasts are only updated every few minutes
+    fetchTTL = 600
+    cacheTTL = 600
+    # A forecast from half an hour ago beats waiting for a new one
+    cacheGrace = 1800
+
     config = {
         'Weather.Location': str,
         'Weather.Units': [str, 'metric', 'imperial']
     }
+    # The free API keys are good for 60 calls a minute
+    rateLimit = lib.ratelimit.Limit('60/minute', burst=10,
+                                    name='OpenWeatherMap')
+
+    @classmethod
+    def getOffsets(cls, key):
+        # dateutil is only imported once a weather query comes in
+        from dateutil import relativedelta as rdelta
+
+        return [
+            rdelta.relativedelta(**dict(
+                (name, name == 'weekday' and getattr(rdelta, value) or value)
+                for name, value in offset.items()
+            ))
+            for offset in cls.offsets[key]
+        ]
+
+    @classmethod
+    def getOffsetKey(cls, word):
+        """ The offsetKey a word stands for, if any """
+        word = word.lower()
+        for suffix in ("'s", "s'", "'"):
+            if word.endswith(suffix):
+                word = word[:-len(suffix)]
+                break
+        if word not in cls.offsetKeys and word[-1:] == 's':
+            word = word[:-1]  # todays, mondays, weekends
+        word = cls.synonyms.get(word, word)
+        return word in cls.offsetKeys and word or None
+
+    def canonicalise(self, query):
+        """
+        "today's weather be like", "the current forecast" and "weather
+        now" all become "today weather"; the location, if any, is kept as
+        "for <location>"
+        """
+        query_words = [word for word in query.split(' ') if word]
+        if 'next' in query_words:
+            return query  # Left for incantation to turn down
+
+        query_loc = None
+        for marker in ('for', 'in'):
+            if marker in query_words:
+                index = query_words.index(marker)
+                query_loc = ' '.join(query_words[index+1:])
+                del query_words[index:]
+                break
+
+        keys = [key for key in map(self.getOffsetKey, query_words) if key]
+        words = [keys and keys[0] or 'today', 'weather']
+        if query_loc is not None:
+            words += ['for', query_loc]
+        return ' '.join(words)
+
+    def predict(self, config):
+        """ The weather where the user lives is asked about every day """
+        return [
+            "What will today's weather be like",
+            "What will tomorrow's weather be like"
+        ]
 
     def incantation(self, query, config, state):
         result = ['']
@@ -240,11 +314,11 @@ class OpenWeatherMap(lib.spell.BaseSpell):
         query_words.intersection_update(self.offsetKeys)
         try:
             weekday = tuple(query_words)[0]
-            offsets = self.offsets[weekday]
+            offsets = self.getOffsets(weekday)
         except (KeyError, IndexError):
             # Just give the current weather
             weekday = 'current'
-            offsets = self.offsets[weekday]
+            offsets = self.getOffsets(weekday)
         try:
             location_id = state[query_loc]
         except KeyError:
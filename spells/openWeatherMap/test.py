@@ -142,3 +142,36 @@ class OpenWeatherMap(Shaman):
             """
         self.assertLooksLike(self.query(query), expected)
         self.assertEqual(self.state['Dallas, Texas'], 4363282)
+
+    @Shaman.generate(
+        "what is  todays weather??",
+        "What is the weather now?",
+        "What is TODAY'S weather",
+        "What will the weather be like tonight?"
+    )
+    def test_today_synonyms(self, query):
+        # Canonicalised onto "today weather", so the answer is the same
+        self.assertEqual(self.canonical(query), 'today weather')
+        self.assertEqual(
+            self.query(query), self.query("What is today's weather")
+        )
+
+    @Shaman.generate(
+        "What is thurs weather in Dallas, Texas",
+        "What will Thursdays forecast be like for Dallas, Texas?"
+    )
+    def test_thursday_synonyms(self, query):
+        self.assertEqual(
+            self.canonical(query), 'thursday weather for Dallas, Texas'
+        )
+
+    def test_predict(self):
+        # The predicted queries are routed here, and share the cache
+        # entries of the questions users ask
+        queries = self.spell_obj.predict(self.config)
+        self.assertEqual(
+            [self.canonical(query) for query in queries],
+            ['today weather', 'tomorrow weather']
+        )
+        for query in queries:
+            self.assertEqual(self.spell_obj.parse(query)[0], 100)
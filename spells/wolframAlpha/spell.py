@@ -1,5 +1,14 @@
-import time
 import lib.spell
+import lib.retry
+import lib.ratelimit
+
+
+def answered(data):
+    """ W|A sometimes returns blank data, which is worth asking again """
+    return not (
+        data.attrib.get('success') == 'true' and
+        data.attrib.get('numpods') == '0'
+    )
 
 
 class WolframAlpha(lib.spell.BaseSpell):
@@ -37,44 +46,47 @@ class WolframAlpha(lib.spell.BaseSpell):
         )
     """
     blacklist = "\s+(?:you|you're|your)\s+"
+    hosts = ('http://api.wolframalpha.com',)
+    # Some answers change, such as conversions between currencies or the
+    # time in another city
+    cacheTTL = 300
     config = {
         'WolframAlpha.AppID': str
     }
+    # The free AppIDs are good for 2000 queries a month
+    rateLimit = lib.ratelimit.Limit('2000/month', burst=20,
+                                    name='WolframAlpha')
+    # Not hedged: a second request would spend a query of the quota
+    retry = lib.retry.Policy(attempts=3, backoff=0.5, accept=answered)
 
     def incantation(self, query, config, state):
-        # For some reason, sometimes W|A returns blank data.
-        # We'll try 3 times to get the data
         inf = float('inf')
         result_relevance = -inf
         result_value = None
-        for _ in range(3):
-            data = self.fetch(
-                'http://api.wolframalpha.com/v2/query',
-                get={
-                    'input': query,
-                    'appid': config['WolframAlpha.AppID']
-                },
-                format='xml'
-            )
-
-            if data.attrib['success'] == 'true':
-                if data.attrib['numpods'] == '0':
-                    self.log.warning('Strange data, trying again ...')
-                    time.sleep(1)
-                    continue
+        data = self.fetch(
+            'http://api.wolframalpha.com/v2/query',
+            get={
+                'input': query,
+                'appid': config['WolframAlpha.AppID']
+            },
+            format='xml-stream'
+        )
 
-                for pod in data.findall('pod'):
-                    # Search through the pods looking for the best one
-                    attrib = pod.attrib
-                    if attrib.get('primary') == 'true':
-                        relevance = attrib.get('id') == 'Result' and 100 or 90
-                    elif attrib.get('scanner') == 'Data' and 'NotableFacts' in attrib.get('id'):
-                        relevance = 80
-                    else:
-                        relevance = -inf
+        if data.attrib.get('success') == 'true':
+            for pod in data.iter('pod'):
+                # Search through the pods looking for the best one
+                attrib = pod.attrib
+                if attrib.get('primary') == 'true':
+                    relevance = attrib.get('id') == 'Result' and 100 or 90
+                elif attrib.get('scanner') == 'Data' and 'NotableFacts' in attrib.get('id'):
+                    relevance = 80
+                else:
+                    relevance = -inf
 
-                    if relevance > result_relevance:
-                        result_relevance = relevance
-                        result_value = pod.findall('subpod')[0].find('plaintext').text
+                if relevance > result_relevance:
+                    result_relevance = relevance
+                    result_value = pod.findall('subpod')[0].find('plaintext').text
+                    if relevance == 100:
+                        break  # Nothing can beat it, skip the other pods
 
-            return result_value, state
+        return result_value, state
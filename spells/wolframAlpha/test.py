@@ -31,13 +31,14 @@ class WolframAlpha(Shaman):
         self.config['WolframAlpha.AppID'] = 'test123'
 
         for question, answer, file in queries:
+            # W|A is asked the canonical query (see lib.canonical)
             self.web.route(
                 url='http://api.wolframalpha.com/v2/query',
                 get={
-                    'input': question,
+                    'input': question.rstrip('?'),
                     'appid': self.config['WolframAlpha.AppID']
                 },
-                format='xml',
+                format='xml-stream',
                 file=file
             )
 
@@ -47,3 +48,11 @@ class WolframAlpha(Shaman):
             self.query(question),
             answer
         )
+
+    @Shaman.generate(
+        "What is the tallest building in the world",
+        "What is  the tallest building\tin the world ?!",
+        "What is the tallest building in the world???"
+    )
+    def test_canonical(self, question):
+        self.assertLooksLike(self.query(question), queries[0][1])
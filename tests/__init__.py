@@ -0,0 +1,254 @@
+"""
+The tests of the library itself (the spells have their own, next to them).
+They are run along with the spells' by ``troz.py --test``.
+"""
+import sys
+import time
+import threading
+
+try:
+    import mock  # Python2.x
+except ImportError:
+    from unittest import mock
+
+if sys.version_info[:2] <= (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import lib.spell
+import lib.breaker
+import lib.deadline
+import lib.keywords
+import lib.dispatch
+import lib.backtrack
+import lib.httpcache
+import lib.answercache
+import lib.wizard
+
+#: Patterns using what the combined scan and the keyword index have to
+#: be careful about, and queries (some matching, some not) to try them on
+PATTERNS = [
+    # Optional groups
+    r"(?:please\s+)?define\s+(\w+)",
+    r"tell\s+me\s+(?:about\s+)?(.+?)(?:\s+please)?$",
+    # Alternations, with and without common keywords
+    r"(?:hello|hi|hey)\s+(\w+)",
+    r"(?:what|who)\s+(?:is|are)\s+(.+)",
+    r"(?:colou?r|shade)\s+of\s+(\w+)",
+    # Digits
+    r"(\d+)\s*[-+*/]\s*(\d+)",
+    r"room\s+\d{3}",
+    # Lookaheads
+    r"(?=.*\bdog\b)(.+)",
+    r"(?!stop\b)(\w+)\s+now",
+    # Named groups
+    r"(?P<city>\w+)\s+weather",
+    r"(?P<first>\w+)\s+and\s+(?P=first)",
+    # Back references
+    r"(\w+)\s+\1",
+    r"say\s+(['\"])(.+)\1",
+    # No group, and nothing required at all
+    r"ping",
+    r".*\?",
+]
+
+QUERIES = [
+    'define cake', 'Please define Cake', 'please define', 'undefined cake',
+    'tell me about dogs', 'Tell me cats please', 'tell me',
+    'hello world', 'HI there', 'hey', 'hello',
+    'What is the tallest building in the world?', 'who are you',
+    'What is today\'s weather?', 'colour of money', 'color of Magic',
+    'shade of grey', '13 + 14', '1+1', '12 * x', 'room 101', 'room 1',
+    'my dog barks', 'hotdog', 'the dog', 'go now', 'stop now', 'stopping now',
+    'Dallas weather', 'weather', 'salt and salt', 'salt and pepper',
+    'bye bye', 'bye', 'say "hi"', "say 'hi\"", 'ping', 'PING pong', 'ding',
+    'Why?', '', '   ', u'caf\xe9 au lait?'
+]
+
+#: What ``FetchCase`` fetches by default, and how it decodes it
+URL = 'http://troz.test/data'
+FORMATS = lib.spell.BaseSpell.fetchFormats
+
+
+def spell(pattern, blacklist='$a', weight=100, name='Synthetic', **attrs):
+    """
+    Create a spell without registering it
+
+    :param attrs: The other attributes and methods of the spell
+
+    :returns: The spell class, and a group describing it as
+        ``lib.registry.register`` would (see
+        ``lib.registry.lookup_by_name``)
+    :rtype: ``tuple(class, dict)``
+    """
+    attrs.update({
+        'weight': weight, 'pattern': pattern, 'blacklist': blacklist
+    })
+    with mock.patch('lib.registry.register'):
+        cls = type(name, (lib.spell.BaseSpell,), attrs)
+    return cls, {
+        'spell': cls, 'test': None, 'enabled': True, 'entry': None,
+        'name': name, 'doc': None, 'weight': weight,
+        'pattern': pattern, 'blacklist': blacklist,
+        'keywords': lib.keywords.required(pattern),
+        'risks': lib.backtrack.risks(pattern) + lib.backtrack.risks(blacklist),
+        'predicts': False
+    }
+
+
+class Clock(object):
+    """
+    Stands for the ``time`` module of what is tested, such as
+    ``lib.ratelimit``: sleeping moves it on
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.slept.append(delay)
+        self.now += delay
+
+
+def response(content=b'', status=200, headers=None, url='http://troz.test/'):
+    """
+    A response, as ``lib.http.request`` returns it
+
+    :type content: bytes
+    :param content: The body
+
+    :rtype: ``requests.Response``
+    """
+    import io
+    import requests
+
+    result = requests.Response()
+    result.status_code = status
+    result.url = url
+    result.raw = io.BytesIO(content)
+    result.headers.update(headers or {})
+    result.encoding = 'UTF-8'
+    return result
+
+
+class FetchCase(unittest.TestCase):
+    """
+    Fetches through ``lib.httpcache.fetch``, with ``lib.http.request``
+    stubbed (``self.request``) and the hosts' breakers (see
+    ``lib.breaker``) reset
+    """
+
+    def setUp(self):
+        patch = mock.patch.dict(lib.breaker._BREAKERS, clear=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+        patch = mock.patch('lib.http.request')
+        self.request = patch.start()
+        self.addCleanup(patch.stop)
+
+    def fetch(self, url=URL, format='raw', **kwargs):
+        """
+        Fetch and decode ``url``; unless a ``cache`` is given, an empty
+        one is used each time. The other arguments are passed on to
+        ``lib.httpcache.fetch``
+        """
+        kwargs.setdefault('cache', lib.httpcache.Cache())
+        return lib.httpcache.fetch(url, format=format, decode=FORMATS[format],
+                                   **kwargs)
+
+
+class AskCase(unittest.TestCase):
+    """
+    Asks synthetic spells (see ``add``), with an answer cache of its own
+    and the failures of the spells recorded (``self.failed``) rather than
+    reported
+    """
+
+    def setUp(self):
+        self.groups = []
+        self.store = {}
+
+        #: The name of each spell run, and its deadline, as they start
+        self.runs = []
+
+        #: The threads the spells ran in
+        self.threads = []
+
+        patch = mock.patch.object(lib.answercache, 'CACHE',
+                                  lib.answercache.Cache())
+        patch.start()
+        self.addCleanup(patch.stop)
+        patch = mock.patch('lib.wizard._failed')
+        self.failed = patch.start()
+        self.addCleanup(patch.stop)
+
+    def add(self, name, weight, result=None, delay=0, wait=False,
+            error=None, fallback=None, **attrs):
+        """
+        Add a spell answering the queries starting with ``hello``, with
+        ``result``; its state is ``{'by': name}``
+
+        :type delay: float
+        :param delay: How long it takes to answer, in seconds
+
+        :type wait: bool
+        :param wait: If true, it runs until its deadline is cancelled,
+            for 5 seconds at most, and does not answer
+
+        :type error: Exception or None
+        :param error: Raised instead of answering
+
+        :param fallback: What its ``fallback`` answers
+
+        :param attrs: The other attributes of the spell
+
+        :rtype: class
+        """
+        case = self
+
+        def incantation(spell, query, config, state):
+            deadline = lib.deadline.current()
+            case.runs.append((name, deadline))
+            case.threads.append(threading.current_thread())
+            if wait:
+                until = time.time() + 5
+                while not deadline.expired() and time.time() < until:
+                    time.sleep(0.005)
+                return None, state
+            time.sleep(delay)
+            if error is not None:
+                raise error
+            return result, {'by': name}
+
+        def answer(spell, query, config, state):
+            return fallback, {'by': name}
+
+        cls, group = spell(r"hello", weight=weight, name=name,
+                           incantation=incantation, fallback=answer, **attrs)
+        self.groups.append(group)
+        return cls
+
+    def ask(self, query='hello', deadline=5, speculate=1):
+        """ ``lib.wizard.ask``, with the spells added """
+        return lib.wizard.ask(
+            query, lib.dispatch.Dispatcher(self.groups), {}, self.store,
+            deadline, speculate
+        )
+
+    def join(self, timeout=5):
+        """
+        Wait for the threads that ran the spells, such as the losers of a
+        race, which ``lib.wizard.ask`` does not wait for
+        """
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def deadline(self, name):
+        """ The deadline of the first run of a spell """
+        return dict(reversed(self.runs))[name]
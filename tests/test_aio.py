@@ -0,0 +1,118 @@
+import lib.wizard
+import lib.dispatch
+
+from tests import AskCase, unittest
+
+try:
+    import asyncio
+    import lib.aio
+except (ImportError, SyntaxError):
+    asyncio = None  # Python < 3.7
+
+
+@unittest.skipIf(asyncio is None, 'lib.aio requires Python 3.7 or later')
+class Asked(AskCase):
+    """ ``lib.aio.ask``, the spells tried as tasks """
+
+    def complete(self, *awaitables):
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            return loop.run_until_complete(asyncio.gather(*awaitables))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def aask(self, query='hello', deadline=5, speculate=1):
+        return lib.aio.ask(
+            query, lib.dispatch.Dispatcher(self.groups), {}, self.store,
+            deadline, speculate
+        )
+
+    def ask(self, query='hello', deadline=5, speculate=1):
+        return self.complete(self.aask(query, deadline, speculate))[0]
+
+    def test_order(self):
+        best = self.add('Best', 100)
+        self.add('Worse', 50, 'Hi')
+        answer = self.ask()
+        self.assertEqual((answer.result, answer.spell), ('Hi', 'Worse'))
+        self.assertEqual([name for name, elapsed in answer.timings],
+                         ['Best', 'Worse'])
+        self.assertEqual(self.failed.call_args[0][0].__class__, best)
+
+    def test_state(self):
+        self.add('Best', 100, 'Hi')
+        self.add('Worse', 50, 'Hey')
+        self.store['Worse'] = {'by': 'someone else'}
+        self.assertEqual(self.ask().spell, 'Best')
+        self.assertEqual(self.store, {
+            'Best': {'by': 'Best'}, 'Worse': {'by': 'someone else'}
+        })
+        self.assertEqual([name for name, deadline in self.runs], ['Best'])
+
+    def test_fallback(self):
+        self.add('Best', 100)
+        self.add('Worse', 50, fallback='Offline')
+        answer = self.ask()
+        self.assertEqual((answer.result, answer.spell), ('Offline', 'Worse'))
+        self.assertEqual(self.store, {'Worse': {'by': 'Worse'}})
+
+    def test_out_of_time(self):
+        # Straight to the fallback, once the deadline has passed
+        self.add('Best', 100, wait=True, fallback='Offline')
+        answer = self.ask(deadline=0.05)
+        self.assertEqual((answer.result, answer.spell), ('Offline', 'Best'))
+        self.assertTrue(answer.elapsed < 1)
+
+    def test_cancelled(self):
+        self.add('Best', 100, 'Hi', delay=0.05)
+        self.add('Worse', 50, wait=True)
+        answer = self.ask(speculate=2)
+        self.assertEqual(answer.spell, 'Best')
+        self.assertEqual([name for name, elapsed in answer.timings], ['Best'])
+        # The thread running the loser stops at its next request
+        self.assertTrue(self.deadline('Worse').expired())
+        self.assertFalse(self.failed.called)
+        self.assertEqual(self.store, {'Best': {'by': 'Best'}})
+
+    def test_best(self):
+        # The worse spell answers first, but the better one still wins
+        self.add('Best', 100, 'Hi', delay=0.1)
+        self.add('Worse', 50, 'Hey')
+        self.store['Worse'] = {'by': 'someone else'}
+        answer = self.ask(speculate=2)
+        self.assertEqual((answer.result, answer.spell), ('Hi', 'Best'))
+        self.assertEqual(sorted(name for name, deadline in self.runs),
+                         ['Best', 'Worse'])
+        self.assertEqual(self.store, {
+            'Best': {'by': 'Best'}, 'Worse': {'by': 'someone else'}
+        })
+
+    def test_error(self):
+        self.add('Best', 100, delay=0.05, error=RuntimeError('Bug'))
+        self.add('Worse', 50, wait=True)
+        self.assertRaises(RuntimeError, self.ask, speculate=2)
+        self.assertTrue(self.deadline('Worse').expired())
+
+    def test_deadlines(self):
+        # Each task has its own, however the queries interleave
+        self.add('Best', 100, 'Hi', delay=0.05)
+        self.complete(self.aask(deadline=1), self.aask(deadline=100),
+                      self.aask(deadline=1))
+        remaining = sorted(deadline.remaining() for name, deadline
+                           in self.runs)
+        self.assertTrue(remaining[1] < 1 < 10 < remaining[2])
+
+    def test_wizard(self):
+        self.add('Best', 100, 'Hi')
+        wizard = lib.wizard.Wizard.__new__(lib.wizard.Wizard)
+        wizard.__dict__.update({
+            'dispatcher': lib.dispatch.Dispatcher(self.groups),
+            'config': {}, 'store': self.store, 'scheduler': None,
+            'deadline': 5.0, 'speculate': 1
+        })
+        answer = self.complete(wizard.aask('hello', deadline=2))[0]
+        self.assertEqual((answer.result, answer.spell), ('Hi', 'Best'))
+        # Half of the query's deadline, the share of the first spell
+        self.assertTrue(0.5 < self.deadline('Best').remaining() <= 1)
@@ -0,0 +1,119 @@
+import lib.answercache
+
+from tests import Clock, mock, spell, unittest
+
+
+class Cached(unittest.TestCase):
+    """ The answers kept by ``lib.answercache.Cache`` """
+
+    def setUp(self):
+        self.clock = Clock()
+        patch = mock.patch.object(lib.answercache, 'time', self.clock)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.cache = lib.answercache.Cache(maxEntries=2)
+
+    def test_evicted(self):
+        # The least recently used answer goes first
+        self.cache.put('first', 'Hi', 60)
+        self.cache.put('second', 'Hey', 60)
+        self.assertEqual(self.cache.get('first'), ('Hi', True))
+        self.cache.put('third', 'Hello', 60)
+        self.assertEqual(self.cache.get('second'), (None, False))
+        self.assertEqual(self.cache.get('first'), ('Hi', True))
+        self.assertEqual(self.cache.get('third'), ('Hello', True))
+        self.assertEqual(self.cache.stats()['evicted'], 1)
+        self.assertEqual(self.cache.stats()['entries'], 2)
+
+    def test_replaced(self):
+        self.cache.put('first', 'Hi', 60)
+        self.cache.put('first', 'Hey', 60)
+        self.assertEqual(self.cache.get('first'), ('Hey', True))
+        self.assertEqual(self.cache.stats()['evicted'], 0)
+
+    def test_expired(self):
+        self.cache.put('first', 'Hi', 60)
+        self.clock.now += 59
+        self.assertEqual(self.cache.get('first'), ('Hi', True))
+        self.assertEqual(self.cache.expires('first'), 1060.0)
+        self.clock.now += 1
+        self.assertEqual(self.cache.get('first'), (None, False))
+        self.assertFalse(self.cache.has('first'))
+
+    def test_grace(self):
+        self.cache.put('first', 'Hi', 60, grace=30)
+        self.clock.now += 60
+        self.assertEqual(self.cache.get('first'), ('Hi', False))
+        self.assertTrue(self.cache.has('first'))
+        self.clock.now += 30
+        self.assertEqual(self.cache.get('first'), (None, False))
+
+    def test_stats(self):
+        self.cache.put('first', 'Hi', 60, grace=30)
+        self.cache.get('first')
+        self.cache.get('second')
+        self.cache.has('second')  # Not counted
+        self.clock.now += 60
+        self.cache.get('first')
+        self.assertTrue(self.cache.claim('first'))
+        self.assertEqual(self.cache.stats(), {
+            'hits': 1, 'stale': 1, 'misses': 1, 'evicted': 0,
+            'refreshes': 1, 'entries': 1
+        })
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+
+class Spells(unittest.TestCase):
+    """ The answers of the spells (see ``lib.answercache.put``) """
+
+    def setUp(self):
+        patch = mock.patch.object(lib.answercache, 'CACHE',
+                                  lib.answercache.Cache())
+        self.cache = patch.start()
+        self.addCleanup(patch.stop)
+        cls, _ = spell(r"weather", cacheTTL=60, config={
+            'units': [str, 'metric', 'imperial']
+        })
+        self.spell = cls()
+
+    def test_put(self):
+        lib.answercache.put(self.spell, 'weather', {}, 'Sunny')
+        self.assertEqual(lib.answercache.get(self.spell, 'Weather', {}),
+                         ('Sunny', True))
+        self.assertTrue(lib.answercache.cached(self.spell, 'weather', {}))
+
+    def test_not_cached(self):
+        # Spells without a cacheTTL
+        cls, _ = spell(r"weather")
+        lib.answercache.put(cls(), 'weather', {}, 'Sunny')
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(lib.answercache.get(cls(), 'weather', {}),
+                         (None, False))
+
+    def test_disabled(self):
+        lib.answercache.configure({'Query.AnswerCache': '0'})
+        self.assertEqual(self.cache.maxEntries, 0)
+        lib.answercache.put(self.spell, 'weather', {}, 'Sunny')
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_configure(self):
+        lib.answercache.configure({'Query.AnswerCache': '16'})
+        self.assertEqual(self.cache.maxEntries, 16)
+        for config in ({}, {'Query.AnswerCache': ''}):
+            lib.answercache.configure(config)
+            self.assertEqual(self.cache.maxEntries, 16)
+
+    def test_key(self):
+        # Only the values the spell requires, whatever the query's case
+        key = lib.answercache.key(self.spell, 'weather',
+                                  {'units': 'metric'})
+        self.assertEqual(key, lib.answercache.key(
+            self.spell, 'Weather', {'units': 'metric', 'other': 'value'}
+        ))
+        self.assertNotEqual(key, lib.answercache.key(
+            self.spell, 'weather', {'units': 'imperial'}
+        ))
+        self.assertNotEqual(key, lib.answercache.key(
+            self.spell, 'weather', {}
+        ))
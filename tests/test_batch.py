@@ -0,0 +1,72 @@
+import io
+import sys
+import json
+import warnings
+
+import lib.batch
+import lib.breaker
+import lib.registry
+import lib.answercache
+import lib.wizard
+
+from tests import mock, unittest
+
+
+class Batch(unittest.TestCase):
+    """
+    ``troz.py --batch`` writes nothing but JSON lines to stdout, whatever
+    goes wrong
+    """
+
+    def setUp(self):
+        enabled = [(group, group['enabled']) for group in lib.registry.all()]
+        self.addCleanup(lambda: [
+            group.__setitem__('enabled', value) for group, value in enabled
+        ])
+        for patch in (
+            # Every request fails, so every spell that fetches complains
+            mock.patch('lib.http.request', side_effect=IOError('Offline')),
+            mock.patch.dict(lib.breaker._BREAKERS, clear=True),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(lib.answercache.CACHE.clear)
+
+    def test_json_lines(self):
+        lines = [
+            '"How awesome is Troz?"\n',
+            '{"id": 1, "query": "What are cookies?"}\n',
+            'Not JSON\n',
+            '{"id": 2, "query": "What will today\'s weather be like?"}\n',
+        ]
+        if sys.version_info[0] < 3:
+            output, errors = io.BytesIO(), io.BytesIO()
+        else:
+            output, errors = io.StringIO(), io.StringIO()
+        with mock.patch('sys.stdout', output):
+            with mock.patch('sys.stderr', errors):
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    # Without a configuration, the spells needing one are
+                    # disabled, and say so
+                    wizard = lib.wizard.Wizard(
+                        {'HTTP.CacheDirectory': ''}, {}, warm=False,
+                        deadline=5
+                    )
+                    failed = lib.batch.run(wizard.ask, lines, sys.stdout, 2)
+
+        responses = [
+            json.loads(line) for line in output.getvalue().splitlines()
+        ]
+        self.assertEqual(len(responses), len(lines))
+        self.assertEqual(responses[0]['query'], 'How awesome is Troz?')
+        self.assertEqual(responses[1]['id'], 1)
+        self.assertTrue('error' in responses[2])
+        self.assertEqual(responses[3]['id'], 2)
+        # Offline, Dunno still has excuses
+        self.assertEqual(
+            [response.get('spell') for response in responses],
+            ['Dunno', 'Dunno', None, 'Dunno']
+        )
+        self.assertEqual(failed, 1)
+        self.assertTrue('Warning: DDG failed' in errors.getvalue())
@@ -0,0 +1,62 @@
+import lib.breaker
+import lib.deadline
+
+from tests import URL, FetchCase, response
+
+
+class Breaker(FetchCase):
+    """ Only the host's failures open its breaker (see ``lib.breaker``) """
+
+    def state(self):
+        return lib.breaker.breaker(URL).state
+
+    def test_failures(self):
+        self.request.side_effect = IOError('Offline')
+        for _ in range(lib.breaker.threshold):
+            self.assertRaises(IOError, self.fetch)
+        self.assertEqual(self.state(), lib.breaker.OPEN)
+        self.assertRaises(lib.breaker.CircuitOpenError, self.fetch)
+        self.assertEqual(self.request.call_count, lib.breaker.threshold)
+
+    def test_client_errors(self):
+        self.request.return_value = response(b'Not found', status=404)
+        for _ in range(lib.breaker.threshold):
+            self.assertRaises(IOError, self.fetch)
+        self.assertEqual(self.state(), lib.breaker.CLOSED)
+
+    def test_cancelled(self):
+        # Such as a spell that lost a race (see ``lib.wizard.ask``)
+        self.request.return_value = response(b'Hello')
+        for _ in range(2 * lib.breaker.threshold):
+            deadline = lib.deadline.Deadline(10)
+            deadline.cancel()
+            with deadline:
+                self.assertRaises(lib.deadline.DeadlineExceeded, self.fetch)
+        self.assertFalse(self.request.called)
+        self.assertEqual(self.state(), lib.breaker.CLOSED)
+        self.assertEqual(self.fetch(), 'Hello')
+
+    def test_out_of_time(self):
+        # Not sent, although the breaker let it through
+        def send():
+            raise lib.deadline.DeadlineExceeded('The query took too long')
+
+        for _ in range(2 * lib.breaker.threshold):
+            self.assertRaises(lib.deadline.DeadlineExceeded,
+                              lib.breaker.call, URL, send)
+        self.assertEqual(self.state(), lib.breaker.CLOSED)
+        self.assertEqual(lib.breaker.breaker(URL).stats()['failed'], 0)
+
+    def test_half_open(self):
+        self.request.side_effect = IOError('Offline')
+        for _ in range(lib.breaker.threshold):
+            self.assertRaises(IOError, self.fetch)
+        lib.breaker.breaker(URL).opened -= lib.breaker.cooldown
+
+        # The probe never went out; the next request probes instead
+        self.assertRaises(lib.deadline.DeadlineExceeded, lib.breaker.call,
+                          URL, lambda: lib.deadline.Deadline(0).check())
+        self.request.side_effect = None
+        self.request.return_value = response(b'Hello')
+        self.assertEqual(self.fetch(), 'Hello')
+        self.assertEqual(self.state(), lib.breaker.CLOSED)
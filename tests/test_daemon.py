@@ -0,0 +1,86 @@
+import socket
+import threading
+
+import lib.daemon
+import lib.wizard
+
+from tests import mock, unittest
+
+
+class Forwarded(unittest.TestCase):
+    """ Queries sent to a daemon (see ``lib.daemon``) over TCP """
+
+    def setUp(self):
+        self.answer = mock.Mock(return_value={'result': 'Hello'})
+        self.server = lib.daemon.TCPServer(('127.0.0.1', 0),
+                                           lib.daemon.Handler)
+        self.server.answer = self.answer
+        self.server.stats = None
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.address = '127.0.0.1:%d' % self.server.server_address[1]
+
+    def forward(self, request):
+        return lib.daemon.forward(request, self.address, timeout=5)
+
+    def test_query(self):
+        self.assertEqual(self.forward({'query': 'hi'}), {'result': 'Hello'})
+        self.answer.assert_called_once_with('hi')
+
+    def test_options(self):
+        # Such as troz.py "QUERY" --deadline 2.5 --speculate 2
+        self.forward({'query': 'hi', 'deadline': 2.5, 'speculate': '2'})
+        self.answer.assert_called_once_with('hi', deadline=2.5, speculate=2)
+        self.answer.reset_mock()
+        self.forward({'query': 'hi', 'deadline': 0, 'speculate': None})
+        self.answer.assert_called_once_with('hi', deadline=0.0)
+
+    def test_errors(self):
+        response = self.forward({'query': 'hi', 'speculate': 'many'})
+        self.assertTrue(response['error'].startswith('ValueError'))
+        response = self.forward({'stats': True})
+        self.assertTrue(response['error'].startswith('ValueError'))
+        self.assertFalse(self.answer.called)
+
+
+class Hung(unittest.TestCase):
+    """ A daemon that accepts the connection, but never answers """
+
+    def test_timeout(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        address = '127.0.0.1:%d' % listener.getsockname()[1]
+        # What troz.py "QUERY" catches, before answering by itself
+        self.assertRaises((IOError, OSError), lib.daemon.forward,
+                          {'query': 'hi'}, address, timeout=0.1)
+
+
+class Options(unittest.TestCase):
+    """ The options of a query override the wizard's """
+
+    def setUp(self):
+        self.wizard = lib.wizard.Wizard.__new__(lib.wizard.Wizard)
+        self.wizard.__dict__.update({
+            'dispatcher': None, 'config': {}, 'store': {}, 'scheduler': None,
+            'deadline': 10.0, 'speculate': 1
+        })
+        patch = mock.patch('lib.wizard.ask')
+        self.ask = patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_defaults(self):
+        self.wizard.ask('hi')
+        self.ask.assert_called_once_with('hi', None, {}, {}, 10.0, 1)
+
+    def test_overridden(self):
+        self.wizard.ask('hi', deadline=2.5, speculate=3)
+        self.ask.assert_called_once_with('hi', None, {}, {}, 2.5, 3)
+        self.ask.reset_mock()
+        self.wizard.ask('hi', deadline=0, speculate=0)  # No limit
+        self.ask.assert_called_once_with('hi', None, {}, {}, None, 1)
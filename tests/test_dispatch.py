@@ -0,0 +1,131 @@
+import time
+import warnings
+
+import lib.registry
+import lib.dispatch
+
+from tests import PATTERNS, QUERIES, spell, mock, unittest
+
+
+class CombinedScan(unittest.TestCase):
+    """
+    ``lib.dispatch.Dispatcher.parse`` gives the same results as calling
+    ``lib.spell.BaseSpell.parse`` on every spell
+    """
+
+    def assertSameParse(self, groups, queries):
+        dispatcher = lib.dispatch.Dispatcher(groups)
+        spells = [dispatcher.spell(position) for position in
+                  range(len(groups))]
+        for query in queries:
+            expected = sorted(
+                (spell.__class__.__name__, score, parsed)
+                for score, spell, parsed in
+                (spell.parse(query) for spell in spells)
+                if score > float('-inf')
+            )
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                found = sorted(
+                    (spell.__class__.__name__, score, parsed)
+                    for score, spell, parsed in dispatcher.parse(query)
+                )
+            self.assertEqual(found, expected, 'Parsing %r' % query)
+
+    def test_spells(self):
+        lib.registry.discover()
+        queries = QUERIES + [
+            'How awesome am I?', 'How awesome is Troz???',
+            'What will today\'s weather be like?',
+            'What is the forecast for next Tuesday?',
+            'What is next Friday\'s forecast for Dallas, Texas?',
+            'What is the current weather', 'What is your name?',
+            'Where was George Washington born?', 'When is Christmas?',
+            '2 to the 10',
+        ]
+        self.assertSameParse(list(lib.registry.all()), queries)
+
+    def test_each_pattern(self):
+        for pattern in PATTERNS:
+            self.assertSameParse([spell(pattern)[1]], QUERIES)
+
+    def test_all_patterns(self):
+        # Merged into one expression, where the groups are renumbered
+        groups = [
+            spell(pattern, name='Synthetic%d' % index)[1]
+            for index, pattern in enumerate(PATTERNS)
+        ]
+        self.assertSameParse(groups, QUERIES)
+
+    def test_blacklists(self):
+        groups = [
+            spell(r"(?:what|who)\s+(?:is|are)\s+(.+)", r".*\byou\b",
+                  name='NotYou')[1],
+            spell(r"(\w+)\s+\1", r"(bye)\s+\1", name='NotBye')[1],
+            spell(r".*", r"(?=.*dog)", name='NoDogs')[1],
+        ]
+        self.assertSameParse(groups, QUERIES)
+
+    def test_candidates(self):
+        groups = [
+            spell(r"(?:hello|hi|hey)\s+(\w+)", weight=10, name='Low')[1],
+            spell(r"(?P<who>\w+)\s+there", weight=50, name='Named')[1],
+            spell(r"(\w+)\s+\1", weight=100, name='Twice')[1],
+            spell(r".*", weight=-100, name='Fallback')[1],
+            spell(r".*", name='Never')[1],
+        ]
+        groups[-1]['weight'] = float('-inf')
+        dispatcher = lib.dispatch.Dispatcher(groups)
+        self.assertEqual(
+            [(candidate.spell.__class__.__name__, candidate.query)
+             for candidate in dispatcher.candidates('hi there')],
+            [('Named', 'hi'), ('Low', 'there'), ('Fallback', 'hi there')]
+        )
+
+    def test_lazy(self):
+        # The patterns matched on their own, risky or not, are only
+        # matched once the better spells have been pulled
+        groups = [
+            spell(r"hi\s+(\w+)", weight=100, name='Best')[1],
+            spell(r"(?P<who>\w+)\s+there", weight=50, name='Named')[1],
+            spell(r"(?:\w+\s*)+(there)", weight=10, name='Risky')[1],
+        ]
+        self.assertTrue(groups[2]['risks'])
+        dispatcher = lib.dispatch.Dispatcher(groups)
+        with mock.patch.object(dispatcher, 'guard',
+                               wraps=dispatcher.guard) as guard:
+            candidates = dispatcher.candidates('hi there')
+            self.assertEqual(next(candidates).spell.__class__.__name__,
+                             'Best')
+            self.assertFalse(guard.called)
+            self.assertEqual(dispatcher.spells[1:], [None, None])
+            self.assertEqual(
+                [candidate.query for candidate in candidates],
+                ['hi', 'there']
+            )
+            self.assertTrue(guard.called)
+
+    def test_guard(self):
+        # A risky spell that takes too long is skipped for long queries,
+        # for a while only
+        groups = [spell(r"\w*\w*\w*!", name='Slow')[1]]
+        dispatcher = lib.dispatch.Dispatcher(groups)
+        query = 'a' * 200 + '?!'
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            dispatcher.budget = 1e-9
+            self.assertEqual(dispatcher.parse(query), [])
+            self.assertEqual(dispatcher.limit(0), len(query) // 2)
+            self.assertEqual(dispatcher.plausible(query), ())
+            self.assertEqual(len(caught), 2)
+
+            dispatcher.budget = lib.dispatch.Dispatcher.budget
+            self.assertEqual(
+                [parsed for score, found, parsed in dispatcher.parse('abc!')],
+                ['abc!']
+            )
+
+            limit, until = dispatcher.penalties[0]
+            dispatcher.penalties[0] = (limit, time.time())
+            self.assertEqual(dispatcher.limit(0), dispatcher.maxLength)
+            self.assertEqual(dispatcher.plausible(query), (0,))
@@ -0,0 +1,141 @@
+import socket
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler  # Python2.x
+
+import lib.http
+
+from tests import mock, unittest
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive
+
+    def do_GET(self):
+        # The host asked for
+        body = self.headers.get('Host').split(':')[0].encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/close':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        if self.command == 'GET':
+            self.wfile.write(body)
+
+    do_HEAD = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class Connections(unittest.TestCase):
+    """ The connections of ``lib.http``, to a server on this machine """
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+
+        for patch in (
+            mock.patch.dict(lib.http._SESSIONS, clear=True),
+            mock.patch.dict(lib.http._STATS, clear=True),
+            mock.patch.dict(lib.http._DNS, clear=True),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def close(self):
+        for session in lib.http._SESSIONS.values():
+            session.close()
+
+    def test_reuse(self):
+        for _ in range(3):
+            response = lib.http.request('GET', self.url, timeout=5)
+            self.assertEqual(response.text, '127.0.0.1')
+        stats = lib.http.stats()
+        self.assertEqual(
+            dict((key, stats[key]) for key in
+                 ('requests', 'connections', 'warmed', 'open')),
+            {'requests': 3, 'connections': 1, 'warmed': 0, 'open': 1}
+        )
+        self.assertAlmostEqual(stats['reuse'], 2 / 3.0)
+        self.close()
+
+    def test_closed(self):
+        for _ in range(2):
+            lib.http.request('GET', self.url + 'close', timeout=5)
+        stats = lib.http.stats()
+        self.assertEqual(
+            (stats['requests'], stats['connections'], stats['open']),
+            (2, 2, 0)
+        )
+
+    def test_warm(self):
+        lib.http.warm([self.url])
+        lib.http.warm([self.url])  # Already open
+        lib.http.request('GET', self.url, timeout=5)
+        stats = lib.http.stats()
+        self.assertEqual(
+            (stats['connections'], stats['warmed'], stats['reuse']),
+            (0, 1, 1.0)
+        )
+        self.close()
+
+    def test_dns_cache(self):
+        original = socket.getaddrinfo
+
+        def getaddrinfo(host, *args, **kwargs):
+            return original(host == 'troz.test' and '127.0.0.1' or host,
+                            *args, **kwargs)
+
+        url = self.url.replace('127.0.0.1', 'troz.test')
+        with mock.patch('socket.getaddrinfo',
+                        side_effect=getaddrinfo) as resolve:
+            for _ in range(2):
+                response = lib.http.request('GET', url + 'close', timeout=5)
+                self.assertEqual(response.text, 'troz.test')
+        # Resolved once, for both connections; urllib3 was given the address
+        self.assertEqual(
+            [call[0][0] for call in resolve.call_args_list].count('troz.test'),
+            1
+        )
+        self.assertEqual(lib.http.stats()['hosts']['troz.test']['connections'],
+                         2)
+
+    def test_addresses(self):
+        # The first address refuses connections, such as an IPv6 address
+        # without a route to it: the next one is tried
+        original = socket.getaddrinfo
+
+        def getaddrinfo(host, *args, **kwargs):
+            if host != 'troz.test':
+                return original(host, *args, **kwargs)
+            return (original('127.0.0.2', *args, **kwargs) +
+                    original('127.0.0.1', *args, **kwargs))
+
+        url = self.url.replace('127.0.0.1', 'troz.test')
+        with mock.patch('socket.getaddrinfo', side_effect=getaddrinfo):
+            for _ in range(2):
+                response = lib.http.request('GET', url + 'close', timeout=5)
+                self.assertEqual(response.text, 'troz.test')
+        self.assertEqual(
+            lib.http._DNS[('troz.test', self.server.server_address[1])][1],
+            ['127.0.0.2', '127.0.0.1']
+        )
+
+    def test_scoped(self):
+        # Only Troz's own sessions resolve through the cache
+        import urllib3.util.connection
+
+        original = urllib3.util.connection.create_connection
+        lib.http.request('GET', self.url, timeout=5)
+        self.close()
+        self.assertTrue(urllib3.util.connection.create_connection is original)
@@ -0,0 +1,195 @@
+import os
+import json
+import shutil
+import tempfile
+
+import lib.httpcache
+
+from tests import URL, FetchCase, response, unittest
+
+
+class Decoded(FetchCase):
+    """ The decoded responses count towards the size of the cache """
+
+    def fetch(self, cache, content, url=URL):
+        self.request.return_value = response(
+            json.dumps(content).encode('UTF-8'),
+            headers={'Cache-Control': 'max-age=60'}
+        )
+        return super(Decoded, self).fetch(url, format='json', cache=cache)
+
+    def test_counted(self):
+        cache = lib.httpcache.Cache(maxMemory=1 << 20)
+        content = {'items': [{'name': 'item %d' % i} for i in range(100)]}
+        result = self.fetch(cache, content)
+        self.assertEqual(result, content)
+
+        entry = cache.get(lib.httpcache.key(URL))
+        self.assertTrue(entry.decoded['json'] is result)
+        self.assertEqual(entry.size,
+                         len(entry.body) + lib.httpcache.sizeof(result))
+        self.assertTrue(entry.size > len(json.dumps(content)))
+        self.assertEqual(cache.memorySize, entry.size)
+
+        # Hits are not decoded again
+        self.request.reset_mock()
+        self.assertTrue(
+            super(Decoded, self).fetch(format='json', cache=cache) is result
+        )
+        self.assertFalse(self.request.called)
+
+    def test_evicted(self):
+        content = dict(('key %d' % i, 'value %d' % i) for i in range(100))
+        size = lib.httpcache.sizeof(content)
+        cache = lib.httpcache.Cache(maxMemory=int(size * 1.5))
+        self.fetch(cache, content, URL + '/1')
+        self.fetch(cache, content, URL + '/2')
+        # The first response is evicted to make room for the second,
+        # decoded
+        self.assertEqual(list(cache.memory), [lib.httpcache.key(URL + '/2')])
+        self.assertEqual(cache.memorySize,
+                         cache.memory[lib.httpcache.key(URL + '/2')].size)
+        self.assertEqual(cache.stats()['evicted'], 1)
+
+    def test_too_large(self):
+        content = dict(('key %d' % i, 'value %d' % i) for i in range(100))
+        cache = lib.httpcache.Cache(
+            maxMemory=lib.httpcache.sizeof(content) // 2
+        )
+        self.assertEqual(self.fetch(cache, content), content)
+        entry = cache.get(lib.httpcache.key(URL))
+        self.assertEqual(entry.decoded, {})
+        self.assertEqual(cache.memorySize, len(entry.body))
+
+    def test_sizeof(self):
+        from xml.etree import ElementTree as ETree
+
+        text = 'x' * 1000
+        self.assertTrue(lib.httpcache.sizeof(text) >= 1000)
+        self.assertTrue(lib.httpcache.sizeof([text, text]) <
+                        lib.httpcache.sizeof([text, 'y' * 1000]))
+        element = ETree.fromstring('<a><b>%s</b><c x="1"/></a>' % text)
+        self.assertTrue(lib.httpcache.sizeof(element) > 1000)
+        self.assertTrue(lib.httpcache.sizeof(ETree.ElementTree(element)) >
+                        lib.httpcache.sizeof(element))
+
+
+class Revalidation(FetchCase):
+    """ ``lib.httpcache.fetch`` against a stubbed ``lib.http.request`` """
+
+    def setUp(self):
+        super(Revalidation, self).setUp()
+        self.cache = lib.httpcache.Cache()
+
+    def fetch(self, *responses, **kwargs):
+        self.request.side_effect = list(responses)
+        return super(Revalidation, self).fetch(cache=self.cache, **kwargs)
+
+    def test_fresh(self):
+        self.assertEqual(self.fetch(response(
+            b'Hello', headers={'Cache-Control': 'max-age=60'}
+        )), 'Hello')
+        self.assertEqual(self.fetch(), 'Hello')
+        self.assertEqual(self.request.call_count, 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_not_modified(self):
+        self.assertEqual(self.fetch(response(b'Hello', headers={
+            'Cache-Control': 'no-cache', 'ETag': '"1"',
+            'Last-Modified': 'Sat, 17 Oct 2026 10:00:00 GMT'
+        })), 'Hello')
+        self.assertEqual(self.fetch(response(
+            status=304, headers={'ETag': '"2"', 'Cache-Control': 'max-age=60'}
+        )), 'Hello')
+        self.assertEqual(self.request.call_args[1]['headers'], {
+            'If-None-Match': '"1"',
+            'If-Modified-Since': 'Sat, 17 Oct 2026 10:00:00 GMT'
+        })
+        # Fresh again, with the new validator
+        self.assertEqual(self.fetch(), 'Hello')
+        entry = self.cache.get(lib.httpcache.key(URL))
+        self.assertEqual(entry.validators()['If-None-Match'], '"2"')
+        self.assertEqual(self.request.call_count, 2)
+        self.assertEqual(self.cache.stats()['revalidated'], 1)
+
+    def test_modified(self):
+        self.fetch(response(b'Hello', headers={'ETag': '"1"'}))
+        self.assertEqual(self.fetch(response(b'World', headers={
+            'ETag': '"2"'
+        })), 'World')
+        self.assertEqual(self.request.call_args[1]['headers'],
+                         {'If-None-Match': '"1"'})
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_not_stored(self):
+        for headers in ({}, {'Cache-Control': 'no-store, max-age=60'}):
+            self.fetch(response(b'Hello', headers=headers))
+            self.assertEqual(self.cache.get(lib.httpcache.key(URL)), None)
+
+    def test_ttl(self):
+        # The spell's fetchTTL wins over the headers
+        self.assertEqual(self.fetch(response(b'Hello', headers={
+            'Cache-Control': 'no-cache'
+        }), ttl=60), 'Hello')
+        self.assertEqual(self.fetch(ttl=60), 'Hello')
+        self.assertEqual(self.request.call_count, 1)
+
+    def test_error(self):
+        self.assertRaises(IOError, self.fetch, response(b'Oops', status=500))
+        self.assertEqual(self.cache.get(lib.httpcache.key(URL)), None)
+
+
+class Size(unittest.TestCase):
+    """ The cache stays within its limits, in memory and on disk """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def entry(self, index):
+        return lib.httpcache.Entry(
+            '%s/%d' % (URL, index), os.urandom(1000), 'UTF-8', {}
+        )
+
+    def test_memory(self):
+        cache = lib.httpcache.Cache(maxMemory=5000)
+        for index in range(10):
+            cache.put(str(index), self.entry(index))
+        self.assertTrue(cache.memorySize <= 5000)
+        self.assertEqual(cache.memorySize, sum(
+            entry.size for entry in cache.memory.values()
+        ))
+        # The least recently used go first
+        self.assertEqual(list(cache.memory)[-1], '9')
+        self.assertEqual(cache.get('0'), None)
+        self.assertEqual(cache.stats()['evicted'], 10 - len(cache.memory))
+
+    def test_disk(self):
+        cache = lib.httpcache.Cache(directory=self.directory)
+        entry = self.entry(0)
+        entry.expires = 42
+        cache.put('0', entry)
+
+        # Another process, or the next run
+        loaded = lib.httpcache.Cache(directory=self.directory).get('0')
+        self.assertEqual(loaded.content, entry.content)
+        self.assertEqual((loaded.url, loaded.expires), (entry.url, 42))
+
+        cache.forget('0')
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(
+            lib.httpcache.Cache(directory=self.directory).get('0'), None
+        )
+
+    def test_disk_size(self):
+        cache = lib.httpcache.Cache(directory=self.directory, maxDisk=5000)
+        for index in range(10):
+            cache.put(str(index), self.entry(index))
+        files = os.listdir(self.directory)
+        self.assertTrue(0 < len(files) < 10)
+        self.assertTrue('9' in files and '0' not in files)
+        self.assertTrue(cache.stats()['disk'] <= 5000)
+        self.assertEqual(cache.stats()['disk'], sum(
+            os.path.getsize(os.path.join(self.directory, name))
+            for name in files
+        ))
@@ -0,0 +1,70 @@
+import re
+
+import lib.registry
+import lib.keywords
+import lib.dispatch
+
+from tests import PATTERNS, QUERIES, spell, unittest
+
+
+class Required(unittest.TestCase):
+    """
+    ``lib.keywords.required`` never rules out a spell that matches: one
+    of the keywords it finds is in every query the pattern matches
+    """
+
+    def assertNeverDropped(self, pattern, queries):
+        keywords = lib.keywords.required(pattern)
+        regex = re.compile(pattern, lib.dispatch.FLAGS)
+        for query in queries:
+            if keywords is None or not regex.match(query):
+                continue
+            self.assertTrue(
+                lib.keywords.KeywordIndex(keywords).search(query),
+                '%r matches %r, but none of %s is found in it' % (
+                    pattern, query, sorted(keywords)
+                )
+            )
+
+    def test_patterns(self):
+        for pattern in PATTERNS:
+            self.assertNeverDropped(pattern, QUERIES)
+
+    def test_spells(self):
+        lib.registry.discover()
+        queries = QUERIES + [
+            'How awesome am I?', 'HOW AWESOME IS TROZ',
+            'What will today\'s weather be like?',
+            'What is the FORECAST for next Tuesday?',
+            'Where was George Washington born?', '2 to the 10'
+        ]
+        for group in lib.registry.all():
+            self.assertNeverDropped(group['pattern'], queries)
+
+    def test_keywords(self):
+        self.assertEqual(lib.keywords.required(r"ping"), set(['ping']))
+        self.assertEqual(lib.keywords.required(r"(?:hello|hi|hey)\s+(\w+)"),
+                         set(['hello', 'hi', 'hey']))
+        self.assertEqual(lib.keywords.required(r"(?:please\s+)?define"),
+                         set(['define']))
+        self.assertEqual(lib.keywords.required(r"(\d+)\s*\+\s*(\d+)"),
+                         set([lib.keywords.DIGIT]))
+        # Nothing in particular is required
+        self.assertEqual(lib.keywords.required(r".*"), None)
+        self.assertEqual(lib.keywords.required(r"(\w+)\s+\1"), None)
+        self.assertEqual(lib.keywords.required(r"(?:hello)?|bye"), None)
+        # Invalid
+        self.assertEqual(lib.keywords.required(r"(unbalanced"), None)
+
+    def test_plausible(self):
+        groups = [
+            spell(pattern, name='Synthetic%d' % index)[1]
+            for index, pattern in enumerate(PATTERNS)
+        ]
+        dispatcher = lib.dispatch.Dispatcher(groups)
+        for query in QUERIES:
+            plausible = dispatcher.plausible(query)
+            for position, group in enumerate(groups):
+                if re.match(group['pattern'], query, lib.dispatch.FLAGS):
+                    self.assertTrue(position in plausible, '%r dropped for %r'
+                                    % (group['pattern'], query))
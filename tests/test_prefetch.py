@@ -0,0 +1,229 @@
+import os
+import json
+import shutil
+import tempfile
+
+import lib.spell
+import lib.breaker
+import lib.registry
+import lib.dispatch
+import lib.prefetch
+import lib.ratelimit
+import lib.answercache
+
+from tests import URL, AskCase, Clock, mock, spell, unittest
+
+#: The spells of this repository, wherever the tests are run from
+ROOT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'spells'
+)
+
+
+class Predicted(unittest.TestCase):
+    """
+    Only the spells which predict queries are imported for them (see
+    ``lib.prefetch.Scheduler.predicted``)
+    """
+
+    def setUp(self):
+        # A manifest of its own, even if the spells' directory is read only
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.manifest = os.path.join(directory, lib.registry.MANIFEST)
+        with mock.patch.object(lib.registry, 'MANIFEST', self.manifest):
+            lib.registry.discover(ROOT)
+
+    def test_registered(self):
+        self.assertTrue(
+            lib.registry.lookup_by_name(spell='OpenWeatherMap')['predicts']
+        )
+        self.assertFalse(
+            lib.registry.lookup_by_name(spell='Awesome')['predicts']
+        )
+
+    def test_manifest(self):
+        with open(self.manifest) as f:
+            records = json.load(f)['spells']
+        self.assertEqual(
+            sorted(record['name'] for record in records
+                   if record['predicts']),
+            ['OpenWeatherMap']
+        )
+
+    def test_overrides(self):
+        with mock.patch('lib.registry.register'):
+            Plain = type('Plain', (lib.spell.BaseSpell,), {})
+            Predicting = type('Predicting', (Plain,), {
+                'predict': lambda self, config: ['ping']
+            })
+            Inherited = type('Inherited', (Predicting,), {})
+        self.assertFalse(lib.registry._overrides(Plain, 'predict'))
+        self.assertTrue(lib.registry._overrides(Predicting, 'predict'))
+        self.assertTrue(lib.registry._overrides(Inherited, 'predict'))
+
+    def test_lazy(self):
+        dispatcher = lib.dispatch.Dispatcher(lib.registry.all())
+        scheduler = lib.prefetch.Scheduler(dispatcher, {}, {})
+        with mock.patch('lib.registry.load',
+                        wraps=lib.registry.load) as load:
+            predicted = scheduler.predicted()
+        self.assertEqual(predicted, [
+            "What will today's weather be like",
+            "What will tomorrow's weather be like"
+        ])
+        self.assertEqual([call[0][0]['name'] for call in load.call_args_list],
+                         ['OpenWeatherMap'])
+
+
+class Counted(unittest.TestCase):
+    """
+    The popular queries (see ``lib.prefetch.Scheduler.record`` and
+    ``hot``)
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        patch = mock.patch.object(lib.prefetch, 'time', self.clock)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.scheduler = lib.prefetch.Scheduler(None, {}, {}, top=2,
+                                                halfLife=100.0, maxQueries=4)
+
+    def record(self, query, times=1):
+        for _ in range(times):
+            self.scheduler.record(query)
+
+    def test_hot(self):
+        # Queries asked only once are not popular
+        self.record('What time is it?', 2)
+        self.record('Weather', 3)
+        self.record('Tell me a joke')
+        self.assertEqual(self.scheduler.hot(),
+                         ['Weather', 'What time is it'])
+
+    def test_top(self):
+        for times, query in enumerate(('one', 'two', 'three')):
+            self.record(query, times + 2)
+        self.assertEqual(self.scheduler.hot(), ['three', 'two'])
+
+    def test_decay(self):
+        self.record('Weather', 4)
+        self.clock.now += 100
+        self.record('What time is it?', 3)
+        self.assertEqual(self.scheduler.hot(),
+                         ['What time is it', 'Weather'])
+        # Counts of 1 and 1.5
+        self.clock.now += 100
+        self.assertEqual(self.scheduler.hot(), ['What time is it'])
+        # Counted again, from what is left of the count
+        self.record('Weather')
+        self.assertEqual(self.scheduler.hot(), ['Weather', 'What time is it'])
+
+    def test_forgotten(self):
+        # The least popular half goes, once there are too many
+        for times, query in enumerate(('one', 'two', 'three', 'four')):
+            self.record(query, 4 - times)
+        self.assertEqual(len(self.scheduler.queries), 4)
+        self.record('five')
+        self.assertEqual(sorted(self.scheduler.queries),
+                         ['one', 'three', 'two'])
+
+
+class Prefetched(AskCase):
+    """ Answers about to expire (see ``lib.prefetch.Scheduler.prefetch``) """
+
+    def setUp(self):
+        super(Prefetched, self).setUp()
+        self.clock = Clock()
+        for patch in (
+            mock.patch.object(lib.prefetch, 'time', self.clock),
+            mock.patch.object(lib.answercache, 'time', self.clock),
+            mock.patch.dict(lib.breaker._BREAKERS, clear=True),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.limit = lib.ratelimit.Limit('60/minute', burst=4)
+        self.cls = self.add('Weather', 100, 'Sunny', cacheTTL=600,
+                            hosts=(URL,), rateLimit=self.limit)
+        self.scheduler = lib.prefetch.Scheduler(
+            lib.dispatch.Dispatcher(self.groups), {}, self.store,
+            interval=30.0
+        )
+
+    def prefetch(self):
+        return self.scheduler.prefetch('hello')
+
+    def name(self):
+        """ The cache key of the answer """
+        return lib.answercache.key(self.cls(), 'hello', {})
+
+    def test_prefetched(self):
+        self.assertTrue(self.prefetch())
+        self.assertEqual(len(self.runs), 1)
+        self.assertEqual(self.store, {'Weather': {'by': 'Weather'}})
+        self.assertEqual(lib.answercache.CACHE.get(self.name()),
+                         ('Sunny', True))
+        self.assertEqual(self.scheduler.stats()['prefetched'], 1)
+        # Then answered from the cache
+        self.assertEqual(self.ask().result, 'Sunny')
+        self.assertEqual(len(self.runs), 1)
+
+    def test_fresh(self):
+        self.ask()
+        self.assertFalse(self.prefetch())
+        # Expiring before the next run
+        self.clock.now += 600 - 2 * 30
+        self.assertTrue(self.prefetch())
+        self.assertEqual(len(self.runs), 2)
+
+    def test_not_cached(self):
+        self.cls.cacheTTL = 0
+        self.assertFalse(self.prefetch())
+        self.assertEqual(self.runs, [])
+
+    def test_breaker(self):
+        for _ in range(lib.breaker.threshold):
+            lib.breaker.breaker(URL).failure()
+        self.assertFalse(self.prefetch())
+        self.assertEqual(self.runs, [])
+        self.assertEqual(self.scheduler.stats()['deferred'], 1)
+
+    def test_quota(self):
+        # Only while at least half of it is left
+        for _ in range(3):
+            self.limit.acquire()
+        self.assertTrue(self.limit.available())
+        self.assertFalse(self.prefetch())
+        self.assertEqual(self.runs, [])
+        self.assertEqual(self.scheduler.stats()['deferred'], 1)
+
+    def test_claimed(self):
+        # Already being refreshed (see ``lib.wizard._refresh``)
+        self.assertTrue(lib.answercache.CACHE.claim(self.name()))
+        self.assertFalse(self.prefetch())
+        self.assertEqual(self.runs, [])
+        lib.answercache.CACHE.release(self.name())
+        self.assertTrue(self.prefetch())
+        # And released once done
+        self.assertTrue(lib.answercache.CACHE.claim(self.name()))
+
+    def test_failed(self):
+        # The next spell is tried, and the failure is not reported
+        self.cls.incantation = lambda spell, query, config, state: (
+            None, state
+        )
+        worse = self.add('Worse', 50, 'Cloudy', cacheTTL=600)
+        scheduler = lib.prefetch.Scheduler(
+            lib.dispatch.Dispatcher(self.groups), {}, self.store
+        )
+        self.assertTrue(scheduler.prefetch('hello'))
+        self.assertEqual(scheduler.stats()['failed'], 1)
+        self.assertEqual(scheduler.stats()['prefetched'], 1)
+        self.assertEqual(
+            lib.answercache.CACHE.get(lib.answercache.key(worse(), 'hello',
+                                                          {})),
+            ('Cloudy', True)
+        )
+        self.assertEqual(self.store, {'Worse': {'by': 'Worse'}})
+        self.assertFalse(self.failed.called)
+        self.assertFalse(lib.answercache.CACHE.refreshing)
@@ -0,0 +1,158 @@
+import lib.breaker
+import lib.deadline
+import lib.httpcache
+import lib.ratelimit
+import lib.store
+
+from tests import URL, Clock, FetchCase, mock, response, unittest
+
+
+class Limited(FetchCase):
+    """ The token buckets of ``lib.ratelimit``, and ``fetch`` within them """
+
+    def setUp(self):
+        super(Limited, self).setUp()
+        self.clock = Clock()
+        patch = mock.patch.object(lib.ratelimit, 'time', self.clock)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.request.return_value = response(b'Hello')
+
+    def test_parse(self):
+        self.assertEqual(lib.ratelimit.parse('60/minute'), 1.0)
+        self.assertEqual(lib.ratelimit.parse('7200/hours'), 2.0)
+        self.assertEqual(lib.ratelimit.parse(0.5), 0.5)
+        self.assertRaises(ValueError, lib.ratelimit.parse, '60/fortnight')
+
+    def test_burst(self):
+        limit = lib.ratelimit.Limit('60/minute', burst=3, queue=0)
+        for _ in range(3):
+            self.assertEqual(self.fetch(limit=limit), 'Hello')
+        self.assertRaises(lib.ratelimit.QuotaExceeded, self.fetch,
+                          limit=limit)
+        self.assertEqual(self.request.call_count, 3)
+        self.assertEqual(self.clock.slept, [])
+        self.assertEqual(
+            limit.stats(),
+            {'granted': 3, 'waited': 0, 'rejected': 1, 'tokens': 0}
+        )
+
+    def test_refill(self):
+        limit = lib.ratelimit.Limit('60/minute', burst=2, queue=0)
+        for _ in range(2):
+            limit.acquire()
+        self.assertFalse(limit.available())
+        self.clock.now += 1
+        self.assertTrue(limit.available())
+        self.clock.now += 60  # Never more than the burst
+        self.assertEqual(limit.stats()['tokens'], 2)
+
+    def test_queue(self):
+        limit = lib.ratelimit.Limit('60/minute', burst=1, queue=2, wait=5)
+        for _ in range(3):
+            self.assertEqual(self.fetch(limit=limit), 'Hello')
+        # Each waited for its turn
+        self.assertEqual(self.clock.slept, [1.0, 1.0])
+        self.assertEqual(limit.stats()['waited'], 2)
+
+    def test_full_queue(self):
+        limit = lib.ratelimit.Limit('60/minute', burst=1, queue=2, wait=5)
+        limit.acquire()
+        with mock.patch.object(self.clock, 'sleep'):  # All waiting at once
+            limit.acquire()
+            limit.acquire()
+        self.assertRaises(lib.ratelimit.QuotaExceeded, limit.acquire)
+
+    def test_wait(self):
+        # Too long a wait for the limit, then for the query's deadline
+        limit = lib.ratelimit.Limit('1/minute', burst=1, wait=30)
+        limit.acquire()
+        self.assertFalse(limit.available())
+        self.assertRaises(lib.ratelimit.QuotaExceeded, self.fetch,
+                          limit=limit)
+
+        limit = lib.ratelimit.Limit('60/minute', burst=1)
+        limit.acquire()
+        self.assertTrue(limit.available())
+        self.assertFalse(limit.available(budget=0.5))
+        with lib.deadline.Deadline(0.5):
+            self.assertRaises(lib.ratelimit.QuotaExceeded, self.fetch,
+                              limit=limit)
+        self.assertEqual(self.request.call_count, 0)
+
+    def test_spare(self):
+        limit = lib.ratelimit.Limit('60/minute', burst=4)
+        self.assertTrue(limit.spare())
+        for _ in range(3):
+            limit.acquire()
+        self.assertFalse(limit.spare())
+        self.assertTrue(limit.available())
+
+    def test_cached(self):
+        # Only requests that reach the service count
+        limit = lib.ratelimit.Limit('60/minute', burst=1, queue=0)
+        cache = lib.httpcache.Cache()
+        for _ in range(3):
+            self.assertEqual(self.fetch(limit=limit, cache=cache, ttl=60),
+                             'Hello')
+        self.assertEqual(self.request.call_count, 1)
+        self.assertEqual(limit.stats()['granted'], 1)
+
+    def test_not_a_failure(self):
+        # Over quota, the host's breaker is not involved
+        limit = lib.ratelimit.Limit('60/minute', burst=1, queue=0)
+        limit.acquire()
+        for _ in range(2 * lib.breaker.threshold):
+            self.assertRaises(lib.ratelimit.QuotaExceeded, self.fetch,
+                              limit=limit)
+        self.assertEqual(lib.breaker.breaker(URL).state, lib.breaker.CLOSED)
+
+
+class Saved(unittest.TestCase):
+    """ Named limits survive restarts, in the spells' store """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.store = lib.store.MemoryStore()
+        for patch in (
+            mock.patch.object(lib.ratelimit, 'time', self.clock),
+            mock.patch.object(lib.ratelimit, '_STORE', self.store),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def restart(self, name='Service'):
+        # A new process, with the same store
+        return lib.ratelimit.Limit('2000/month', burst=3, queue=0, name=name)
+
+    def test_restarted(self):
+        limit = self.restart()
+        for _ in range(3):
+            limit.acquire()
+        self.assertEqual(self.store['Quota:Service'],
+                         {'tokens': 0, 'updated': 1000.0})
+        limit = self.restart()
+        self.assertFalse(limit.available())
+        self.assertRaises(lib.ratelimit.QuotaExceeded, limit.acquire)
+
+        # Refilled while no process was running
+        self.clock.now += 86400 * 30 / 2000.0
+        self.assertTrue(self.restart().available())
+
+    def test_unnamed(self):
+        limit = self.restart(name=None)
+        for _ in range(3):
+            limit.acquire()
+        self.assertEqual(self.store, {})
+        self.assertTrue(self.restart(name=None).available())
+
+    def test_store(self):
+        # Such as a daemon started with another store
+        limit = self.restart()
+        limit.acquire()
+        other = lib.store.MemoryStore({'Quota:Service': {
+            'tokens': 0.5, 'updated': 1000.0
+        }})
+        with mock.patch.object(lib.ratelimit, '_STORE', other):
+            self.assertEqual(limit.stats()['tokens'], 0.5)
+            self.assertFalse(limit.available())
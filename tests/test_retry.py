@@ -0,0 +1,139 @@
+import threading
+
+import lib.spell
+import lib.retry
+import lib.deadline
+import lib.ratelimit
+
+from tests import FetchCase, mock, response, spell, unittest
+
+
+class Retried(FetchCase):
+    """ ``lib.httpcache.fetch`` follows the spell's ``lib.retry.Policy`` """
+
+    def setUp(self):
+        super(Retried, self).setUp()
+        patch = mock.patch.dict(lib.retry._STATS, clear=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_retried(self):
+        self.request.side_effect = [IOError('Offline'), response(b'Hello')]
+        policy = lib.retry.Policy(backoff=0)
+        self.assertEqual(self.fetch(policy=policy), 'Hello')
+        self.assertEqual(self.request.call_count, 2)
+        self.assertEqual(lib.retry.stats()['retries'], 1)
+
+    def test_attempts(self):
+        self.request.return_value = response(b'Busy', status=503)
+        self.assertRaises(IOError, self.fetch,
+                          policy=lib.retry.Policy(attempts=3, backoff=0))
+        self.assertEqual(self.request.call_count, 3)
+
+    def test_not_retryable(self):
+        self.request.return_value = response(b'Not found', status=404)
+        self.assertRaises(IOError, self.fetch,
+                          policy=lib.retry.Policy(backoff=0))
+        self.assertEqual(self.request.call_count, 1)
+
+    def test_rejected(self):
+        self.request.side_effect = [response(b''), response(b'Hello')]
+        policy = lib.retry.Policy(backoff=0, accept=bool)
+        self.assertEqual(self.fetch(policy=policy), 'Hello')
+        self.assertEqual(self.request.call_count, 2)
+
+    def test_deadline(self):
+        # No time left to wait before trying again
+        self.request.side_effect = [IOError('Offline'), response(b'Hello')]
+        policy = lib.retry.Policy(backoff=60, maximum=60)
+        with mock.patch('random.uniform', return_value=30):
+            with lib.deadline.Deadline(5):
+                self.assertRaises(IOError, self.fetch, policy=policy)
+        self.assertEqual(self.request.call_count, 1)
+
+    def test_delay(self):
+        policy = lib.retry.Policy(backoff=0.25, maximum=2.0)
+        with mock.patch('random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([policy.delay(retry) for retry in range(5)],
+                             [0.25, 0.5, 1.0, 2.0, 2.0])
+
+
+class Hedged(FetchCase):
+    """ Slow requests are sent twice (see ``lib.retry.Policy.send``) """
+
+    def setUp(self):
+        super(Hedged, self).setUp()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        patch = mock.patch.dict(lib.retry._STATS, clear=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.request.side_effect = self.send
+        self.policy = lib.retry.Policy(hedge=0.5)
+        self.policy.latencies.extend([0.01] * lib.retry.SAMPLES)
+
+    def send(self, *args, **kwargs):
+        # The first request hangs, the second answers at once
+        if self.request.call_count == 1:
+            self.release.wait(5)
+            return response(b'Slow')
+        return response(b'Fast')
+
+    def fetch(self, **kwargs):
+        return super(Hedged, self).fetch(policy=self.policy, **kwargs)
+
+    def test_hedged(self):
+        self.assertEqual(self.fetch(), 'Fast')
+        self.assertEqual(self.request.call_count, 2)
+        self.assertEqual(lib.retry.stats(),
+                         {'retries': 0, 'hedged': 1, 'hedgesWon': 1})
+
+    def test_too_few_samples(self):
+        self.policy.latencies.clear()
+        self.release.set()
+        self.assertEqual(self.fetch(), 'Slow')
+        self.assertEqual(self.request.call_count, 1)
+
+    def test_quota(self):
+        # A second request would spend another token
+        limit = lib.ratelimit.Limit('60/minute', burst=10)
+        threading.Timer(0.1, self.release.set).start()
+        self.assertEqual(self.fetch(limit=limit), 'Slow')
+        self.assertEqual(self.request.call_count, 1)
+        self.assertEqual(limit.stats()['granted'], 1)
+        self.assertEqual(lib.retry.stats()['hedged'], 0)
+
+
+class Posted(FetchCase):
+    """ ``POST`` requests are sent once, unless the policy allows more """
+
+    def test_once(self):
+        self.request.side_effect = [IOError('Timed out'), response(b'Hello')]
+        self.assertRaises(IOError, self.fetch, post={'name': 'value'},
+                          policy=lib.retry.Policy(backoff=0))
+        self.assertEqual(self.request.call_count, 1)
+
+    def test_allowed(self):
+        self.request.side_effect = [IOError('Timed out'), response(b'Hello')]
+        policy = lib.retry.Policy(backoff=0, posts=True)
+        self.assertEqual(self.fetch(post={'name': 'value'}, policy=policy),
+                         'Hello')
+        self.assertEqual(self.request.call_count, 2)
+
+
+class Inherited(unittest.TestCase):
+    """ Each spell keeps the latencies of its own requests """
+
+    def test_copied(self):
+        first, _ = spell(r"first")
+        second, _ = spell(r"second")
+        self.assertFalse(first.retry is second.retry)
+        self.assertFalse(first.retry.latencies is second.retry.latencies)
+        self.assertEqual(first.retry.attempts,
+                         lib.spell.BaseSpell.retry.attempts)
+
+    def test_own(self):
+        policy = lib.retry.Policy(attempts=3)
+        with mock.patch('lib.registry.register'):
+            cls = type('Own', (lib.spell.BaseSpell,), {'retry': policy})
+        self.assertTrue(cls.retry is policy)
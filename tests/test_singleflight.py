@@ -0,0 +1,127 @@
+import threading
+
+import lib.deadline
+import lib.httpcache
+import lib.singleflight
+
+from tests import FORMATS, FetchCase, mock, response, unittest
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None  # Python2.x
+
+URL = 'http://troz.test/shared'
+
+
+class Coalesced(FetchCase):
+    """
+    Identical fetches made at the same time reach the server once (see
+    ``lib.httpcache.fetch``)
+    """
+
+    def setUp(self):
+        super(Coalesced, self).setUp()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.flights = lib.singleflight.Group()
+        patch = mock.patch.object(lib.httpcache, 'FLIGHTS', self.flights)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.request.side_effect = self.send
+        self.addCleanup(self.release.set)
+        self.responses = [response(b'Hello')]
+
+    def send(self, *args, **kwargs):
+        self.started.set()
+        self.release.wait(5)
+        item = self.responses.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def collect(self, results):
+        try:
+            results.append(self.fetch(URL))
+        except Exception as e:
+            results.append(e)
+
+    def start(self, results, count):
+        threads = [
+            threading.Thread(target=self.collect, args=(results,))
+            for _ in range(count)
+        ]
+        threads[0].start()
+        self.assertTrue(self.started.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        return threads
+
+    def wait(self, threads, coalesced):
+        for _ in range(500):
+            if self.flights.stats()['coalesced'] >= coalesced:
+                break
+            threading.Event().wait(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+    def test_coalesced(self):
+        results = []
+        threads = self.start(results, 5)
+        self.wait(threads, 4)
+        self.assertEqual(results, ['Hello'] * 5)
+        self.assertEqual(self.request.call_count, 1)
+        self.assertEqual(self.flights.stats(),
+                         {'calls': 1, 'coalesced': 4, 'inflight': 0})
+
+        # Done: the next fetch is a call of its own
+        self.responses = [response(b'World')]
+        self.collect(results)
+        self.assertEqual(results[-1], 'World')
+        self.assertEqual(self.flights.stats()['calls'], 2)
+
+    def test_error(self):
+        self.responses = [IOError('Offline')]
+        results = []
+        threads = self.start(results, 3)
+        self.wait(threads, 2)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertTrue(isinstance(results[0], IOError))
+        self.assertEqual(self.request.call_count, 1)
+
+    def test_follower_timeout(self):
+        results = []
+        threads = self.start(results, 1)
+        with lib.deadline.Deadline(0.05):
+            self.assertRaises(lib.deadline.DeadlineExceeded, self.fetch, URL)
+        # The call itself goes on, for whoever waits for it
+        self.assertEqual(self.flights.stats()['inflight'], 1)
+        self.wait(threads, 1)
+        self.assertEqual(results, ['Hello'])
+        self.assertEqual(self.request.call_count, 1)
+
+    @unittest.skipIf(asyncio is None, 'asyncio is not available')
+    def test_tasks(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        results = []
+        threads = self.start(results, 1)
+
+        def afetch():
+            return lib.httpcache.afetch(
+                URL, format='raw', decode=FORMATS['raw'],
+                cache=lib.httpcache.Cache(), loop=loop
+            )
+
+        futures = [afetch(), afetch()]
+        self.release.set()
+        self.assertEqual(
+            loop.run_until_complete(asyncio.gather(*futures)),
+            ['Hello', 'Hello']
+        )
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ['Hello'])
+        self.assertEqual(self.request.call_count, 1)
@@ -0,0 +1,80 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+
+import lib.store
+
+from tests import mock, unittest
+
+
+class Flushed(unittest.TestCase):
+    """ ``lib.store.JSONStore.flush`` never loses the latest state """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.fileName = os.path.join(directory, 'save.db')
+        self.store = lib.store.JSONStore(self.fileName)
+
+    def saved(self):
+        with open(self.fileName) as f:
+            return json.load(f)
+
+    def test_flush(self):
+        self.store.flush()
+        self.assertFalse(os.path.exists(self.fileName))  # Nothing changed
+        self.store['Spell'] = {'count': 1}
+        self.store.flush()
+        self.assertEqual(self.saved(), {'Spell': {'count': 1}})
+        self.assertEqual(
+            lib.store.JSONStore(self.fileName).get('Spell'), {'count': 1}
+        )
+
+    def test_concurrent(self):
+        # The daemon's flusher is still writing when the last flush starts
+        writing = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+        rename = os.rename
+        errors = []
+
+        def replace(source, destination):
+            if not writing.is_set():  # Only the first flush is held up
+                writing.set()
+                release.wait(5)
+            rename(source, destination)
+
+        def flush():
+            try:
+                self.store.flush()
+            except Exception as e:
+                errors.append(e)
+
+        with mock.patch.object(os, 'replace', side_effect=replace,
+                               create=True):
+            self.store['Spell'] = {'count': 1}
+            flusher = threading.Thread(target=flush)
+            flusher.start()
+            self.assertTrue(writing.wait(5))
+
+            self.store['Spell'] = {'count': 2}
+            last = threading.Thread(target=flush)
+            last.start()
+            last.join(0.1)
+            self.assertTrue(last.is_alive())  # Waits for its turn
+            release.set()
+            flusher.join(5)
+            last.join(5)
+        self.assertEqual(errors, [])
+        self.assertEqual(self.saved(), {'Spell': {'count': 2}})
+
+    def test_failed(self):
+        self.store['Spell'] = {'count': 1}
+        with mock.patch.object(os, 'replace', side_effect=OSError('Full'),
+                               create=True):
+            self.assertRaises(OSError, self.store.flush)
+        self.assertFalse(os.path.exists(self.fileName))
+        self.store.flush()  # Still to be written
+        self.assertEqual(self.saved(), {'Spell': {'count': 1}})
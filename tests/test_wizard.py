@@ -0,0 +1,179 @@
+import time
+import threading
+
+import lib.answercache
+
+from tests import AskCase, Clock, mock, spell
+
+
+class Raced(AskCase):
+    """
+    With ``speculate``, the best few spells are tried at the same time
+    (see ``lib.wizard._race``)
+    """
+
+    def test_best(self):
+        # The worse spell answers first, but the better one still wins
+        self.add('Best', 100, 'Hi', delay=0.1)
+        self.add('Worse', 50, 'Hey')
+        answer = self.ask(speculate=2)
+        self.assertEqual((answer.result, answer.spell), ('Hi', 'Best'))
+        self.assertEqual([name for name, elapsed in answer.timings],
+                         ['Best'])
+        self.assertTrue(answer.elapsed >= 0.1)
+        self.assertEqual(sorted(name for name, deadline in self.runs),
+                         ['Best', 'Worse'])
+
+    def test_failed(self):
+        # The worse spell answers, once the better one has failed
+        best = self.add('Best', 100, delay=0.05)
+        self.add('Worse', 50, 'Hey')
+        answer = self.ask(speculate=2)
+        self.assertEqual((answer.result, answer.spell), ('Hey', 'Worse'))
+        self.assertEqual([name for name, elapsed in answer.timings],
+                         ['Best', 'Worse'])
+        self.assertEqual(self.failed.call_args[0][0].__class__, best)
+
+    def test_cancelled(self):
+        self.add('Best', 100, 'Hi', delay=0.05)
+        self.add('Worse', 50, wait=True)
+        answer = self.ask(speculate=2)
+        self.assertEqual(answer.spell, 'Best')
+        self.assertTrue(self.deadline('Worse').expired())
+        self.assertFalse(self.deadline('Best').expired())
+        self.join()
+        # The loser did not answer, but was not reported as failing
+        self.assertFalse(self.failed.called)
+
+    def test_state(self):
+        self.add('Best', 100, 'Hi', delay=0.05)
+        self.add('Worse', 50, 'Hey')
+        self.store['Worse'] = {'by': 'someone else'}
+        self.ask(speculate=2)
+        self.join()
+        self.assertEqual(self.store, {
+            'Best': {'by': 'Best'}, 'Worse': {'by': 'someone else'}
+        })
+
+    def test_error(self):
+        self.add('Best', 100, delay=0.05, error=RuntimeError('Bug'))
+        self.add('Worse', 50, wait=True)
+        self.assertRaises(RuntimeError, self.ask, speculate=2)
+        self.assertTrue(self.deadline('Worse').expired())
+
+    def test_worse_error(self):
+        # Raised only if no better spell answered
+        self.add('Best', 100, 'Hi', delay=0.05)
+        self.add('Worse', 50, error=RuntimeError('Bug'))
+        self.assertEqual(self.ask(speculate=2).spell, 'Best')
+
+    def test_batches(self):
+        # The next spells are tried once a whole batch failed
+        self.add('First', 100)
+        self.add('Second', 90)
+        self.add('Third', 80, 'Hi')
+        answer = self.ask(speculate=2)
+        self.assertEqual(answer.spell, 'Third')
+        self.assertEqual([name for name, elapsed in answer.timings],
+                         ['First', 'Second', 'Third'])
+
+
+class Refreshed(AskCase):
+    """
+    Answers past their ``cacheTTL``, but not their ``cacheGrace``, are
+    used and refreshed in the background (see ``lib.wizard._refresh``)
+    """
+
+    def setUp(self):
+        super(Refreshed, self).setUp()
+        self.clock = Clock()
+        patch = mock.patch.object(lib.answercache, 'time', self.clock)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        #: Lets the refreshes through
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.error = None
+        self.calls = []
+        case = self
+
+        def incantation(spell, query, config, state):
+            case.calls.append(query)
+            if len(case.calls) > 1:
+                case.release.wait(5)
+            if case.error is not None:
+                raise case.error
+            return 'Answer %d' % len(case.calls), {'calls': len(case.calls)}
+
+        cls, group = spell(r"weather", name='Weather', cacheTTL=60,
+                           cacheGrace=60, incantation=incantation)
+        self.groups.append(group)
+
+    def ask(self, query='weather', **kwargs):
+        return super(Refreshed, self).ask(query, **kwargs)
+
+    def settle(self):
+        """ Wait for the refreshes to finish """
+        until = time.time() + 5
+        while lib.answercache.CACHE.refreshing and time.time() < until:
+            time.sleep(0.005)
+
+    def test_stale(self):
+        self.assertEqual(self.ask().result, 'Answer 1')
+        self.clock.now += 90
+        # Straight away, while the spell is asked again
+        answer = self.ask()
+        self.assertEqual(answer.result, 'Answer 1')
+        self.assertTrue(answer.elapsed < 1)
+        self.release.set()
+        self.settle()
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.ask().result, 'Answer 2')
+        self.assertEqual(self.store, {'Weather': {'calls': 2}})
+        self.assertEqual(lib.answercache.CACHE.stats()['hits'], 1)
+
+    def test_once(self):
+        self.ask()
+        self.clock.now += 90
+        answers = []
+        threads = [
+            threading.Thread(target=lambda: answers.append(self.ask()))
+            for _ in range(50)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([answer.result for answer in answers],
+                         ['Answer 1'] * 50)
+        self.release.set()
+        self.settle()
+        # Exactly one refresh ran
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(lib.answercache.CACHE.stats()['refreshes'], 1)
+
+    def test_failed(self):
+        self.ask()
+        self.clock.now += 90
+        self.error = IOError('Offline')
+        self.release.set()
+        self.assertEqual(self.ask().result, 'Answer 1')
+        self.settle()
+        self.assertEqual(len(self.calls), 2)
+        # Nobody waited for it, so it is not reported
+        self.assertFalse(self.failed.called)
+        self.assertEqual(self.store, {'Weather': {'calls': 1}})
+        # The next query can try again
+        self.assertEqual(self.ask().result, 'Answer 1')
+        self.settle()
+        self.assertEqual(len(self.calls), 3)
+
+    def test_grace(self):
+        # Too old to be used at all: the spell is asked again, and waited
+        # for
+        self.ask()
+        self.clock.now += 120
+        self.release.set()
+        self.assertEqual(self.ask().result, 'Answer 2')
+        self.assertEqual(lib.answercache.CACHE.stats()['refreshes'], 0)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Measure how the cost of starting up and of finding spells grows with
+the number of spells installed.
+
+Synthetic spells (every tenth one requiring a configuration value that
+is missing, so that it gets disabled) are generated in a temporary
+directory. For each size, a fresh interpreter then discovers them,
+first without and then with the manifest, validates the configuration,
+looks every spell up by name and answers one query.
+
+Usage: python tools/bench_registry.py [--sizes 10,100,1000]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SPELL = '''import lib.spell
+
+
+class Synthetic%(index)d(lib.spell.BaseSpell):
+    """ Synthetic spell number %(index)d """
+    weight = %(weight)d
+    pattern = r"synthetic%(index)d\\s+(.+)"
+    config = %(config)s
+
+    def incantation(self, query, config, state):
+        return query, state
+'''
+
+#: Run in a fresh interpreter, with the spell directory and the number
+#: of spells as arguments; prints the measurements as JSON
+CHILD = '''
+import sys, time, json
+start = time.time()
+import lib.registry, lib.config, lib.dispatch
+root, size = sys.argv[1], int(sys.argv[2])
+result = {'import': time.time() - start}
+
+start = time.time()
+lib.registry.discover(root, entryPoints=None)
+result['discover'] = time.time() - start
+
+start = time.time()
+lib.config.validate({})
+result['validate'] = time.time() - start
+
+start = time.time()
+for index in range(size):
+    assert lib.registry.lookup_by_name(spell='synthetic%d' % index)
+result['lookup'] = (time.time() - start) / size
+
+start = time.time()
+dispatcher = lib.dispatch.Dispatcher(lib.registry.enabled())
+for candidate in dispatcher.candidates('Synthetic1 hello'):
+    candidate.spell.incantation(candidate.query, {}, {})
+    break
+result['query'] = time.time() - start
+result['imported'] = sum(
+    1 for group in lib.registry.all() if group['spell'] is not None
+)
+print(json.dumps(result))
+'''
+
+
+def generate(root, size):
+    """
+    Write `size` synthetic spells under `root`
+
+    :type root: str
+    :param root: The spell directory
+
+    :type size: int
+    :param size: How many spells to generate
+    """
+    os.makedirs(root)
+    open(os.path.join(root, '__init__.py'), 'w').close()
+    for index in range(size):
+        directory = os.path.join(root, 'synthetic%d' % index)
+        os.makedirs(directory)
+        open(os.path.join(directory, '__init__.py'), 'w').close()
+        with open(os.path.join(directory, 'spell.py'), 'w') as f:
+            f.write(SPELL % {
+                'index': index,
+                'weight': index % 100,
+                'config': index % 10 == 9 and (
+                    "{'Synthetic.Key%d': str}" % index
+                ) or '{}'
+            })
+
+
+def measure(root, size):
+    """
+    :returns: The measurements of a fresh interpreter (see ``CHILD``)
+    :rtype: dict
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD, root, str(size)],
+        cwd=ROOT, universal_newlines=True
+    )
+    return json.loads(output.splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help='Comma separated numbers of spells')
+    args = parser.parse_args()
+
+    print('%6s %-9s %9s %9s %9s %10s %9s %9s' % (
+        'spells', 'manifest', 'import', 'discover', 'validate',
+        'lookup', 'query', 'imported'
+    ))
+    temp = tempfile.mkdtemp()
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            root = os.path.join(temp, 'spells%d' % size)
+            generate(root, size)
+            for manifest in ('rebuilt', 'used'):
+                result = measure(root, size)
+                print('%6d %-9s %7.1fms %7.1fms %7.1fms %8.2fus %7.1fms %9d' % (
+                    size, manifest,
+                    result['import'] * 1000,
+                    result['discover'] * 1000,
+                    result['validate'] * 1000,
+                    result['lookup'] * 1000000,
+                    result['query'] * 1000,
+                    result['imported']
+                ))
+    finally:
+        shutil.rmtree(temp)
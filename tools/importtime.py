@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Check that starting up to answer a query stays cheap.
+
+``troz.py "QUERY"`` is run in a fresh interpreter, a few times, up to the
+point where the spells are asked: the modules are imported, the daemon is
+tried (see ``lib.daemon.forward``), the spells are found (see
+``lib.registry.discover``) and the configuration is loaded. The check
+fails if the (median) time it takes is over budget, or if any of the
+heavy modules that only some queries need are imported up front.
+
+It only relies on the wall clock, so it works with every version of
+Python (unlike ``python -X importtime``, 3.7+). The time it takes the
+interpreter itself to start, which depends on the machine much more than
+on Troz, is measured in the same way and taken off: only what Troz adds
+counts against the budget.
+
+Usage: python tools/importtime.py [--budget MILLISECONDS] [--runs N]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: Modules that must not be imported on the query path. They are
+#: imported on first use instead
+HEAVY = (
+    'requests', 'urllib3', 'mock', 'unittest', 'unittest2',
+    'dateutil', 'xml.etree', 'inspect', 'lib.test'
+)
+
+#: Run in a fresh interpreter, with the query and the address of a daemon
+#: that is not running as arguments. Runs ``troz.py`` as a script until it
+#: asks the spells, then prints (on its last line) when that was and the
+#: modules imported. Without a ``settings.conf``, the template is loaded
+CHILD = '''
+import os, sys, json, time
+import lib.config, lib.wizard
+
+load = lib.config.load
+lib.config.load = lambda path: load(
+    os.path.exists(path) and path or path + '.tmpl'
+)
+
+def ask(self, query):
+    sys.stdout.write('\\n' + json.dumps({
+        'asked': time.time(), 'modules': sorted(sys.modules)
+    }))
+    sys.stdout.flush()
+    os._exit(0)
+lib.wizard.Wizard.ask = ask
+
+sys.argv = ['troz.py', sys.argv[1], '--socket', sys.argv[2]]
+with open('troz.py') as f:
+    code = compile(f.read(), 'troz.py', 'exec')
+exec(code, {'__name__': '__main__', '__file__': 'troz.py'})
+raise RuntimeError('troz.py exited without asking the spells')
+'''
+
+#: Run in a fresh interpreter, to time its start up alone (see ``CHILD``)
+BASELINE = '''
+import sys, json, time
+sys.stdout.write('\\n' + json.dumps({
+    'asked': time.time(), 'modules': sorted(sys.modules)
+}))
+'''
+
+
+def measure(query='What is the weather like?', code=CHILD):
+    """
+    Start ``troz.py "QUERY"`` in a fresh interpreter
+
+    :type query: str
+    :param query: The query
+
+    :type code: str
+    :param code: What the interpreter runs; ``BASELINE`` to time its
+        start up alone
+
+    :returns: How long it took to get to asking the spells, in
+        milliseconds, and the names of all the modules imported by then
+    :rtype: ``tuple(float, list)``
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        process = subprocess.Popen(
+            [sys.executable, '-c', code, query,
+             os.path.join(directory, 'troz.sock')],
+            cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        output, errors = process.communicate()
+    finally:
+        os.rmdir(directory)
+    try:
+        result = json.loads(output.splitlines()[-1])
+    except (ValueError, IndexError):
+        raise RuntimeError('Unable to start troz.py:\n%s%s' % (output, errors))
+    return (result['asked'] - start) * 1000, result['modules']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--budget', type=float, default=150,
+                        help='Maximum start up time, in milliseconds, on '
+                             'top of the interpreter\'s')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='How many times to measure')
+    args = parser.parse_args()
+
+    measure()  # Brings the manifest of the spells up to date
+    times, baselines = [], []
+    for _ in range(args.runs):
+        # In turns, so that both see the machine equally busy
+        baselines.append(measure(code=BASELINE)[0])
+        elapsed, imported = measure()
+        times.append(elapsed)
+    baseline = sorted(baselines)[len(baselines) // 2]
+    elapsed = sorted(times)[len(times) // 2] - baseline
+
+    errors = []
+    heavy = sorted(set(
+        prefix for name in imported
+        for prefix in HEAVY
+        if name == prefix or name.startswith(prefix + '.')
+    ))
+    if heavy:
+        errors.append('Heavy modules imported: %s' % ', '.join(heavy))
+    if elapsed > args.budget:
+        errors.append(
+            'Start up time of %.1fms is over the budget of %.1fms'
+            % (elapsed, args.budget)
+        )
+
+    print('Start up time: %.1fms (budget: %.1fms), on top of the '
+          '%.1fms the interpreter takes' % (elapsed, args.budget, baseline))
+    for error in errors:
+        print(error)
+    sys.exit(len(errors))
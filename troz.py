@@ -1,45 +1,31 @@
 import os
 import sys
-import json
 import argparse
 import textwrap
 
-if sys.version_info[:2] <= (2, 6):
-    import unittest2 as unittest
-else:
-    import unittest
-
 import spells
 import lib.registry
 import lib.config
 import lib.spell
-import lib.test
+import lib.dispatch
+import lib.store
+import lib.wizard
 
 
-def ask(query, spell_objs, config, save):
-    score = None
-    spell = None
-    result = None
-    canidates = (spell.parse(query) for spell in spell_objs)
-    for score, spell, query in sorted(canidates, reverse=True):
-            state = save.get(spell.__class__.__name__)
-            result, state = spell.incantation(query, config, state)
-            if result is None:
-                print('Warning: %s failed' % spell)
-            else:
-                save[spell.__class__.__name__] = state
-                break
-    return score, spell, result
+def ask(query, dispatcher, config, save):
+    # Kept for backwards compatibility, see lib.wizard.Wizard
+    answer = lib.wizard.ask(query, dispatcher, config, save)
+    return answer.score, answer.spell, answer.result
 
 
 def get_spells():
     yield 'The following spells are currently installed:'
-    for spell in sorted(lib.registry.all(), key=lambda item: item['spell']):
+    for spell in sorted(lib.registry.all(), key=lambda item: item['name']):
         yield (
             '    * %s%s -- %s' % (
                 not spell['enabled'] and '[needs config] ' or '',
-                spell['spell'].__name__,
-                spell['spell'].__doc__
+                spell['name'],
+                spell['doc']
             )
         )
 
@@ -62,10 +48,16 @@ def get_spell_info(spell, width=70):
     else:
         yield '  * Required configs: None'
 
+    if spellDict.get('risks'):
+        yield textwrap.fill(
+            '  * Slow pattern: %s' % ', '.join(spellDict['risks']),
+            width=width, subsequent_indent=' ' * 4
+        )
+
     if spellDict['test']:
         queries = spellDict['test'].collectQueries()
         yield '  * Example usage:'
-        for query, result in queries.iteritems():
+        for query, result in queries.items():
             yield textwrap.fill(
                 '      >>> %s' % query,
                 width=width, subsequent_indent=' ' * 10
@@ -88,45 +80,126 @@ if __name__ == "__main__":
                        help='Get detailed information a specific spell')
     group.add_argument('--test', action='store_const', const=True,
                        help='Run test suite')
+    group.add_argument('--serve', action='store_const', const=True,
+                       help='Keep running, answering queries sent to --socket')
+    group.add_argument('--stats', action='store_const', const=True,
+                       help='Show the statistics of the running daemon')
+    group.add_argument('--batch', metavar='FILE',
+                       help='Answer the JSON-lines queries in FILE (or - for '
+                            'stdin), writing JSON-lines answers to stdout')
     parser.add_argument('--capture', action='store_const', const=True,
                         help='Output debugging info and save fetched queries to disk')
+    parser.add_argument('--socket', metavar='ADDRESS', default=None,
+                        help='Unix socket path (or host:port) of the daemon')
+    parser.add_argument('--jobs', metavar='N', type=int, default=8,
+                        help='How many --batch queries to answer at a time')
+    parser.add_argument('--deadline', metavar='SECONDS', type=float,
+                        default=None,
+                        help='How long a query can take (default: '
+                             'Query.Deadline in settings.conf, 0 for no limit)')
+    parser.add_argument('--speculate', metavar='K', type=int, default=None,
+                        help='How many spells to try at the same time '
+                             '(default: Query.Speculate in settings.conf, or 1)')
 
     args = parser.parse_args()
-    lib.registry.collect()
+
+    if args.query and not args.capture:
+        # Let the daemon answer, if one is running and answers in time
+        import lib.daemon
+        import lib.deadline
+        request = {'query': args.query}
+        for name, cast in lib.daemon.OPTIONS:
+            if getattr(args, name) is not None:
+                request[name] = getattr(args, name)
+        deadline = request.get('deadline', lib.deadline.DEFAULT)
+        try:
+            response = lib.daemon.forward(
+                request, args.socket or lib.daemon.ADDRESS,
+                timeout=deadline and deadline + lib.daemon.MARGIN or None
+            )
+        except (IOError, OSError):
+            pass
+        else:
+            if 'error' in response:
+                parser.exit(1, 'Error: %s\n' % response['error'])
+            print(response['result'])
+            parser.exit()
+
+    if args.stats:
+        import json
+        import lib.daemon
+        try:
+            response = lib.daemon.forward(
+                {'stats': True}, args.socket or lib.daemon.ADDRESS
+            )
+        except (IOError, OSError) as e:
+            parser.exit(1, 'Error: %s\n' % e)
+        print(json.dumps(response, indent=2, sort_keys=True))
+        parser.exit('error' in response and 1 or 0)
+
+    if args.test or args.doInfo:
+        lib.registry.collect()
+    else:
+        lib.registry.discover()
 
     if args.doList:
         parser.exit('\n'.join(get_spells()))
     elif args.doInfo:
         parser.exit('\n'.join(get_spell_info(args.doInfo)))
     elif args.test:
+        if sys.version_info[:2] <= (2, 6):
+            import unittest2 as unittest
+        else:
+            import unittest
+
         loader = unittest.TestLoader()
         suite = unittest.TestSuite()
         suite.addTests(
             loader.loadTestsFromTestCase(item['test'])
             for item in lib.registry.all() if item['test']
         )
+        # The tests of the library itself, under tests/
+        root = os.path.dirname(os.path.abspath(__file__))
+        suite.addTests(loader.discover(
+            os.path.join(root, 'tests'), top_level_dir=root
+        ))
         testRunner = unittest.runner.TextTestRunner(verbosity=2)
         result = testRunner.run(suite)
-        parser.exit(len(result.errors))
-    elif not args.query:
+        parser.exit(len(result.errors) + len(result.failures))
+    elif not (args.query or args.serve or args.batch):
         parser.print_help()
         parser.exit()
 
-    config = lib.config.load('settings.conf')
-
-    spell_objs = [item['spell']() for item in lib.registry.enabled()]
-
-    if os.path.exists('save.db'):
-        with open('save.db') as f:
-            save = json.load(f)
-    else:
-        save = {}
+    # Opening connections ahead of time only pays off for many queries
+    wizard = lib.wizard.Wizard(
+        'settings.conf', lib.store.JSONStore('save.db'),
+        warm=bool(args.serve or args.batch), deadline=args.deadline,
+        speculate=args.speculate, prefetch=bool(args.serve)
+    )
 
-    if args.capture:
+    if args.serve:
+        import lib.daemon
+        lib.daemon.serve(
+            lambda query, **options: wizard.ask(query, **options)._asdict(),
+            address=args.socket or lib.daemon.ADDRESS,
+            flush=wizard.flush,
+            stats=wizard.stats
+        )
+        parser.exit()
+    elif args.batch:
+        import lib.batch
+        if args.batch == '-':
+            failed = lib.batch.run(wizard.ask, sys.stdin, sys.stdout, args.jobs)
+        else:
+            with open(args.batch) as lines:
+                failed = lib.batch.run(wizard.ask, lines, sys.stdout, args.jobs)
+        if failed:
+            sys.stderr.write('%d queries could not be answered\n' % failed)
+    elif args.capture:
+        import lib.test
         with lib.test.WebCapture():
-            print(ask(args.query, spell_objs, config, save)[-1])
+            print(wizard.ask(args.query).result)
     else:
-        print(ask(args.query, spell_objs, config, save)[-1])
+        print(wizard.ask(args.query).result)
 
-    with open('save.db', 'w') as f:
-        json.dump(save, f)
+    wizard.flush()